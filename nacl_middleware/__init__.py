@@ -1,2 +1,3 @@
+from nacl_middleware.cache import KeyCache
 from nacl_middleware.nacl_middleware import nacl_middleware
 from nacl_middleware.nacl_utils import MailBox, Nacl
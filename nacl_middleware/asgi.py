@@ -0,0 +1,250 @@
+"""ASGI adapter of the middleware, for ASGI servers and frameworks."""
+
+from collections.abc import Awaitable, Callable, MutableMapping
+from logging import getLogger
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from aiohttp import WSCloseCode
+from nacl.public import PrivateKey
+
+from nacl_middleware.cache import KeyCache
+from nacl_middleware.deadline import DEADLINE_HEADER, DeadlineExceeded, DeadlinePolicy
+from nacl_middleware.engine import NaclEngine
+from nacl_middleware.sketch import HeavyHitters
+from nacl_middleware.tracing import Tracer
+from nacl_middleware.utils import get_parameters
+
+Scope = MutableMapping[str, any]
+Message = MutableMapping[str, any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+_form_content_type = b"application/x-www-form-urlencoded"
+_deadline_header = DEADLINE_HEADER.lower().encode()
+
+
+class BodyTooLarge(Exception):
+    """Raised when a form body exceeds the size limit."""
+
+
+def _header(scope: Scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope.get("headers", ()):
+        if key.lower() == name:
+            return value
+    return None
+
+
+async def _read_body(
+    receive: Receive, max_size: Optional[int] = None
+) -> Tuple[bytes, List[Message]]:
+    """Reads a whole request body, also returning its messages to replay them."""
+    messages = []
+    body = bytearray()
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            break
+        body += message.get("body", b"")
+        if max_size is not None and len(body) > max_size:
+            raise BodyTooLarge(f"Body exceeds the limit of {max_size} bytes!")
+        if not message.get("more_body", False):
+            break
+    return bytes(body), messages
+
+
+def _replay(messages: List[Message], receive: Receive) -> Receive:
+    """Returns a receive callable giving the messages back before the next ones."""
+    messages = list(messages)
+
+    async def replayed_receive() -> Message:
+        if messages:
+            return messages.pop(0)
+        return await receive()
+
+    return replayed_receive
+
+
+class NaclASGIMiddleware:
+    """
+    ASGI middleware decrypting the requests of an ASGI application.
+
+    It runs the same NaclEngine as nacl_middleware. HTTP requests and WebSocket
+    connections carry the publicKey and encryptedMessage parameters in their query
+    string, or HTTP requests in a form encoded body. The MailBox and the decrypted
+    message are stored in the scope state, as scope["state"]["mail_box"] and
+    scope["state"]["decrypted_message"], which frameworks such as Starlette expose as
+    request.state.
+
+    Requests without a valid message are always rejected: HTTP requests with a 401
+    response, and WebSockets are accepted and closed with a protocol error, as the
+    aiohttp adapter does for handlers annotated to return a WebSocketResponse. Requests
+    whose deadline has passed get a 503 response, or a try again later close. With a
+    message_type, messages that do not match it get a 400 response. Form bodies are
+    read up to max_body_size, and larger ones get a 413 response as soon as the limit
+    is passed.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        private_key: Optional[PrivateKey] = None,
+        exclude_routes: Tuple = tuple(),
+        exclude_methods: Tuple = tuple(),
+        log=getLogger(),
+        max_ciphertext_size: Optional[int] = None,
+        max_plaintext_size: Optional[int] = None,
+        key_cache: Optional[KeyCache] = None,
+        tracer: Optional[Tracer] = None,
+        engine: Optional[NaclEngine] = None,
+        deadlines: Optional[DeadlinePolicy] = None,
+        heavy_hitters: Optional[HeavyHitters] = None,
+        message_type: Optional[type] = None,
+        max_body_size: Optional[int] = 1024**2,
+    ) -> None:
+        """
+        Wraps an ASGI application. The arguments are the ones of nacl_middleware.
+
+        Args:
+            app (ASGIApp): The ASGI application.
+            private_key (Optional[PrivateKey], optional): The private key used for decryption. Required unless engine is given.
+            exclude_routes (Tuple, optional): Tuple of routes to exclude from encryption/decryption. Defaults to an empty tuple.
+            exclude_methods (Tuple, optional): Tuple of HTTP methods to exclude from encryption/decryption. Defaults to an empty tuple.
+            log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+            max_ciphertext_size (Optional[int], optional): Maximum length of the encoded encryptedMessage. Defaults to no limit.
+            max_plaintext_size (Optional[int], optional): Maximum size in bytes of the decrypted message. Defaults to no limit.
+            key_cache (Optional[KeyCache], optional): Cache of the shared keys, built with the same private key. Defaults to an in-memory KeyCache.
+            tracer (Optional[Tracer], optional): Receives a span for each stage of a request. Defaults to a NoopTracer.
+            engine (Optional[NaclEngine], optional): An engine to use instead of building one from the other arguments. Defaults to None.
+            deadlines (Optional[DeadlinePolicy], optional): Shed the requests whose deadline has passed. Defaults to None.
+            heavy_hitters (Optional[HeavyHitters], optional): Count the requests and encrypted bytes per client public key, once their message is authenticated. Defaults to None.
+            message_type (Optional[type], optional): Decode the messages into a dataclass, a TypedDict or a msgspec Struct. Defaults to plain JSON.
+            max_body_size (Optional[int], optional): Maximum size in bytes of a form body, as aiohttp's client_max_size. Defaults to 1 MiB.
+        """
+        if engine is None:
+            if private_key is None:
+                raise ValueError("Either private_key or engine is required!")
+            engine = NaclEngine(
+                private_key,
+                exclude_routes,
+                exclude_methods,
+                log,
+                max_ciphertext_size,
+                max_plaintext_size,
+                key_cache,
+                tracer,
+                deadlines=deadlines,
+                heavy_hitters=heavy_hitters,
+                message_type=message_type,
+            )
+        self.app = app
+        self.engine = engine
+        self.max_body_size = max_body_size
+        self._log = log
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        method = scope.get("method", "GET")
+        if self.engine.is_excluded(method, scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        replayed: List[Message] = []
+
+        async def get_encrypted_parameters() -> Tuple[str, str]:
+            parameters = dict(parse_qsl(scope.get("query_string", b"").decode()))
+            if (
+                "encryptedMessage" not in parameters
+                and scope["type"] == "http"
+                and (_header(scope, b"content-type") or b"").split(b";")[0].strip()
+                == _form_content_type
+            ):
+                limit = self.max_body_size
+                length = _header(scope, b"content-length")
+                if limit is not None and length is not None and int(length) > limit:
+                    raise BodyTooLarge(f"Body exceeds the limit of {limit} bytes!")
+                body, messages = await _read_body(receive, limit)
+                replayed.extend(messages)
+                parameters = dict(parse_qsl(body.decode()))
+            return get_parameters(parameters)
+
+        tracer = self.engine.tracer
+        with tracer.span("nacl.request") as request_span:
+            request_span.set_attribute("http.method", method)
+            request_span.set_attribute("http.target", scope["path"])
+            try:
+                hint = _header(scope, _deadline_header)
+                decrypted_message, mail_box = await self.engine.open(
+                    get_encrypted_parameters,
+                    hint.decode("latin-1") if hint is not None else None,
+                )
+            except DeadlineExceeded:
+                request_span.set_attribute("nacl.shed", True)
+                reason = "Request deadline has passed!"
+                if scope["type"] == "http":
+                    await self._reject_http(reason, send, 503)
+                else:
+                    await self._close_websocket(
+                        reason, receive, send, WSCloseCode.TRY_AGAIN_LATER
+                    )
+                return
+            except BodyTooLarge as e:
+                request_span.set_attribute("nacl.rejected", True)
+                await self._reject_http(str(e), send, 413)
+                return
+            except Exception:
+                request_span.set_attribute("nacl.rejected", True)
+                rejection = self.engine.reject()
+                if scope["type"] == "http":
+                    await self._reject_http(rejection.reason, send, rejection.status)
+                else:
+                    await self._close_websocket(
+                        rejection.reason, receive, send, WSCloseCode.PROTOCOL_ERROR
+                    )
+                return
+
+            scope = dict(scope)
+            scope["state"] = {
+                **scope.get("state", {}),
+                "mail_box": mail_box,
+                "decrypted_message": decrypted_message,
+            }
+            if replayed:
+                receive = _replay(replayed, receive)
+            with tracer.span("nacl.handler"):
+                await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _reject_http(reason: str, send: Send, status: int = 401) -> None:
+        body = f"{status}: {reason}".encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def _close_websocket(
+        reason: str, receive: Receive, send: Send, code: WSCloseCode
+    ) -> None:
+        message = await receive()
+        if message["type"] != "websocket.connect":
+            return
+        await send({"type": "websocket.accept"})
+        await send(
+            {
+                "type": "websocket.close",
+                "code": code,
+                "reason": reason,
+            }
+        )
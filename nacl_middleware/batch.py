@@ -0,0 +1,281 @@
+"""Parallel bulk decryption and encryption of archived messages.
+
+``nacl-middleware-batch`` streams a JSONL or binary archive, fans chunks of records
+out to a process pool and writes the results in input order. Memory stays bounded by
+the chunk size times the number of chunks in flight.
+
+JSONL records are objects with a ``publicKey`` and an ``encryptedMessage`` to
+decrypt, or a ``message`` to encrypt. Other fields are kept. Decrypted records carry
+a ``decryptedMessage``, and records failing carry an ``error`` instead.
+
+Binary records are the 32 bytes raw client public key, a 4 bytes big endian length
+and as many bytes of payload: the raw nonce and ciphertext, or the JSON plaintext.
+A record failing is written with its public key and an empty payload, which no valid
+output record has, so output records stay aligned with the input.
+"""
+
+from argparse import ArgumentParser, Namespace
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from json import dumps, loads
+from os import cpu_count
+from struct import Struct
+from sys import stderr, stdin, stdout
+from typing import BinaryIO, Deque, Iterator, List, Optional, Sequence, Tuple
+
+from nacl.bindings import (
+    crypto_box_easy_afternm,
+    crypto_box_NONCEBYTES,
+    crypto_box_open_easy_afternm,
+    crypto_box_PUBLICKEYBYTES,
+)
+from nacl.encoding import HexEncoder
+from nacl.public import PrivateKey
+from nacl.utils import random
+
+from nacl_middleware.nacl_utils import MailBox
+
+MODES = ("decrypt", "encrypt")
+FORMATS = ("jsonl", "binary")
+
+_length = Struct(">I")
+_header_size = crypto_box_PUBLICKEYBYTES + _length.size
+
+_private_key: Optional[PrivateKey] = None
+_mail_boxes: "OrderedDict[bytes, MailBox]" = OrderedDict()
+_max_mail_boxes = 4096
+
+
+def _init_worker(private_key: bytes) -> None:
+    global _private_key
+    _private_key = PrivateKey(private_key)
+    _mail_boxes.clear()
+
+
+def _mail_box(public_key: bytes) -> MailBox:
+    """Returns the MailBox of a raw client public key, kept in a per process LRU."""
+    mail_box = _mail_boxes.get(public_key)
+    if mail_box is None:
+        mail_box = MailBox(_private_key, public_key.hex())
+        _mail_boxes[public_key] = mail_box
+        if len(_mail_boxes) > _max_mail_boxes:
+            _mail_boxes.popitem(last=False)
+    else:
+        _mail_boxes.move_to_end(public_key)
+    return mail_box
+
+
+def _process_jsonl(mode: str, line: bytes) -> Tuple[bytes, bool]:
+    record = {}
+    try:
+        record = loads(line)
+        mail_box = _mail_box(bytes.fromhex(record["publicKey"]))
+        if mode == "decrypt":
+            record["decryptedMessage"] = mail_box.unbox(record["encryptedMessage"])
+            del record["encryptedMessage"]
+        else:
+            record["encryptedMessage"] = mail_box.box(record["message"])
+            del record["message"]
+        ok = True
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        ok = False
+    return dumps(record).encode() + b"\n", ok
+
+
+def _process_binary(mode: str, record: bytes) -> Tuple[bytes, bool]:
+    public_key = record[:crypto_box_PUBLICKEYBYTES]
+    payload = record[_header_size:]
+    try:
+        shared_key = _mail_box(public_key).shared_key()
+        if mode == "decrypt":
+            result = crypto_box_open_easy_afternm(
+                payload[crypto_box_NONCEBYTES:],
+                payload[:crypto_box_NONCEBYTES],
+                shared_key,
+            )
+        else:
+            nonce = random(crypto_box_NONCEBYTES)
+            result = nonce + crypto_box_easy_afternm(payload, nonce, shared_key)
+    except Exception:
+        return public_key + _length.pack(0), False
+    return public_key + _length.pack(len(result)) + result, True
+
+
+def process_chunk(
+    mode: str, archive_format: str, records: List[bytes]
+) -> Tuple[bytes, int]:
+    """
+    Processes a chunk of records in a worker process.
+
+    Records of the same client share one MailBox, kept across chunks.
+
+    Args:
+        mode (str): "decrypt" or "encrypt".
+        archive_format (str): "jsonl" or "binary".
+        records (List[bytes]): The records.
+
+    Returns:
+        Tuple[bytes, int]: The output of the chunk and the number of records that failed.
+    """
+    process = _process_jsonl if archive_format == "jsonl" else _process_binary
+    output = bytearray()
+    failed = 0
+    for record in records:
+        result, ok = process(mode, record)
+        output += result
+        failed += not ok
+    return bytes(output), failed
+
+
+def read_records(source: BinaryIO, archive_format: str) -> Iterator[bytes]:
+    """
+    Streams the records of an archive.
+
+    Args:
+        source (BinaryIO): The archive.
+        archive_format (str): "jsonl" or "binary".
+
+    Yields:
+        bytes: The records.
+
+    Raises:
+        ValueError: If a binary archive is truncated.
+    """
+    if archive_format == "jsonl":
+        for line in source:
+            if line.strip():
+                yield line
+        return
+    while True:
+        header = source.read(_header_size)
+        if not header:
+            return
+        if len(header) < _header_size:
+            raise ValueError("Truncated record header!")
+        (length,) = _length.unpack_from(header, crypto_box_PUBLICKEYBYTES)
+        payload = source.read(length)
+        if len(payload) < length:
+            raise ValueError("Truncated record payload!")
+        yield header + payload
+
+
+def _chunks(records: Iterator[bytes], chunk_size: int) -> Iterator[List[bytes]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def process_archive(
+    source: BinaryIO,
+    destination: BinaryIO,
+    private_key: PrivateKey,
+    mode: str = "decrypt",
+    archive_format: str = "jsonl",
+    workers: Optional[int] = None,
+    chunk_size: int = 1024,
+    max_in_flight: Optional[int] = None,
+) -> dict:
+    """
+    Decrypts or encrypts an archive with a process pool, writing the output in order.
+
+    Args:
+        source (BinaryIO): The input archive.
+        destination (BinaryIO): The output archive.
+        private_key (PrivateKey): The server private key.
+        mode (str, optional): "decrypt" or "encrypt". Defaults to "decrypt".
+        archive_format (str, optional): "jsonl" or "binary". Defaults to "jsonl".
+        workers (Optional[int], optional): Number of worker processes. Defaults to the number of CPUs.
+        chunk_size (int, optional): Number of records sent to a worker at once. Defaults to 1024.
+        max_in_flight (Optional[int], optional): Maximum number of chunks submitted and not written yet. Defaults to twice the number of workers.
+
+    Returns:
+        dict: The number of records processed and of records that failed.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode}!")
+    if archive_format not in FORMATS:
+        raise ValueError(f"Unknown format {archive_format}!")
+    workers = workers or cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    report = {"records": 0, "failed": 0}
+    pending: Deque[Tuple[Future, int]] = deque()
+
+    def write_oldest() -> None:
+        future, size = pending.popleft()
+        output, failed = future.result()
+        destination.write(output)
+        report["records"] += size
+        report["failed"] += failed
+
+    with ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(bytes(private_key),)
+    ) as executor:
+        for chunk in _chunks(read_records(source, archive_format), chunk_size):
+            if len(pending) >= max_in_flight:
+                write_oldest()
+            future = executor.submit(process_chunk, mode, archive_format, chunk)
+            pending.append((future, len(chunk)))
+        while pending:
+            write_oldest()
+    destination.flush()
+    return report
+
+
+def parse_arguments(argv: Optional[Sequence[str]] = None) -> Namespace:
+    """Parses the command line arguments."""
+    parser = ArgumentParser(
+        prog="nacl-middleware-batch",
+        description="Decrypt or encrypt an archive of messages on every core.",
+    )
+    parser.add_argument("mode", choices=MODES)
+    parser.add_argument("input", help="Input archive, - for stdin.")
+    parser.add_argument("output", help="Output archive, - for stdout.")
+    parser.add_argument(
+        "--private-key-file",
+        required=True,
+        help="File holding the hex encoded server private key.",
+    )
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--max-in-flight", type=int)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Entry point of nacl-middleware-batch."""
+    arguments = parse_arguments(argv)
+    with open(arguments.private_key_file, "rb") as file:
+        private_key = PrivateKey(file.read().strip(), HexEncoder)
+    source = stdin.buffer if arguments.input == "-" else open(arguments.input, "rb")
+    destination = (
+        stdout.buffer if arguments.output == "-" else open(arguments.output, "wb")
+    )
+    try:
+        report = process_archive(
+            source,
+            destination,
+            private_key,
+            arguments.mode,
+            arguments.format,
+            arguments.workers,
+            arguments.chunk_size,
+            arguments.max_in_flight,
+        )
+    finally:
+        for file in (source, destination):
+            if file not in (stdin.buffer, stdout.buffer):
+                file.close()
+    print(f"{report['records']} records, {report['failed']} failed", file=stderr)
+    if report["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
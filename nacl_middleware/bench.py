@@ -0,0 +1,577 @@
+"""Load testing command line tool.
+
+``nacl-middleware-bench`` drives an encrypted endpoint with concurrent clients and
+reports throughput, latency percentiles, CPU per request and key cache hit rates.
+Without ``--url`` it starts its own target application in a child process.
+"""
+
+from argparse import ArgumentParser, Namespace
+from asyncio import Event, create_task, gather, run, sleep
+from importlib.util import find_spec
+from json import dumps
+from math import ceil
+from multiprocessing import Process, Queue
+from os import getpid
+from random import random
+from time import perf_counter, process_time
+from typing import List, Optional, Sequence, Tuple
+
+from aiohttp import ClientSession, TCPConnector, WSMsgType
+from aiohttp.web import (
+    Application,
+    AppRunner,
+    Request,
+    Response,
+    TCPSite,
+    WebSocketResponse,
+    json_response,
+)
+from nacl.encoding import HexEncoder
+from nacl.public import PrivateKey
+
+from nacl_middleware.asgi import ASGIApp, NaclASGIMiddleware, Receive, Scope, Send
+from nacl_middleware.cache import KeyCache, MemoryCache
+from nacl_middleware.nacl_middleware import nacl_middleware
+from nacl_middleware.nacl_utils import MailBox, Nacl
+
+TRANSPORTS = ("query", "body", "websocket")
+STACKS = ("aiohttp", "asgi")
+BENCH_PATH = "/bench"
+WEBSOCKET_PATH = "/bench/websocket"
+STATS_PATH = "/bench/stats"
+
+
+def make_bench_app(private_key: PrivateKey, key_cache: KeyCache) -> Application:
+    """
+    Builds the target application: encrypted echo routes and an excluded stats route.
+
+    Args:
+        private_key (PrivateKey): The server private key.
+        key_cache (KeyCache): The key cache used by the middleware.
+
+    Returns:
+        Application: The application.
+    """
+
+    async def echo(request: Request) -> Response:
+        mail_box: MailBox = request["mail_box"]
+        return Response(text=mail_box.box(request["decrypted_message"]))
+
+    async def websocket(request: Request) -> WebSocketResponse:
+        mail_box: MailBox = request["mail_box"]
+        socket = WebSocketResponse()
+        await socket.prepare(request)
+        async for message in socket:
+            if message.type == WSMsgType.TEXT:
+                await socket.send_str(mail_box.box(mail_box.unbox(message.data)))
+        return socket
+
+    async def stats(request: Request) -> Response:
+        return json_response(
+            {"pid": getpid(), "process_time": process_time(), **key_cache.stats()}
+        )
+
+    app = Application(
+        middlewares=[
+            nacl_middleware(
+                private_key, exclude_routes=(STATS_PATH,), key_cache=key_cache
+            )
+        ]
+    )
+    app.router.add_get(BENCH_PATH, echo)
+    app.router.add_post(BENCH_PATH, echo)
+    app.router.add_get(WEBSOCKET_PATH, websocket)
+    app.router.add_get(STATS_PATH, stats)
+    return app
+
+
+def make_bench_asgi_app(private_key: PrivateKey, key_cache: KeyCache) -> ASGIApp:
+    """
+    Builds the ASGI target application, with the routes of make_bench_app.
+
+    Args:
+        private_key (PrivateKey): The server private key.
+        key_cache (KeyCache): The key cache used by the middleware.
+
+    Returns:
+        ASGIApp: The application, wrapped in NaclASGIMiddleware.
+    """
+
+    async def respond(send: Send, status: int, body: bytes, content_type: bytes):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", content_type),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                await send({"type": message["type"] + ".complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+        path = scope["path"]
+        if path == STATS_PATH:
+            stats = {"pid": getpid(), "process_time": process_time()}
+            stats.update(key_cache.stats())
+            await respond(send, 200, dumps(stats).encode(), b"application/json")
+        elif scope["type"] == "http" and path == BENCH_PATH:
+            state = scope["state"]
+            text = state["mail_box"].box(state["decrypted_message"])
+            await respond(send, 200, text.encode(), b"text/plain; charset=utf-8")
+        elif scope["type"] == "websocket" and path == WEBSOCKET_PATH:
+            mail_box: MailBox = scope["state"]["mail_box"]
+            await receive()
+            await send({"type": "websocket.accept"})
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("text") is not None:
+                    reply = mail_box.box(mail_box.unbox(message["text"]))
+                    await send({"type": "websocket.send", "text": reply})
+        elif scope["type"] == "http":
+            await respond(send, 404, b"Not Found", b"text/plain")
+
+    return NaclASGIMiddleware(
+        app, private_key, exclude_routes=(STATS_PATH,), key_cache=key_cache
+    )
+
+
+async def _serve_asgi(
+    private_key: PrivateKey, key_cache: KeyCache, host: str, ready: Queue
+) -> None:
+    from uvicorn import Config, Server
+
+    config = Config(
+        make_bench_asgi_app(private_key, key_cache),
+        host=host,
+        port=0,
+        access_log=False,
+        log_level="warning",
+    )
+    server = Server(config)
+    task = create_task(server.serve())
+    while not server.started:
+        await sleep(0.01)
+    ready.put(server.servers[0].sockets[0].getsockname()[1])
+    await task
+
+
+def _serve(
+    hex_private_key: str,
+    host: str,
+    cache_size: Optional[int],
+    offload: bool,
+    ready: Queue,
+    stack: str = "aiohttp",
+) -> None:
+    """Runs the target application until terminated, reporting its port on ready."""
+    private_key = PrivateKey(hex_private_key, HexEncoder)
+    key_cache = KeyCache(private_key, MemoryCache(cache_size), offload=offload)
+    if stack == "asgi":
+        run(_serve_asgi(private_key, key_cache, host, ready))
+        return
+
+    async def main() -> None:
+        runner = AppRunner(make_bench_app(private_key, key_cache), access_log=None)
+        await runner.setup()
+        site = TCPSite(runner, host, 0)
+        await site.start()
+        ready.put(runner.addresses[0][1])
+        # Serve until the parent terminates the process.
+        await Event().wait()
+
+    run(main())
+
+
+def percentile(sorted_values: Sequence[float], percent: float) -> float:
+    """
+    Returns the nearest-rank percentile of already sorted values.
+
+    Args:
+        sorted_values (Sequence[float]): The values, sorted.
+        percent (float): The percentile, between 0 and 100.
+
+    Returns:
+        float: The percentile, or 0.0 when there are no values.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class LoadClient:
+    """
+    One simulated client sending encrypted requests in a loop.
+
+    With a churn rate above zero, a fresh key pair replaces the current one before a
+    request with that probability. WebSocket clients reconnect with the new key.
+    """
+
+    def __init__(
+        self,
+        session: ClientSession,
+        url: str,
+        server_hex_public_key: str,
+        transport: str,
+        message: str,
+        churn: float,
+    ) -> None:
+        self._session = session
+        self._url = url
+        self._server_hex_public_key = server_hex_public_key
+        self._transport = transport
+        self._message = message
+        self._churn = churn
+        self._socket = None
+        self._rekey()
+
+    def _rekey(self) -> None:
+        keys = Nacl()
+        self._hex_public_key = keys.decoded_public_key()
+        self._mail_box = MailBox(keys.private_key, self._server_hex_public_key)
+
+    def _params(self) -> dict:
+        return {
+            "publicKey": self._hex_public_key,
+            "encryptedMessage": self._mail_box.box(self._message),
+        }
+
+    async def _close_socket(self) -> None:
+        if self._socket is not None:
+            await self._socket.close()
+            self._socket = None
+
+    async def request(self) -> None:
+        """
+        Sends one request and checks its decrypted reply.
+
+        Raises:
+            AssertionError: If the reply is unexpected.
+        """
+        if self._churn and random() < self._churn:
+            self._rekey()
+            await self._close_socket()
+        if self._transport == "query":
+            async with self._session.get(self._url, params=self._params()) as response:
+                text = await response.text()
+                assert response.status == 200, response.status
+        elif self._transport == "body":
+            async with self._session.post(self._url, data=self._params()) as response:
+                text = await response.text()
+                assert response.status == 200, response.status
+        else:
+            if self._socket is None:
+                self._socket = await self._session.ws_connect(
+                    self._url, params=self._params()
+                )
+            await self._socket.send_str(self._mail_box.box(self._message))
+            reply = await self._socket.receive()
+            assert reply.type == WSMsgType.TEXT, reply.type
+            text = reply.data
+        assert self._mail_box.unbox(text) == self._message
+
+    async def close(self) -> None:
+        """Closes the WebSocket, if any."""
+        await self._close_socket()
+
+
+async def fetch_stats(
+    session: ClientSession, stats_url: Optional[str]
+) -> Optional[dict]:
+    """
+    Fetches the target stats, if a stats route is available.
+
+    Args:
+        session (ClientSession): The client session.
+        stats_url (Optional[str]): The stats route URL.
+
+    Returns:
+        Optional[dict]: The stats, or None when unavailable.
+    """
+    if stats_url is None:
+        return None
+    try:
+        async with session.get(stats_url) as response:
+            if response.status != 200:
+                return None
+            return await response.json()
+    except Exception:
+        return None
+
+
+async def run_load(
+    url: str,
+    server_hex_public_key: str,
+    transport: str = "query",
+    concurrency: int = 16,
+    requests: int = 5000,
+    duration: Optional[float] = None,
+    payload_size: int = 64,
+    churn: float = 0.0,
+    stats_url: Optional[str] = None,
+) -> dict:
+    """
+    Drives the target with concurrent encrypted clients and returns a report.
+
+    Args:
+        url (str): The encrypted route URL.
+        server_hex_public_key (str): The server hex encoded public key.
+        transport (str, optional): One of "query", "body" or "websocket". Defaults to "query".
+        concurrency (int, optional): Number of concurrent clients. Defaults to 16.
+        requests (int, optional): Total number of requests, unless duration is given. Defaults to 5000.
+        duration (Optional[float], optional): Run for this many seconds instead. Defaults to None.
+        payload_size (int, optional): Size in characters of each message. Defaults to 64.
+        churn (float, optional): Probability of a new client key before each request. Defaults to 0.0.
+        stats_url (Optional[str], optional): URL of the target stats route. Defaults to None.
+
+    Returns:
+        dict: The report.
+    """
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Unknown transport {transport}!")
+    message = "x" * payload_size
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async with ClientSession(connector=TCPConnector(limit=concurrency)) as session:
+        clients = [
+            LoadClient(session, url, server_hex_public_key, transport, message, churn)
+            for _ in range(concurrency)
+        ]
+        before = await fetch_stats(session, stats_url)
+        started = perf_counter()
+        cpu_started = process_time()
+        deadline = None if duration is None else started + duration
+
+        async def worker(client: LoadClient) -> None:
+            nonlocal errors, remaining
+            while True:
+                if deadline is None:
+                    if remaining <= 0:
+                        return
+                    remaining -= 1
+                elif perf_counter() >= deadline:
+                    return
+                request_started = perf_counter()
+                try:
+                    await client.request()
+                except Exception:
+                    errors += 1
+                    await client.close()
+                    continue
+                latencies.append(perf_counter() - request_started)
+
+        await gather(*[worker(client) for client in clients])
+        elapsed = perf_counter() - started
+        client_cpu = process_time() - cpu_started
+        await gather(*[client.close() for client in clients])
+        after = await fetch_stats(session, stats_url)
+
+    latencies.sort()
+    completed = len(latencies)
+    report = {
+        "transport": transport,
+        "concurrency": concurrency,
+        "payload_size": payload_size,
+        "churn": churn,
+        "requests": completed,
+        "errors": errors,
+        "seconds": elapsed,
+        "rps": completed / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            name: percentile(latencies, percent) * 1000
+            for name, percent in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))
+        },
+        "client_cpu_us_per_request": client_cpu / completed * 1e6 if completed else 0.0,
+    }
+    if before is not None and after is not None:
+        lookups = (after["hits"] - before["hits"]) + (after["misses"] - before["misses"])
+        report["server_cpu_us_per_request"] = (
+            (after["process_time"] - before["process_time"]) / completed * 1e6
+            if completed
+            else 0.0
+        )
+        report["cache_hit_rate"] = (
+            (after["hits"] - before["hits"]) / lookups if lookups else 0.0
+        )
+        report["derivations"] = after["derivations"] - before["derivations"]
+    return report
+
+
+def _check_stack(stack: str) -> None:
+    """Raises ImportError if the server of a stack is not installed."""
+    if stack == "asgi" and find_spec("uvicorn") is None:
+        raise ImportError(
+            "--stack asgi requires uvicorn: pip install nacl_middleware[asgi]"
+        )
+
+
+def start_target(
+    host: str = "127.0.0.1",
+    cache_size: Optional[int] = None,
+    offload: bool = False,
+    stack: str = "aiohttp",
+) -> Tuple[Process, int, str]:
+    """
+    Starts the target application in a child process.
+
+    Args:
+        host (str, optional): The host to listen on. Defaults to "127.0.0.1".
+        cache_size (Optional[int], optional): Size of the key cache. Defaults to unbounded.
+        offload (bool, optional): Derive shared keys in an executor. Defaults to False.
+        stack (str, optional): "aiohttp", or "asgi" to serve NaclASGIMiddleware with uvicorn. Defaults to "aiohttp".
+
+    Returns:
+        Tuple[Process, int, str]: The process, its port and the server hex public key.
+
+    Raises:
+        ImportError: If the stack is asgi and uvicorn is not installed.
+    """
+    _check_stack(stack)
+    keys = Nacl()
+    ready = Queue()
+    process = Process(
+        target=_serve,
+        args=(keys.decoded_private_key(), host, cache_size, offload, ready, stack),
+        daemon=True,
+    )
+    process.start()
+    return process, ready.get(timeout=30), keys.decoded_public_key()
+
+
+def format_report(report: dict) -> str:
+    """
+    Formats a report as human readable lines.
+
+    Args:
+        report (dict): The report returned by run_load.
+
+    Returns:
+        str: The formatted report.
+    """
+    latency = report["latency_ms"]
+    stack = f"stack: {report['stack']}  " if "stack" in report else ""
+    lines = [
+        f"{stack}transport: {report['transport']}  "
+        f"concurrency: {report['concurrency']}  "
+        f"payload: {report['payload_size']}  churn: {report['churn']}",
+        f"requests: {report['requests']}  errors: {report['errors']}  "
+        f"seconds: {report['seconds']:.2f}  rps: {report['rps']:.1f}",
+        "latency ms: "
+        + "  ".join(f"{name} {value:.2f}" for name, value in latency.items()),
+        f"client cpu/request: {report['client_cpu_us_per_request']:.1f} us",
+    ]
+    if "server_cpu_us_per_request" in report:
+        lines.append(
+            f"server cpu/request: {report['server_cpu_us_per_request']:.1f} us  "
+            f"cache hit rate: {report['cache_hit_rate']:.1%}  "
+            f"derivations: {report['derivations']}"
+        )
+    return "\n".join(lines)
+
+
+def parse_arguments(argv: Optional[Sequence[str]] = None) -> Namespace:
+    """Parses the command line arguments."""
+    parser = ArgumentParser(
+        prog="nacl-middleware-bench",
+        description="Load test an encrypted endpoint served with nacl_middleware.",
+    )
+    parser.add_argument(
+        "--url", help="Encrypted route to target. Starts a local target if omitted."
+    )
+    parser.add_argument(
+        "--server-public-key", help="Hex encoded server public key, required with --url."
+    )
+    parser.add_argument("--stats-url", help="Stats route of the target, if any.")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="query")
+    parser.add_argument(
+        "--stack",
+        choices=STACKS,
+        default="aiohttp",
+        help="Adapter serving the local target, asgi requires uvicorn.",
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument(
+        "--duration", type=float, help="Run for this many seconds instead."
+    )
+    parser.add_argument("--payload-size", type=int, default=64)
+    parser.add_argument(
+        "--churn",
+        type=float,
+        default=0.0,
+        help="Fraction of requests made with a new client key.",
+    )
+    parser.add_argument(
+        "--cache-size", type=int, help="Key cache size of the local target."
+    )
+    parser.add_argument(
+        "--offload",
+        action="store_true",
+        help="Derive shared keys in an executor on the local target.",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    arguments = parser.parse_args(argv)
+    if arguments.url and not arguments.server_public_key:
+        parser.error("--server-public-key is required with --url")
+    if not arguments.url:
+        try:
+            _check_stack(arguments.stack)
+        except ImportError as e:
+            parser.error(str(e))
+    return arguments
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Entry point of nacl-middleware-bench."""
+    arguments = parse_arguments(argv)
+    process = None
+    url = arguments.url
+    stats_url = arguments.stats_url
+    server_hex_public_key = arguments.server_public_key
+    if url is None:
+        process, port, server_hex_public_key = start_target(
+            cache_size=arguments.cache_size,
+            offload=arguments.offload,
+            stack=arguments.stack,
+        )
+        scheme = "ws" if arguments.transport == "websocket" else "http"
+        path = WEBSOCKET_PATH if arguments.transport == "websocket" else BENCH_PATH
+        url = f"{scheme}://127.0.0.1:{port}{path}"
+        stats_url = f"http://127.0.0.1:{port}{STATS_PATH}"
+    try:
+        report = run(
+            run_load(
+                url,
+                server_hex_public_key,
+                transport=arguments.transport,
+                concurrency=arguments.concurrency,
+                requests=arguments.requests,
+                duration=arguments.duration,
+                payload_size=arguments.payload_size,
+                churn=arguments.churn,
+                stats_url=stats_url,
+            )
+        )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join()
+    if process is not None:
+        report["stack"] = arguments.stack
+    print(dumps(report, indent=2) if arguments.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,633 @@
+from asyncio import (
+    CancelledError,
+    Future,
+    Lock,
+    StreamReader,
+    StreamWriter,
+    get_running_loop,
+    open_connection,
+    shield,
+)
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import Executor
+from itertools import islice
+from logging import getLogger
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from nacl.bindings import crypto_box_BEFORENMBYTES
+from nacl.encoding import HexEncoder
+from nacl.public import Box, PrivateKey, PublicKey
+
+from nacl_middleware.nacl_utils import MailBox
+
+Admission = Callable[[str, str], bool]
+"""Tells whether a new hex encoded public key may evict a cached one."""
+
+
+class CacheBackend:
+    """
+    Async interface of a store of shared keys indexed by the hex encoded client public key.
+
+    Values are the 32 bytes precomputed shared keys, so any backend able to store bytes
+    can hold them and share them between workers and hosts.
+    """
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """
+        Gets the shared key stored under key.
+
+        Args:
+            key (str): The hex encoded client public key.
+
+        Returns:
+            Optional[bytes]: The shared key, or None on a miss.
+        """
+        raise NotImplementedError()
+
+    async def set(self, key: str, value: bytes) -> None:
+        """
+        Stores a shared key under key.
+
+        Args:
+            key (str): The hex encoded client public key.
+            value (bytes): The shared key.
+        """
+        raise NotImplementedError()
+
+    async def delete(self, key: str) -> None:
+        """
+        Removes the shared key stored under key, if any.
+
+        Args:
+            key (str): The hex encoded client public key.
+        """
+        raise NotImplementedError()
+
+    def hottest(self, count: int) -> List[Tuple[str, bytes]]:
+        """
+        Returns the most recently used entries, for snapshots. Only local backends
+        implement it.
+
+        Args:
+            count (int): Maximum number of entries returned.
+
+        Returns:
+            List[Tuple[str, bytes]]: The public keys and shared keys, hottest first.
+        """
+        raise NotImplementedError()
+
+
+class MemoryCache(CacheBackend):
+    """
+    In-process least recently used cache.
+
+    Attributes:
+        max_size (Optional[int]): Maximum number of entries kept. None means unbounded.
+        admission (Optional[Admission]): Decides whether a new key may evict the least recently used one.
+    """
+
+    max_size: Optional[int]
+    admission: Optional[Admission]
+    _data: "OrderedDict[str, bytes]"
+
+    def __init__(
+        self, max_size: Optional[int] = None, admission: Optional[Admission] = None
+    ) -> None:
+        """
+        Initializes the cache.
+
+        Args:
+            max_size (Optional[int], optional): Maximum number of entries kept. Defaults to None (unbounded).
+            admission (Optional[Admission], optional): Called with the new and the evicted key when full, the new key is not stored unless it returns True, such as HeavyHitters.admit. Defaults to always storing.
+        """
+        self.max_size = max_size
+        self.admission = admission
+        self._data = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes) -> None:
+        data = self._data
+        if (
+            self.admission is not None
+            and self.max_size is not None
+            and key not in data
+            and len(data) >= self.max_size
+            and not self.admission(key, next(iter(data)))
+        ):
+            return
+        data[key] = value
+        data.move_to_end(key)
+        if self.max_size is not None and len(data) > self.max_size:
+            data.popitem(last=False)
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def hottest(self, count: int) -> List[Tuple[str, bytes]]:
+        return list(islice(reversed(self._data.items()), count))
+
+
+class SharedKeyArena(CacheBackend):
+    """
+    Compact fixed capacity store packing the shared keys into one contiguous bytearray.
+
+    Each entry costs its 32 bytes slot in the arena plus a dict entry indexing the raw
+    32 bytes client public key, instead of a Python object per key. When full, an entry
+    is evicted with the CLOCK algorithm, an approximation of least recently used.
+
+    Attributes:
+        capacity (int): Number of slots.
+        admission (Optional[Admission]): Decides whether a new key may evict the one chosen by CLOCK.
+    """
+
+    capacity: int
+    admission: Optional[Admission]
+    _arena: bytearray
+    _referenced: bytearray
+    _slots: Dict[bytes, int]
+    _keys: List[Optional[bytes]]
+    _free: List[int]
+    _unused: int
+    _hand: int
+
+    def __init__(self, capacity: int, admission: Optional[Admission] = None) -> None:
+        """
+        Initializes the arena, allocating every slot upfront.
+
+        Args:
+            capacity (int): Number of slots.
+            admission (Optional[Admission], optional): Called with the new and the evicted key when full, the new key is not stored unless it returns True, such as HeavyHitters.admit. Defaults to always storing.
+        """
+        if capacity < 1:
+            raise ValueError("Capacity must be positive!")
+        self.capacity = capacity
+        self.admission = admission
+        self._arena = bytearray(capacity * crypto_box_BEFORENMBYTES)
+        self._referenced = bytearray(capacity)
+        self._slots = {}
+        self._keys = [None] * capacity
+        self._free = []
+        self._unused = 0
+        self._hand = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _victim(self) -> int:
+        while self._referenced[self._hand]:
+            self._referenced[self._hand] = 0
+            self._hand = (self._hand + 1) % self.capacity
+        slot = self._hand
+        self._hand = (self._hand + 1) % self.capacity
+        return slot
+
+    async def get(self, key: str) -> Optional[bytes]:
+        slot = self._slots.get(bytes.fromhex(key))
+        if slot is None:
+            return None
+        self._referenced[slot] = 1
+        offset = slot * crypto_box_BEFORENMBYTES
+        return bytes(self._arena[offset : offset + crypto_box_BEFORENMBYTES])
+
+    async def set(self, key: str, value: bytes) -> None:
+        if len(value) != crypto_box_BEFORENMBYTES:
+            raise ValueError(
+                f"Shared key must be {crypto_box_BEFORENMBYTES} bytes long!"
+            )
+        raw_key = bytes.fromhex(key)
+        slot = self._slots.get(raw_key)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            elif self._unused < self.capacity:
+                slot = self._unused
+                self._unused += 1
+            else:
+                slot = self._victim()
+                victim = self._keys[slot]
+                if self.admission is not None and not self.admission(key, victim.hex()):
+                    return
+                del self._slots[victim]
+            self._slots[raw_key] = slot
+            self._keys[slot] = raw_key
+        self._referenced[slot] = 1
+        offset = slot * crypto_box_BEFORENMBYTES
+        self._arena[offset : offset + crypto_box_BEFORENMBYTES] = value
+
+    async def delete(self, key: str) -> None:
+        slot = self._slots.pop(bytes.fromhex(key), None)
+        if slot is not None:
+            self._keys[slot] = None
+            self._referenced[slot] = 0
+            offset = slot * crypto_box_BEFORENMBYTES
+            self._arena[offset : offset + crypto_box_BEFORENMBYTES] = bytes(
+                crypto_box_BEFORENMBYTES
+            )
+            self._free.append(slot)
+
+    def hottest(self, count: int) -> List[Tuple[str, bytes]]:
+        # Referenced slots were used since the hand last swept them.
+        slots = sorted(self._slots.values(), key=lambda slot: -self._referenced[slot])
+        entries = []
+        for slot in slots[:count]:
+            offset = slot * crypto_box_BEFORENMBYTES
+            entries.append(
+                (
+                    self._keys[slot].hex(),
+                    bytes(self._arena[offset : offset + crypto_box_BEFORENMBYTES]),
+                )
+            )
+        return entries
+
+
+class TieredCache(CacheBackend):
+    """
+    A local least recently used cache in front of a shared remote backend.
+
+    Attributes:
+        remote (CacheBackend): The shared backend.
+        local (MemoryCache): The in-process cache consulted first.
+    """
+
+    remote: CacheBackend
+    local: MemoryCache
+
+    def __init__(
+        self, remote: CacheBackend, local: Optional[MemoryCache] = None
+    ) -> None:
+        """
+        Initializes the tiered cache.
+
+        Args:
+            remote (CacheBackend): The shared backend.
+            local (Optional[MemoryCache], optional): The local cache. Defaults to a MemoryCache of 1024 entries.
+        """
+        self.remote = remote
+        self.local = local if local is not None else MemoryCache(1024)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = await self.local.get(key)
+        if value is None:
+            value = await self.remote.get(key)
+            if value is not None:
+                await self.local.set(key, value)
+        return value
+
+    async def set(self, key: str, value: bytes) -> None:
+        await self.local.set(key, value)
+        await self.remote.set(key, value)
+
+    async def delete(self, key: str) -> None:
+        await self.local.delete(key)
+        await self.remote.delete(key)
+
+    def hottest(self, count: int) -> List[Tuple[str, bytes]]:
+        return self.local.hottest(count)
+
+
+class RedisCacheError(Exception):
+    """Raised when the Redis server replies with an error."""
+
+
+class RedisCache(CacheBackend):
+    """
+    A minimal Redis protocol (RESP) backend speaking GET, SET and DEL over one connection.
+
+    Anything answering the Redis protocol (Redis, Valkey, KeyDB or a local fake) can be used.
+
+    Attributes:
+        host (str): The server host.
+        port (int): The server port.
+        prefix (str): Prefix prepended to every key.
+        ttl (Optional[int]): Expiry in seconds of stored keys. None means no expiry.
+    """
+
+    host: str
+    port: int
+    prefix: str
+    ttl: Optional[int]
+    _reader: Optional[StreamReader]
+    _writer: Optional[StreamWriter]
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        prefix: str = "nacl:",
+        ttl: Optional[int] = None,
+    ) -> None:
+        """
+        Initializes the backend. The connection is opened on first use.
+
+        Args:
+            host (str, optional): The server host. Defaults to "localhost".
+            port (int, optional): The server port. Defaults to 6379.
+            db (int, optional): The database index selected after connecting. Defaults to 0.
+            password (Optional[str], optional): Password sent with AUTH after connecting. Defaults to None.
+            prefix (str, optional): Prefix prepended to every key. Defaults to "nacl:".
+            ttl (Optional[int], optional): Expiry in seconds of stored keys. Defaults to None.
+        """
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.ttl = ttl
+        self._db = db
+        self._password = password
+        self._reader = None
+        self._writer = None
+        self._lock = Lock()
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode()
+            elif isinstance(arg, int):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    async def _read_reply(self) -> any:
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed!")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            # Returned rather than raised, so the rest of an array reply is read.
+            return RedisCacheError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisCacheError(f"Unexpected reply {line!r}")
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await open_connection(self.host, self.port)
+        setup = []
+        if self._password is not None:
+            setup.append(("AUTH", self._password))
+        if self._db:
+            setup.append(("SELECT", self._db))
+        for args in setup:
+            reply = await self._command(*args)
+            if isinstance(reply, RedisCacheError):
+                raise reply
+
+    async def _command(self, *args) -> any:
+        self._writer.write(self._encode(*args))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def execute(self, *args) -> any:
+        """
+        Sends a command and returns its reply, connecting first if needed.
+
+        Args:
+            *args: The command and its arguments.
+
+        Returns:
+            any: The decoded reply.
+
+        Raises:
+            RedisCacheError: If the server replies with an error.
+        """
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    await self._connect()
+                reply = await self._command(*args)
+            except BaseException:
+                # Interrupted mid-command, the reply stream is out of sync: a
+                # timeout, a cancellation, a truncated or malformed reply. Reconnect
+                # on next use.
+                await self.close()
+                raise
+        # A complete error reply leaves the stream in sync.
+        if isinstance(reply, RedisCacheError):
+            raise reply
+        return reply
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.execute("GET", self.prefix + key)
+
+    async def set(self, key: str, value: bytes) -> None:
+        if self.ttl is None:
+            await self.execute("SET", self.prefix + key, value)
+        else:
+            await self.execute("SET", self.prefix + key, value, "EX", self.ttl)
+
+    async def delete(self, key: str) -> None:
+        await self.execute("DEL", self.prefix + key)
+
+    async def close(self) -> None:
+        """
+        Closes the connection, if open.
+        """
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+class KeyCache:
+    """
+    Resolves client public keys into MailBoxes, caching the derived shared keys.
+
+    Concurrent misses for the same public key are coalesced (single-flight): the first
+    one derives and stores the shared key while the others await the same future.
+
+    A backend failing, such as a RedisCache whose server is down, is logged and the
+    shared key derived locally, so a cache outage does not reject the requests.
+
+    Attributes:
+        backend (CacheBackend): The store of shared keys.
+        offload (bool): Whether derivations run in an executor instead of on the event loop.
+        hits (int): Number of lookups answered by the backend.
+        misses (int): Number of lookups not answered by the backend.
+        derivations (int): Number of shared key derivations performed.
+        derivations_saved (int): Number of misses served by awaiting an in-flight derivation.
+    """
+
+    backend: CacheBackend
+    offload: bool
+    hits: int
+    misses: int
+    derivations: int
+    derivations_saved: int
+    _in_flight: Dict[str, Future]
+
+    def __init__(
+        self,
+        private_key: PrivateKey,
+        backend: Optional[CacheBackend] = None,
+        offload: bool = False,
+        executor: Optional[Executor] = None,
+        log=getLogger(),
+    ) -> None:
+        """
+        Initializes the key cache.
+
+        Args:
+            private_key (PrivateKey): The server private key.
+            backend (Optional[CacheBackend], optional): The store of shared keys. Defaults to an unbounded MemoryCache.
+            offload (bool, optional): Run derivations in an executor, off the event loop. Defaults to False.
+            executor (Optional[Executor], optional): The executor used when offloading. Defaults to the loop's default executor.
+            log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+        """
+        self._private_key = private_key
+        self.backend = backend if backend is not None else MemoryCache()
+        self.offload = offload
+        self._executor = executor
+        self._log = log
+        self.hits = 0
+        self.misses = 0
+        self.derivations = 0
+        self.derivations_saved = 0
+        self._in_flight = {}
+
+    def _derive(self, hex_public_key: str) -> bytes:
+        return Box(self._private_key, PublicKey(hex_public_key, HexEncoder)).shared_key()
+
+    def stats(self) -> dict:
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: The hits, misses, derivations and derivations_saved counters.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "derivations": self.derivations,
+            "derivations_saved": self.derivations_saved,
+        }
+
+    def hottest(self, count: int) -> List[Tuple[str, bytes]]:
+        """
+        Returns the most recently used shared keys of the backend.
+
+        Args:
+            count (int): Maximum number of entries returned.
+
+        Returns:
+            List[Tuple[str, bytes]]: The hex encoded public keys and shared keys, hottest first.
+        """
+        return self.backend.hottest(count)
+
+    async def warm(self, entries: Iterable[Tuple[str, bytes]]) -> int:
+        """
+        Stores shared keys derived earlier, such as the ones of a snapshot.
+
+        Args:
+            entries (Iterable[Tuple[str, bytes]]): The hex encoded public keys and shared keys, hottest first.
+
+        Returns:
+            int: Number of entries stored.
+        """
+        entries = list(entries)
+        # Store the coldest first, so the hottest end up most recently used.
+        for hex_public_key, shared_key in reversed(entries):
+            await self.backend.set(hex_public_key, shared_key)
+        return len(entries)
+
+    async def get(self, hex_public_key: str) -> MailBox:
+        """
+        Gets the MailBox for a client public key, deriving its shared key on a miss.
+
+        Args:
+            hex_public_key (str): The hex encoded client public key.
+
+        Returns:
+            MailBox: The MailBox shared with the client.
+        """
+        mail_box, _ = await self.lookup(hex_public_key)
+        return mail_box
+
+    async def lookup(self, hex_public_key: str) -> Tuple[MailBox, bool]:
+        """
+        Like get, also telling whether the backend had the shared key.
+
+        Args:
+            hex_public_key (str): The hex encoded client public key.
+
+        Returns:
+            Tuple[MailBox, bool]: The MailBox shared with the client and whether it was a hit.
+        """
+        try:
+            shared_key = await self.backend.get(hex_public_key)
+        except Exception as e:
+            self._log.info(f"Key cache backend failed, deriving locally: {e!r}")
+            shared_key = None
+        if shared_key is not None:
+            self.hits += 1
+            return MailBox.from_shared_key(shared_key), True
+        self.misses += 1
+
+        future = self._in_flight.get(hex_public_key)
+        while future is not None:
+            try:
+                # Shielded, so cancelling this request does not cancel the others.
+                shared_key = await shield(future)
+            except CancelledError:
+                if not future.cancelled():
+                    raise
+                # The deriving request was cancelled, not this one: derive anew.
+                future = self._in_flight.get(hex_public_key)
+                continue
+            self.derivations_saved += 1
+            return MailBox.from_shared_key(shared_key), False
+
+        loop = get_running_loop()
+        future = loop.create_future()
+        self._in_flight[hex_public_key] = future
+        try:
+            self.derivations += 1
+            if self.offload:
+                shared_key = await loop.run_in_executor(
+                    self._executor, self._derive, hex_public_key
+                )
+            else:
+                shared_key = self._derive(hex_public_key)
+            try:
+                await self.backend.set(hex_public_key, shared_key)
+            except Exception as e:
+                self._log.info(f"Key cache backend failed to store a key: {e!r}")
+        except BaseException as exception:
+            if isinstance(exception, CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(exception)
+                # Mark the exception as retrieved when nobody else is waiting.
+                future.exception()
+            raise
+        else:
+            future.set_result(shared_key)
+        finally:
+            del self._in_flight[hex_public_key]
+        return MailBox.from_shared_key(shared_key), False
@@ -0,0 +1,360 @@
+"""Registered clients mode: only known client public keys are served."""
+
+from asyncio import get_running_loop
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from os import cpu_count
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from nacl.bindings import (
+    crypto_box_beforenm,
+    crypto_box_BEFORENMBYTES,
+    crypto_box_PUBLICKEYBYTES,
+)
+from nacl.public import PrivateKey, PublicKey
+
+from nacl_middleware.nacl_utils import MailBox
+
+ClientKey = Union[str, bytes, PublicKey]
+"""A client public key: hex encoded, raw or a PublicKey."""
+
+_parallel_threshold = 1024
+
+
+class UnknownClientError(KeyError):
+    """Raised when a public key is not registered."""
+
+
+def _raw_key(key: ClientKey) -> bytes:
+    if isinstance(key, PublicKey):
+        return bytes(key)
+    if isinstance(key, str):
+        key = bytes.fromhex(key)
+    if len(key) != crypto_box_PUBLICKEYBYTES:
+        raise ValueError(f"Public key must be {crypto_box_PUBLICKEYBYTES} bytes long!")
+    return bytes(key)
+
+
+def _derive_chunk(private_key: bytes, public_keys: bytes) -> bytes:
+    """Derives the shared keys of concatenated raw public keys, in a worker process."""
+    return b"".join(
+        crypto_box_beforenm(
+            public_keys[offset : offset + crypto_box_PUBLICKEYBYTES], private_key
+        )
+        for offset in range(0, len(public_keys), crypto_box_PUBLICKEYBYTES)
+    )
+
+
+def precompute_shared_keys(
+    private_key: PrivateKey,
+    public_keys: List[bytes],
+    workers: Optional[int] = None,
+    chunk_size: int = 4096,
+) -> bytes:
+    """
+    Derives the shared keys of many clients, on a process pool for large batches.
+
+    Args:
+        private_key (PrivateKey): The server private key.
+        public_keys (List[bytes]): The raw client public keys.
+        workers (Optional[int], optional): Number of worker processes. Defaults to the number of CPUs.
+        chunk_size (int, optional): Number of keys sent to a worker at once. Defaults to 4096.
+
+    Returns:
+        bytes: The concatenated 32 bytes shared keys, in the order of public_keys.
+    """
+    raw_private_key = bytes(private_key)
+    if len(public_keys) < _parallel_threshold:
+        return _derive_chunk(raw_private_key, b"".join(public_keys))
+    chunks = [
+        b"".join(public_keys[start : start + chunk_size])
+        for start in range(0, len(public_keys), chunk_size)
+    ]
+    with ProcessPoolExecutor(workers or cpu_count() or 1) as executor:
+        return b"".join(
+            executor.map(_derive_chunk, [raw_private_key] * len(chunks), chunks)
+        )
+
+
+def read_client_keys(
+    path: Union[str, Path], raw: bool = False, log=getLogger()
+) -> Iterator[bytes]:
+    """
+    Reads a client registry file. Malformed lines are logged and skipped.
+
+    Args:
+        path (Union[str, Path]): The file, with one hex encoded public key per line, blank lines and # comments allowed, or concatenated raw keys.
+        raw (bool, optional): Whether the file holds concatenated raw keys. Defaults to False.
+        log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+
+    Yields:
+        bytes: The raw client public keys.
+    """
+    if raw:
+        data = Path(path).read_bytes()
+        if len(data) % crypto_box_PUBLICKEYBYTES:
+            raise ValueError(f"Truncated registry {path}!")
+        for offset in range(0, len(data), crypto_box_PUBLICKEYBYTES):
+            yield data[offset : offset + crypto_box_PUBLICKEYBYTES]
+        return
+    with open(path) as file:
+        for number, line in enumerate(file, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            try:
+                yield _raw_key(line)
+            except ValueError as e:
+                log.info(f"Skipping line {number} of {path}: {e}")
+
+
+class ClientRegistry:
+    """
+    Serves only registered clients, with every shared key precomputed, in place of a
+    KeyCache.
+
+    The shared keys are packed into one bytearray table. A request from an unknown or
+    malformed public key is rejected with a single dict lookup, before any crypto, so
+    random keys cannot make the server derive shared keys. Unlike a KeyCache, it has no
+    backend and nothing to snapshot or warm, since it never derives on a lookup.
+
+    Attributes:
+        hits (int): Number of lookups of registered keys.
+        derivations (int): Number of shared key derivations performed.
+        rejected (int): Number of lookups of unregistered keys.
+    """
+
+    hits: int
+    derivations: int
+    rejected: int
+    _slots: Dict[bytes, int]
+    _table: bytearray
+    _free: List[int]
+
+    def __init__(
+        self,
+        private_key: PrivateKey,
+        clients: Iterable[ClientKey] = (),
+        workers: Optional[int] = None,
+        log=getLogger(),
+    ) -> None:
+        """
+        Initializes the registry, precomputing the shared keys of the clients.
+
+        The derivation blocks, so the registry should be built before the event loop
+        serves. Malformed keys are logged and skipped.
+
+        Args:
+            private_key (PrivateKey): The server private key.
+            clients (Iterable[ClientKey], optional): The registered client public keys. Defaults to none.
+            workers (Optional[int], optional): Number of worker processes for large batches. Defaults to the number of CPUs.
+            log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+        """
+        self._private_key = private_key
+        self._workers = workers
+        self._log = log
+        self.hits = 0
+        self.derivations = 0
+        self.rejected = 0
+        self._slots = {}
+        self._table = bytearray()
+        self._free = []
+        public_keys = self._new_keys(self._valid_keys(clients))
+        self._store(
+            public_keys, precompute_shared_keys(private_key, public_keys, workers)
+        )
+        self.derivations += len(public_keys)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, key: ClientKey) -> bool:
+        try:
+            return _raw_key(key) in self._slots
+        except ValueError:
+            return False
+
+    def _parse(
+        self, clients: Iterable[ClientKey]
+    ) -> Tuple[List[bytes], List[ClientKey]]:
+        """Returns the distinct raw keys of the clients and the malformed keys."""
+        keys = {}
+        invalid = []
+        for client in clients:
+            try:
+                keys[_raw_key(client)] = None
+            except (TypeError, ValueError):
+                invalid.append(client)
+        return list(keys), invalid
+
+    def _valid_keys(self, clients: Iterable[ClientKey]) -> List[bytes]:
+        keys, invalid = self._parse(clients)
+        for client in invalid:
+            self._log.info(f"Skipping malformed public key {client!r}")
+        return keys
+
+    def _new_keys(self, public_keys: List[bytes]) -> List[bytes]:
+        return [key for key in public_keys if key not in self._slots]
+
+    async def _derive(self, public_keys: List[bytes]) -> bytes:
+        shared_keys = await get_running_loop().run_in_executor(
+            None, precompute_shared_keys, self._private_key, public_keys, self._workers
+        )
+        self.derivations += len(public_keys)
+        return shared_keys
+
+    def _store(self, public_keys: List[bytes], shared_keys: bytes) -> int:
+        # Skip the keys registered by a concurrent call while these were derived.
+        indexes = [
+            index
+            for index, public_key in enumerate(public_keys)
+            if public_key not in self._slots
+        ]
+        missing = len(indexes) - len(self._free)
+        if missing > 0:
+            first = len(self._table) // crypto_box_BEFORENMBYTES
+            self._table += bytes(missing * crypto_box_BEFORENMBYTES)
+            self._free.extend(range(first + missing - 1, first - 1, -1))
+        for index in indexes:
+            slot = self._free.pop()
+            offset = slot * crypto_box_BEFORENMBYTES
+            self._table[offset : offset + crypto_box_BEFORENMBYTES] = shared_keys[
+                index * crypto_box_BEFORENMBYTES : (index + 1) * crypto_box_BEFORENMBYTES
+            ]
+            self._slots[public_keys[index]] = slot
+        return len(indexes)
+
+    async def add(self, clients: Iterable[ClientKey]) -> Tuple[int, List[ClientKey]]:
+        """
+        Registers clients, deriving their shared keys off the event loop.
+
+        Args:
+            clients (Iterable[ClientKey]): The client public keys.
+
+        Returns:
+            Tuple[int, List[ClientKey]]: Number of clients newly registered, and the malformed keys, which were skipped.
+        """
+        public_keys, invalid = self._parse(clients)
+        public_keys = self._new_keys(public_keys)
+        added = self._store(public_keys, await self._derive(public_keys))
+        return added, invalid
+
+    def remove(self, clients: Iterable[ClientKey]) -> int:
+        """
+        Unregisters clients.
+
+        Args:
+            clients (Iterable[ClientKey]): The client public keys.
+
+        Returns:
+            int: Number of clients removed.
+        """
+        removed = 0
+        public_keys, _ = self._parse(clients)
+        for public_key in public_keys:
+            slot = self._slots.pop(public_key, None)
+            if slot is not None:
+                offset = slot * crypto_box_BEFORENMBYTES
+                self._table[offset : offset + crypto_box_BEFORENMBYTES] = bytes(
+                    crypto_box_BEFORENMBYTES
+                )
+                self._free.append(slot)
+                removed += 1
+        return removed
+
+    async def update(self, clients: Iterable[ClientKey]) -> Tuple[int, int]:
+        """
+        Makes the registry hold exactly clients, deriving the new keys off the event loop.
+
+        Malformed keys are logged and skipped.
+
+        Args:
+            clients (Iterable[ClientKey]): The client public keys.
+
+        Returns:
+            Tuple[int, int]: Number of clients added and removed.
+        """
+        public_keys = self._valid_keys(clients)
+        wanted = set(public_keys)
+        public_keys = self._new_keys(public_keys)
+        shared_keys = await self._derive(public_keys)
+        removed = self.remove([key for key in self._slots if key not in wanted])
+        added = self._store(public_keys, shared_keys)
+        self._log.info(f"Registry updated: {added} added, {removed} removed")
+        return added, removed
+
+    async def reload(self, path: Union[str, Path], raw: bool = False) -> Tuple[int, int]:
+        """
+        Updates the registry from a file, see read_client_keys.
+
+        Args:
+            path (Union[str, Path]): The registry file.
+            raw (bool, optional): Whether the file holds concatenated raw keys. Defaults to False.
+
+        Returns:
+            Tuple[int, int]: Number of clients added and removed.
+        """
+        clients = await get_running_loop().run_in_executor(
+            None, lambda: list(read_client_keys(path, raw, self._log))
+        )
+        return await self.update(clients)
+
+    def stats(self) -> dict:
+        """
+        Returns the registry counters.
+
+        Returns:
+            dict: The hits, derivations, registered and rejected counters.
+        """
+        return {
+            "hits": self.hits,
+            "derivations": self.derivations,
+            "registered": len(self),
+            "rejected": self.rejected,
+        }
+
+    async def get(self, hex_public_key: str) -> MailBox:
+        """
+        Gets the MailBox of a registered client.
+
+        Args:
+            hex_public_key (str): The hex encoded client public key.
+
+        Returns:
+            MailBox: The MailBox shared with the client.
+
+        Raises:
+            UnknownClientError: If the public key is not registered.
+        """
+        mail_box, _ = await self.lookup(hex_public_key)
+        return mail_box
+
+    async def lookup(self, hex_public_key: str) -> Tuple[MailBox, bool]:
+        """
+        Like get, for the middleware. Registered keys are always hits.
+
+        Args:
+            hex_public_key (str): The hex encoded client public key.
+
+        Returns:
+            Tuple[MailBox, bool]: The MailBox shared with the client and True.
+
+        Raises:
+            UnknownClientError: If the public key is not registered.
+        """
+        try:
+            slot = self._slots.get(bytes.fromhex(hex_public_key))
+        except (TypeError, ValueError):
+            slot = None
+        if slot is None:
+            self.rejected += 1
+            raise UnknownClientError(f"Unregistered public key {hex_public_key}!")
+        self.hits += 1
+        offset = slot * crypto_box_BEFORENMBYTES
+        return (
+            MailBox.from_shared_key(
+                self._table[offset : offset + crypto_box_BEFORENMBYTES]
+            ),
+            True,
+        )
@@ -0,0 +1,167 @@
+"""Deadline aware load shedding of encrypted requests."""
+
+from collections.abc import Callable
+from logging import getLogger
+from time import time
+from typing import Dict, Optional, Tuple
+
+from nacl_middleware.nacl_utils import MailBox
+
+DEADLINE_HEADER = "X-Nacl-Deadline"
+"""Request header carrying an unauthenticated copy of the deadline."""
+
+DEADLINE_KEY = "naclDeadline"
+"""Key of the deadline in the boxed envelope."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request expired before its handler could run."""
+
+
+def box_with_deadline(
+    mail_box: MailBox,
+    message: any,
+    timeout: float,
+    clock: Callable[[], float] = time,
+) -> Tuple[str, Dict[str, str]]:
+    """
+    Boxes a message in an envelope carrying its deadline, on the client side.
+
+    Args:
+        mail_box (MailBox): The MailBox shared with the server.
+        message (any): The message.
+        timeout (float): Seconds the client waits for the response.
+        clock (Callable[[], float], optional): Returns the current Unix time. Defaults to time.time.
+
+    Returns:
+        Tuple[str, Dict[str, str]]: The encryptedMessage and the headers to send along.
+    """
+    deadline = round(clock() + timeout, 3)
+    encrypted_message = mail_box.box({DEADLINE_KEY: deadline, "message": message})
+    return encrypted_message, {DEADLINE_HEADER: repr(deadline)}
+
+
+def _parse_hint(hint: Optional[str]) -> Optional[float]:
+    if hint is None:
+        return None
+    try:
+        return float(hint)
+    except ValueError:
+        return None
+
+
+class DeadlinePolicy:
+    """
+    Drops requests whose client has given up, before their handler runs.
+
+    Clients box their message with box_with_deadline, in an envelope holding the Unix
+    time after which the response is useless, and copy the deadline in the
+    X-Nacl-Deadline header. The header is checked before decryption, so requests that
+    waited too long in the server queues are shed without any crypto. It is not
+    authenticated, so once decrypted the deadline of the envelope is checked again and
+    the header must match it. Handlers receive the message without its envelope.
+
+    Attributes:
+        required (bool): Whether messages without a deadline are rejected.
+        clock_skew (float): Seconds a deadline may be exceeded, for the clock difference between clients and server.
+        shed_before_decrypt (int): Number of requests shed on their header.
+        shed_after_decrypt (int): Number of requests shed on their authenticated deadline.
+        hint_mismatches (int): Number of requests rejected because their header does not match their deadline.
+    """
+
+    required: bool
+    clock_skew: float
+    shed_before_decrypt: int
+    shed_after_decrypt: int
+    hint_mismatches: int
+
+    def __init__(
+        self,
+        required: bool = False,
+        clock_skew: float = 1.0,
+        clock: Callable[[], float] = time,
+        log=getLogger(),
+    ) -> None:
+        """
+        Initializes the policy.
+
+        Args:
+            required (bool, optional): Reject messages without a deadline. Defaults to False.
+            clock_skew (float, optional): Seconds a deadline may be exceeded. Defaults to 1.0.
+            clock (Callable[[], float], optional): Returns the current Unix time. Defaults to time.time.
+            log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+        """
+        self.required = required
+        self.clock_skew = clock_skew
+        self._clock = clock
+        self._log = log
+        self.shed_before_decrypt = 0
+        self.shed_after_decrypt = 0
+        self.hint_mismatches = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the shedding counters.
+
+        Returns:
+            dict: The shed_before_decrypt, shed_after_decrypt, shed and hint_mismatches counters.
+        """
+        return {
+            "shed_before_decrypt": self.shed_before_decrypt,
+            "shed_after_decrypt": self.shed_after_decrypt,
+            "shed": self.shed_before_decrypt + self.shed_after_decrypt,
+            "hint_mismatches": self.hint_mismatches,
+        }
+
+    def _expired(self, deadline: float) -> bool:
+        return self._clock() > deadline + self.clock_skew
+
+    def check_hint(self, hint: Optional[str]) -> None:
+        """
+        Sheds a request on its deadline header, before decryption.
+
+        Args:
+            hint (Optional[str]): The X-Nacl-Deadline header, if any.
+
+        Raises:
+            DeadlineExceeded: If the header deadline has passed.
+        """
+        deadline = _parse_hint(hint)
+        if deadline is not None and self._expired(deadline):
+            self.shed_before_decrypt += 1
+            self._log.debug(f"Request shed before decryption, deadline {hint}")
+            raise DeadlineExceeded(f"Deadline {hint} has passed!")
+
+    def open(self, message: any, hint: Optional[str]) -> any:
+        """
+        Verifies the deadline of a decrypted message and removes its envelope.
+
+        Args:
+            message (any): The decrypted message.
+            hint (Optional[str]): The X-Nacl-Deadline header, if any.
+
+        Returns:
+            any: The message without its envelope.
+
+        Raises:
+            DeadlineExceeded: If the deadline has passed.
+            ValueError: If the header does not match the deadline, or a required deadline is missing.
+        """
+        if not isinstance(message, dict) or DEADLINE_KEY not in message:
+            if self.required:
+                raise ValueError("Message has no deadline!")
+            if hint is not None:
+                self.hint_mismatches += 1
+                raise ValueError("Deadline header without a deadline in the message!")
+            return message
+        deadline = message[DEADLINE_KEY]
+        if not isinstance(deadline, (int, float)) or isinstance(deadline, bool):
+            raise ValueError(f"Invalid deadline {deadline!r}!")
+        if hint is not None and _parse_hint(hint) != deadline:
+            self.hint_mismatches += 1
+            raise ValueError(f"Deadline header {hint} does not match {deadline}!")
+        if self._expired(deadline):
+            self.shed_after_decrypt += 1
+            self._log.debug(f"Request shed after decryption, deadline {deadline}")
+            raise DeadlineExceeded(f"Deadline {deadline} has passed!")
+        return message.get("message")
@@ -0,0 +1,151 @@
+"""Queue based pipeline stage for inbound messages."""
+
+from asyncio import CancelledError, Event, Queue, Task, gather, get_running_loop
+from collections.abc import Awaitable, Callable, Hashable
+from logging import getLogger
+from typing import Dict, List, Set
+
+
+class MessageDispatcher:
+    """
+    Hands inbound messages to a handler through bounded queues served by worker tasks.
+
+    Each key, typically the connection the messages arrived on, has its own queue, so
+    the messages of one key are handled one at a time and in arrival order. Keys with
+    messages waiting take turns on a shared pool of workers, one message at a time, so
+    a slow key only holds the worker handling it while the others serve other keys.
+    When the queue of a key is full, put waits, which pauses only the reader feeding
+    it. A handler blocking forever still holds its worker, so use more workers than the
+    slow keys expected at once.
+
+    Attributes:
+        workers (int): Number of worker tasks.
+        max_queue_size (int): Capacity of the queue of each key.
+        handled (int): Number of messages handled.
+        failed (int): Number of messages whose handler raised.
+    """
+
+    workers: int
+    max_queue_size: int
+    handled: int
+    failed: int
+    _queues: Dict[Hashable, Queue]
+    _pending: Dict[Hashable, int]
+    _scheduled: Set[Hashable]
+    _ready: Queue
+    _drained: Event
+    _tasks: List[Task]
+
+    def __init__(
+        self,
+        handler: Callable[[any], Awaitable],
+        workers: int = 4,
+        max_queue_size: int = 128,
+        log=getLogger(),
+    ) -> None:
+        """
+        Initializes the dispatcher. Call start from the event loop before putting messages.
+
+        Args:
+            handler (Callable[[any], Awaitable]): Coroutine function handling each message.
+            workers (int, optional): Number of worker tasks. Defaults to 4.
+            max_queue_size (int, optional): Capacity of the queue of each key. Defaults to 128.
+            log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+        """
+        self._handler = handler
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self._log = log
+        self.handled = 0
+        self.failed = 0
+        self._queues = {}
+        self._pending = {}
+        self._scheduled = set()
+        self._tasks = []
+
+    @property
+    def queued(self) -> int:
+        """Number of messages waiting in every queue."""
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def start(self) -> None:
+        """Starts the worker tasks."""
+        loop = get_running_loop()
+        # Keys with messages waiting, each at most once, in the order they take turns.
+        self._ready = Queue()
+        self._drained = Event()
+        self._drained.set()
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def put(self, key: Hashable, message: any) -> None:
+        """
+        Queues a message, waiting while the queue of its key is full.
+
+        Args:
+            key (Hashable): The ordering key, such as the connection.
+            message (any): The message given to the handler.
+        """
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = Queue(self.max_queue_size)
+        # Counted before waiting, so the queue outlives the messages put meanwhile.
+        self._pending[key] = self._pending.get(key, 0) + 1
+        self._drained.clear()
+        try:
+            await queue.put(message)
+        except BaseException:
+            self._release(key)
+            raise
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            self._ready.put_nowait(key)
+
+    async def _work(self) -> None:
+        while True:
+            key = await self._ready.get()
+            queue = self._queues[key]
+            message = queue.get_nowait()
+            try:
+                await self._handler(message)
+                self.handled += 1
+            except CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                self._log.info(f"Failed handling message: {e}")
+            finally:
+                self._done(key, queue)
+
+    def _done(self, key: Hashable, queue: Queue) -> None:
+        """Hands the key its next turn, or forgets it once it has no messages left."""
+        if not queue.empty():
+            self._pending[key] -= 1
+            self._ready.put_nowait(key)
+            return
+        # A put still waiting schedules the key again once its message is queued.
+        self._scheduled.discard(key)
+        self._release(key)
+
+    def _release(self, key: Hashable) -> None:
+        """Uncounts a message of a key, forgetting the key once none is left."""
+        self._pending[key] -= 1
+        if self._pending[key]:
+            return
+        del self._pending[key]
+        del self._queues[key]
+        if not self._pending:
+            self._drained.set()
+
+    async def stop(self, drain: bool = True) -> None:
+        """
+        Stops the worker tasks.
+
+        Args:
+            drain (bool, optional): Handle the queued messages first. Defaults to True.
+        """
+        if drain:
+            await self._drained.wait()
+        for task in self._tasks:
+            task.cancel()
+        await gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
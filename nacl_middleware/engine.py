@@ -0,0 +1,209 @@
+"""Framework agnostic core of the encrypted request protocol."""
+
+from collections.abc import Awaitable, Callable
+from logging import getLogger
+from sys import exc_info
+from traceback import format_exception
+from typing import NamedTuple, Optional, Tuple
+
+from nacl.public import PrivateKey
+
+from nacl_middleware.cache import KeyCache
+from nacl_middleware.deadline import DeadlinePolicy
+from nacl_middleware.lazy import LazyMessage, decrypt_message, load_message
+from nacl_middleware.nacl_utils import MailBox
+from nacl_middleware.sketch import HeavyHitters
+from nacl_middleware.tracing import NoopTracer, Tracer
+from nacl_middleware.typed import MessageDecoder, MessageValidationError, decoder_for
+from nacl_middleware.utils import is_excluded_path, validate_encrypted_message
+
+REJECT_REASON = "Failed to retrieve a valid message!"
+"""Reason phrase of rejected requests."""
+
+INVALID_REASON = "Invalid message!"
+"""Reason phrase of requests whose message does not match its declared type."""
+
+
+class Rejection(NamedTuple):
+    """Why a request was rejected, for the adapter to answer with its status."""
+
+    reason: str
+    body: str
+    status: int = 401
+
+
+class NaclEngine:
+    """
+    The encrypted request protocol, shared by the aiohttp and ASGI adapters.
+
+    Adapters extract the publicKey and encryptedMessage parameters their own way. The
+    engine validates them, resolves the client MailBox through the key cache, decrypts
+    the message, decodes it into its declared type if any, and describes rejections.
+
+    Attributes:
+        exclude_routes (Tuple): Patterns of the paths left unencrypted.
+        exclude_methods (Tuple): HTTP methods left unencrypted.
+        key_cache (KeyCache): Cache of the shared keys.
+        tracer (Tracer): Receives a span for each stage of a request.
+        lazy (bool): Whether parsing is deferred to the first access.
+        deadlines (Optional[DeadlinePolicy]): Sheds the requests whose deadline has passed.
+        heavy_hitters (Optional[HeavyHitters]): Counts the requests and encrypted bytes per client public key.
+        message_type (Optional[type]): Type the messages are decoded into, unless a route declares its own.
+    """
+
+    exclude_routes: Tuple
+    exclude_methods: Tuple
+    key_cache: KeyCache
+    tracer: Tracer
+    lazy: bool
+    deadlines: Optional[DeadlinePolicy]
+    heavy_hitters: Optional[HeavyHitters]
+    message_type: Optional[type]
+
+    def __init__(
+        self,
+        private_key: PrivateKey,
+        exclude_routes: Tuple = tuple(),
+        exclude_methods: Tuple = tuple(),
+        log=getLogger(),
+        max_ciphertext_size: Optional[int] = None,
+        max_plaintext_size: Optional[int] = None,
+        key_cache: Optional[KeyCache] = None,
+        tracer: Optional[Tracer] = None,
+        lazy: bool = False,
+        deadlines: Optional[DeadlinePolicy] = None,
+        heavy_hitters: Optional[HeavyHitters] = None,
+        message_type: Optional[type] = None,
+    ) -> None:
+        """
+        Initializes the engine. The arguments are the ones of nacl_middleware.
+
+        Args:
+            private_key (PrivateKey): The private key used for decryption.
+            exclude_routes (Tuple, optional): Tuple of routes to exclude from encryption/decryption. Defaults to an empty tuple.
+            exclude_methods (Tuple, optional): Tuple of HTTP methods to exclude from encryption/decryption. Defaults to an empty tuple.
+            log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+            max_ciphertext_size (Optional[int], optional): Maximum length of the encoded encryptedMessage. Defaults to no limit.
+            max_plaintext_size (Optional[int], optional): Maximum size in bytes of the decrypted message. Defaults to no limit.
+            key_cache (Optional[KeyCache], optional): Cache of the shared keys, built with the same private key. Defaults to an in-memory KeyCache.
+            tracer (Optional[Tracer], optional): Receives a span for each stage of a request. Defaults to a NoopTracer.
+            lazy (bool, optional): Return a LazyMessage, authenticated and decrypted but parsed on first access. Defaults to False.
+            deadlines (Optional[DeadlinePolicy], optional): Shed the requests whose deadline has passed. Defaults to None.
+            heavy_hitters (Optional[HeavyHitters], optional): Count the requests and encrypted bytes per client public key, once their message is authenticated. Defaults to None.
+            message_type (Optional[type], optional): Decode the messages into a dataclass, a TypedDict or a msgspec Struct. Defaults to plain JSON.
+        """
+        if lazy and deadlines is not None:
+            raise ValueError("Deadlines are verified on parsing, which lazy defers!")
+        self.exclude_routes = exclude_routes
+        self.exclude_methods = exclude_methods
+        self._log = log
+        self._max_ciphertext_size = max_ciphertext_size
+        self._max_plaintext_size = max_plaintext_size
+        self.key_cache = key_cache if key_cache is not None else KeyCache(private_key)
+        self.tracer = tracer if tracer is not None else NoopTracer()
+        self.lazy = lazy
+        self.deadlines = deadlines
+        self.heavy_hitters = heavy_hitters
+        self.message_type = message_type
+        self._decoder = decoder_for(message_type) if message_type is not None else None
+
+    def is_excluded(self, method: str, path: str) -> bool:
+        """
+        Tells whether a request is left unencrypted.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The request path.
+
+        Returns:
+            bool: True if the method or the path is excluded.
+        """
+        return method in self.exclude_methods or is_excluded_path(
+            path, self.exclude_routes
+        )
+
+    async def open(
+        self,
+        get_parameters: Callable[[], Awaitable[Tuple[str, str]]],
+        deadline_hint: Optional[str] = None,
+        message_type: Optional[type] = None,
+    ) -> Tuple[any, MailBox]:
+        """
+        Extracts, validates and decrypts the encrypted message of a request.
+
+        Args:
+            get_parameters (Callable[[], Awaitable[Tuple[str, str]]]): Returns the hex encoded client public key and the encrypted message, raising KeyError if missing.
+            deadline_hint (Optional[str], optional): The X-Nacl-Deadline header, if any. Defaults to None.
+            message_type (Optional[type], optional): Type declared by the route, over the engine one. Defaults to None.
+
+        Returns:
+            Tuple[any, MailBox]: The decrypted message, or a LazyMessage in lazy mode, and the MailBox shared with the client.
+
+        Raises:
+            DeadlineExceeded: If the request deadline has passed.
+            MessageValidationError: If the message does not match its declared type.
+            Exception: If a valid message cannot be retrieved.
+        """
+        log = self._log
+        deadlines = self.deadlines
+        if deadlines is not None:
+            deadlines.check_hint(deadline_hint)
+
+        log.debug("Retrieving publicKey and encryptedMessage from message...")
+        with self.tracer.span("nacl.parse"):
+            public_key, encrypted_message = await get_parameters()
+            validate_encrypted_message(
+                encrypted_message, self._max_ciphertext_size, self._max_plaintext_size
+            )
+        log.debug(
+            f"PublicKey {public_key} and EncryptedMessage {encrypted_message} retrieved!"
+        )
+
+        with self.tracer.span("nacl.key_lookup") as span:
+            mail_box, cache_hit = await self.key_cache.lookup(public_key)
+            span.set_attribute("nacl.cache_hit", cache_hit)
+
+        log.debug("Decrypting message...")
+        plaintext = decrypt_message(mail_box, encrypted_message, self.tracer)
+        # Only authenticated boxes are counted, so forged keys cannot steer the cache.
+        if self.heavy_hitters is not None:
+            self.heavy_hitters.record(public_key, len(encrypted_message))
+
+        decoder = self._decoder_for(message_type)
+        if self.lazy:
+            # The box is authenticated before any handler runs, only parsing waits.
+            log.debug("Deferring parsing...")
+            return LazyMessage(plaintext, self.tracer, log, decoder), mail_box
+
+        if deadlines is None:
+            message = load_message(plaintext, self.tracer, decoder)
+        else:
+            # The envelope is parsed as plain JSON, then its message is converted.
+            message = load_message(plaintext, self.tracer)
+            message = deadlines.open(message, deadline_hint)
+            if decoder is not None:
+                message = decoder.convert(message)
+        log.debug(f"Message {message} decrypted!")
+        return message, mail_box
+
+    def _decoder_for(self, message_type: Optional[type]) -> Optional[MessageDecoder]:
+        if message_type is None:
+            return self._decoder
+        return decoder_for(message_type)
+
+    def reject(self) -> Rejection:
+        """
+        Describes the exception being handled, to be called from an except block.
+
+        Messages that could be decrypted but do not match their declared type get
+        status 400, the other rejections 401.
+
+        Returns:
+            Rejection: The reason, the formatted exception and the status.
+        """
+        info = exc_info()
+        body = "".join(format_exception(*info))
+        self._log.debug(f"Exception body: {body}")
+        if isinstance(info[1], MessageValidationError):
+            return Rejection(INVALID_REASON, body, 400)
+        return Rejection(REJECT_REASON, body)
@@ -0,0 +1,250 @@
+"""Per-client fair scheduling of encrypted requests."""
+
+from asyncio import CancelledError, Future, get_running_loop
+from collections import OrderedDict, deque
+from collections.abc import Callable
+from logging import getLogger
+from typing import Deque, Dict, Optional, Set, Tuple
+
+from aiohttp.typedefs import Handler
+from aiohttp.web import HTTPTooManyRequests, Request, StreamResponse, middleware
+
+from nacl_middleware.utils import get_encrypted_parameters, is_exclude
+
+UNKNOWN_CLIENTS = "unknown"
+"""Key of the queue shared by the requests of unknown public keys."""
+
+
+class _Client:
+    __slots__ = ("queue", "deficit", "in_flight", "bytes_in_flight", "weight")
+
+    def __init__(self, weight: int) -> None:
+        self.queue: Deque[Tuple[Future, int]] = deque()
+        self.deficit = 0
+        self.in_flight = 0
+        self.bytes_in_flight = 0
+        self.weight = weight
+
+
+class FairScheduler:
+    """
+    Admits requests with deficit round robin across client public keys.
+
+    Add ``middleware`` before nacl_middleware, so decryption is scheduled too. The
+    requests of each client wait in their own bounded queue, and a client whose queue
+    is full gets 429 Too Many Requests. Whenever a slot frees, the clients are visited
+    in turn: each visit credits a client with quantum times its weight, and its queued
+    requests are admitted while their cost, the encrypted message length, fits the
+    credit. A client flooding large payloads thus gets its share of the slots and no
+    more, and the other clients keep their latency.
+
+    Requests are scheduled before decryption, so their publicKey parameter, read from
+    the query or the form body, is not authenticated yet. Only known keys get their own
+    queue: the ones known returns True for, such as the keys of a ClientRegistry, or by
+    default the keys whose requests were authenticated by nacl_middleware lately. The
+    requests of any other key, or without one, share a single queue, so rotating random
+    keys does not multiply the allowance of a client.
+
+    Attributes:
+        max_in_flight (int): Maximum number of requests handled at once.
+        max_in_flight_per_client (int): Maximum number of requests of a client handled at once.
+        max_bytes_in_flight_per_client (Optional[int]): Maximum total cost of the requests of a client handled at once.
+        max_queue_per_client (int): Maximum number of requests of a client waiting.
+        quantum (int): Cost credited to a client on each visit, times its weight.
+        max_known_clients (int): Number of authenticated keys remembered, without known.
+        admitted (int): Number of requests admitted.
+        rejected (int): Number of requests answered with 429.
+    """
+
+    max_in_flight: int
+    max_in_flight_per_client: int
+    max_bytes_in_flight_per_client: Optional[int]
+    max_queue_per_client: int
+    quantum: int
+    max_known_clients: int
+    admitted: int
+    rejected: int
+    _clients: Dict[str, _Client]
+    _active: Deque[str]
+    _active_keys: Set[str]
+    _authenticated: "OrderedDict[str, None]"
+
+    def __init__(
+        self,
+        max_in_flight: int = 64,
+        max_in_flight_per_client: int = 4,
+        max_queue_per_client: int = 16,
+        max_bytes_in_flight_per_client: Optional[int] = None,
+        quantum: int = 64 * 1024,
+        weight: Optional[Callable[[str], int]] = None,
+        exclude_routes: Tuple = tuple(),
+        known: Optional[Callable[[str], bool]] = None,
+        max_known_clients: int = 65536,
+        log=getLogger(),
+    ) -> None:
+        """
+        Initializes the scheduler.
+
+        Args:
+            max_in_flight (int, optional): Maximum number of requests handled at once. Defaults to 64.
+            max_in_flight_per_client (int, optional): Maximum number of requests of a client handled at once. Defaults to 4.
+            max_queue_per_client (int, optional): Maximum number of requests of a client waiting. Defaults to 16.
+            max_bytes_in_flight_per_client (Optional[int], optional): Maximum total cost of the requests of a client handled at once. Defaults to no limit.
+            quantum (int, optional): Cost credited to a client on each visit. Defaults to 64 KiB.
+            weight (Optional[Callable[[str], int]], optional): Returns the weight of a known hex encoded public key, at least 1. Defaults to 1 for every client.
+            exclude_routes (Tuple, optional): Routes left unscheduled, such as long lived WebSockets. Defaults to an empty tuple.
+            known (Optional[Callable[[str], bool]], optional): Tells whether a hex encoded public key gets its own queue, such as ClientRegistry.__contains__. Defaults to the keys authenticated lately.
+            max_known_clients (int, optional): Number of authenticated keys remembered, without known. Defaults to 65536.
+            log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+        """
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_client = max_in_flight_per_client
+        self.max_queue_per_client = max_queue_per_client
+        self.max_bytes_in_flight_per_client = max_bytes_in_flight_per_client
+        self.quantum = quantum
+        self._weight = weight
+        self._exclude_routes = exclude_routes
+        self._known = known
+        self.max_known_clients = max_known_clients
+        self._log = log
+        self.admitted = 0
+        self.rejected = 0
+        self._in_flight = 0
+        self._clients = {}
+        self._active = deque()
+        # Membership of _active, tested on every request.
+        self._active_keys = set()
+        self._authenticated = OrderedDict()
+
+    def stats(self) -> dict:
+        """
+        Returns the scheduler counters.
+
+        Returns:
+            dict: The admitted and rejected counters, and the current number of requests in flight and queued and of clients.
+        """
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "in_flight": self._in_flight,
+            "queued": sum(len(client.queue) for client in self._clients.values()),
+            "clients": len(self._clients),
+        }
+
+    def _blocked(self, client: _Client, cost: int) -> bool:
+        if client.in_flight >= self.max_in_flight_per_client:
+            return True
+        limit = self.max_bytes_in_flight_per_client
+        # A request larger than the limit still runs alone.
+        return (
+            limit is not None
+            and client.in_flight > 0
+            and client.bytes_in_flight + cost > limit
+        )
+
+    def _dispatch(self) -> None:
+        blocked = 0
+        while self._in_flight < self.max_in_flight and self._active:
+            key = self._active[0]
+            client = self._clients[key]
+            while client.queue and client.queue[0][0].done():
+                client.queue.popleft()
+            if not client.queue:
+                client.deficit = 0
+                self._active_keys.discard(self._active.popleft())
+                self._forget(key, client)
+                continue
+            waiter, cost = client.queue[0]
+            if self._blocked(client, cost):
+                blocked += 1
+                if blocked >= len(self._active):
+                    return
+                self._active.rotate(-1)
+                continue
+            blocked = 0
+            if cost > client.deficit:
+                client.deficit += self.quantum * client.weight
+                self._active.rotate(-1)
+                continue
+            client.deficit -= cost
+            client.queue.popleft()
+            client.in_flight += 1
+            client.bytes_in_flight += cost
+            self._in_flight += 1
+            waiter.set_result(None)
+
+    def _forget(self, key: str, client: _Client) -> None:
+        if not client.queue and not client.in_flight:
+            self._clients.pop(key, None)
+
+    def _release(self, key: str, client: _Client, cost: int) -> None:
+        client.in_flight -= 1
+        client.bytes_in_flight -= cost
+        self._in_flight -= 1
+        if key not in self._active_keys:
+            self._forget(key, client)
+        self._dispatch()
+
+    def _is_known(self, key: str) -> bool:
+        if self._known is not None:
+            return self._known(key)
+        if key in self._authenticated:
+            self._authenticated.move_to_end(key)
+            return True
+        return False
+
+    def _authenticate(self, key: str) -> None:
+        self._authenticated[key] = None
+        self._authenticated.move_to_end(key)
+        if len(self._authenticated) > self.max_known_clients:
+            self._authenticated.popitem(last=False)
+
+    def _weight_of(self, key: str) -> int:
+        if key == UNKNOWN_CLIENTS or self._weight is None:
+            return 1
+        weight = self._weight(key)
+        if not isinstance(weight, int) or weight < 1:
+            raise ValueError(f"Weight of {key} must be an integer of at least 1!")
+        return weight
+
+    @middleware
+    async def middleware(self, request: Request, handler: Handler) -> StreamResponse:
+        if is_exclude(request, self._exclude_routes):
+            return await handler(request)
+        try:
+            public_key, encrypted_message = await get_encrypted_parameters(request)
+        except KeyError:
+            public_key, encrypted_message = None, ""
+        known = public_key is not None and self._is_known(public_key)
+        key = public_key if known else UNKNOWN_CLIENTS
+        cost = len(encrypted_message) or (request.content_length or 0)
+
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = _Client(self._weight_of(key))
+        if len(client.queue) >= self.max_queue_per_client:
+            self.rejected += 1
+            self._log.debug(f"Queue of {key} is full")
+            raise HTTPTooManyRequests(reason="Too many queued requests!")
+
+        waiter = get_running_loop().create_future()
+        client.queue.append((waiter, cost))
+        if key not in self._active_keys:
+            self._active_keys.add(key)
+            self._active.append(key)
+        self._dispatch()
+        try:
+            await waiter
+        except CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(key, client, cost)
+            else:
+                self._dispatch()
+            raise
+        self.admitted += 1
+        try:
+            return await handler(request)
+        finally:
+            self._release(key, client, cost)
+            if not known and self._known is None and request.get("mail_box") is not None:
+                self._authenticate(public_key)
@@ -0,0 +1,240 @@
+"""Group encryption: encrypt a broadcast once for every subscriber of a topic."""
+
+from collections import OrderedDict
+from collections.abc import Hashable
+from json import dumps, loads
+from typing import Dict
+
+from nacl.encoding import Base64Encoder
+from nacl.secret import SecretBox
+from nacl.utils import random
+
+from nacl_middleware.nacl_utils import MailBox
+
+
+class Group:
+    """
+    The members of a topic and the symmetric key they share.
+
+    Each member receives the group key once, boxed through its own MailBox. Every
+    broadcast is then encrypted a single time with SecretBox and the identical text
+    is sent to every member. The key goes stale when a member leaves and, unless
+    disabled, when a member joins. A stale key is rotated once by rotate, however many
+    members came and went, and must be before the next broadcast. A new epoch starts
+    with each rotation.
+
+    Every member holds the group key, so a group message only proves it comes from
+    some member, not necessarily from the server.
+
+    Attributes:
+        topic (str): The topic.
+        epoch (int): The key generation, incremented on every rotation.
+        rotate_on_join (bool): Whether joining rotates the key.
+    """
+
+    topic: str
+    epoch: int
+    rotate_on_join: bool
+    _members: Dict[Hashable, MailBox]
+    _key: bytes
+    _box: SecretBox
+    _stale: bool
+
+    def __init__(self, topic: str, rotate_on_join: bool = True) -> None:
+        """
+        Initializes the group with a fresh key.
+
+        Args:
+            topic (str): The topic.
+            rotate_on_join (bool, optional): Rotate the key when a member joins, so new members cannot read earlier broadcasts. Defaults to True.
+        """
+        self.topic = topic
+        self.rotate_on_join = rotate_on_join
+        self.epoch = 0
+        self._members = {}
+        self._stale = False
+        self._rotate()
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __contains__(self, member: Hashable) -> bool:
+        return member in self._members
+
+    @property
+    def stale(self) -> bool:
+        """Whether the membership changed since the key was last rotated."""
+        return self._stale
+
+    def _rotate(self) -> None:
+        self.epoch += 1
+        self._key = random(SecretBox.KEY_SIZE)
+        self._box = SecretBox(self._key)
+
+    def key_message(self, mail_box: MailBox) -> str:
+        """
+        Boxes the current group key for one member.
+
+        Args:
+            mail_box (MailBox): The MailBox shared with the member.
+
+        Returns:
+            str: The encrypted key message.
+        """
+        return mail_box.box(
+            {
+                "topic": self.topic,
+                "epoch": self.epoch,
+                "groupKey": Base64Encoder.encode(self._key).decode(),
+            }
+        )
+
+    def _key_messages(self) -> Dict[Hashable, str]:
+        return {
+            member: self.key_message(mail_box)
+            for member, mail_box in self._members.items()
+        }
+
+    def join(self, member: Hashable, mail_box: MailBox) -> Dict[Hashable, str]:
+        """
+        Adds a member. With rotate_on_join, the key goes stale and the member gets
+        the next one from rotate.
+
+        Args:
+            member (Hashable): The member, such as its socket.
+            mail_box (MailBox): The MailBox shared with the member.
+
+        Returns:
+            Dict[Hashable, str]: The key message to deliver to the member now, if any.
+        """
+        self._members[member] = mail_box
+        if self.rotate_on_join:
+            self._stale = True
+        if self._stale:
+            return {}
+        return {member: self.key_message(mail_box)}
+
+    def leave(self, member: Hashable) -> bool:
+        """
+        Removes a member, making the key stale so it cannot read later broadcasts.
+
+        Args:
+            member (Hashable): The member.
+
+        Returns:
+            bool: Whether it was a member.
+        """
+        if self._members.pop(member, None) is None:
+            return False
+        self._stale = True
+        return True
+
+    def rotate(self) -> Dict[Hashable, str]:
+        """
+        Rotates a stale key.
+
+        Returns:
+            Dict[Hashable, str]: The key messages to deliver, by member, or none if the key was not stale.
+        """
+        if not self._stale:
+            return {}
+        self._stale = False
+        self._rotate()
+        return self._key_messages()
+
+    def box(self, message: any) -> str:
+        """
+        Encrypts a broadcast once for every member.
+
+        Args:
+            message (any): The message.
+
+        Returns:
+            str: The group envelope, a JSON object with the topic, epoch and ciphertext.
+
+        Raises:
+            RuntimeError: If the key is stale.
+        """
+        if self._stale:
+            raise RuntimeError(f"Key of {self.topic} must be rotated first!")
+        encrypted = self._box.encrypt(dumps(message).encode(), encoder=Base64Encoder)
+        return dumps(
+            {
+                "topic": self.topic,
+                "epoch": self.epoch,
+                "groupMessage": encrypted.decode(),
+            }
+        )
+
+
+def is_group_envelope(text: str) -> bool:
+    """
+    Tells group envelopes apart from MailBox boxed messages, which are base64.
+
+    Args:
+        text (str): The received text.
+
+    Returns:
+        bool: Whether text is a group envelope.
+    """
+    return text.startswith("{")
+
+
+class GroupKeyring:
+    """
+    Client side counterpart of Group: keeps the received group keys and decrypts.
+
+    A few past epochs are kept per topic, so broadcasts sent right before a rotation
+    can still be read.
+
+    Attributes:
+        mail_box (MailBox): The MailBox shared with the server.
+        max_epochs (int): Number of epochs kept per topic.
+    """
+
+    mail_box: MailBox
+    max_epochs: int
+    _keys: Dict[str, "OrderedDict[int, SecretBox]"]
+
+    def __init__(self, mail_box: MailBox, max_epochs: int = 2) -> None:
+        self.mail_box = mail_box
+        self.max_epochs = max_epochs
+        self._keys = {}
+
+    def receive_key(self, key_message: dict) -> None:
+        """
+        Stores a decrypted key message.
+
+        Args:
+            key_message (dict): The decrypted key message.
+        """
+        keys = self._keys.setdefault(key_message["topic"], OrderedDict())
+        keys[key_message["epoch"]] = SecretBox(
+            key_message["groupKey"], encoder=Base64Encoder
+        )
+        while len(keys) > self.max_epochs:
+            keys.popitem(last=False)
+
+    def unbox(self, text: str) -> any:
+        """
+        Decrypts a group envelope or a MailBox boxed message.
+
+        Key messages are stored and returned as they are.
+
+        Args:
+            text (str): The received text.
+
+        Returns:
+            any: The decrypted message.
+
+        Raises:
+            KeyError: If the key of the envelope's epoch is unknown.
+        """
+        if not is_group_envelope(text):
+            message = self.mail_box.unbox(text)
+            if isinstance(message, dict) and "groupKey" in message:
+                self.receive_key(message)
+            return message
+        envelope = loads(text)
+        box: SecretBox = self._keys[envelope["topic"]][envelope["epoch"]]
+        return loads(box.decrypt(envelope["groupMessage"], encoder=Base64Encoder))
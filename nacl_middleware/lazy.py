@@ -0,0 +1,172 @@
+"""Parsing of the request message on first access."""
+
+from logging import getLogger
+from typing import Optional
+
+from aiohttp.web import HTTPBadRequest, HTTPUnauthorized, Request
+
+from nacl_middleware.nacl_utils import MailBox, custom_loads
+from nacl_middleware.tracing import NoopTracer, Tracer
+from nacl_middleware.typed import MessageDecoder, MessageValidationError
+
+_missing = object()
+
+
+def decrypt_message(mail_box: MailBox, encrypted_message: str, tracer: Tracer) -> bytes:
+    """
+    Authenticates and decrypts a message, tracing the nacl.decrypt stage.
+
+    Args:
+        mail_box (MailBox): The MailBox shared with the client.
+        encrypted_message (str): The encrypted message.
+        tracer (Tracer): Receives the nacl.decrypt span.
+
+    Returns:
+        bytes: The plaintext.
+    """
+    with tracer.span("nacl.decrypt") as span:
+        span.set_attribute("nacl.ciphertext_size", len(encrypted_message))
+        plaintext = mail_box.decrypt(encrypted_message)
+        span.set_attribute("nacl.plaintext_size", len(plaintext))
+    return plaintext
+
+
+def load_message(
+    plaintext: bytes, tracer: Tracer, decoder: Optional[MessageDecoder] = None
+) -> any:
+    """
+    Parses a decrypted message, tracing the nacl.loads stage.
+
+    Args:
+        plaintext (bytes): The plaintext.
+        tracer (Tracer): Receives the nacl.loads span.
+        decoder (Optional[MessageDecoder], optional): Decodes the message into its declared type. Defaults to plain JSON.
+
+    Returns:
+        any: The parsed message.
+
+    Raises:
+        MessageValidationError: If the message does not match its declared type.
+    """
+    with tracer.span("nacl.loads"):
+        if decoder is not None:
+            return decoder.decode(plaintext)
+        return custom_loads(plaintext)
+
+
+def open_message(
+    mail_box: MailBox,
+    encrypted_message: str,
+    tracer: Tracer,
+    decoder: Optional[MessageDecoder] = None,
+) -> any:
+    """
+    Decrypts and parses a message, tracing both stages.
+
+    Args:
+        mail_box (MailBox): The MailBox shared with the client.
+        encrypted_message (str): The encrypted message.
+        tracer (Tracer): Receives the nacl.decrypt and nacl.loads spans.
+        decoder (Optional[MessageDecoder], optional): Decodes the message into its declared type. Defaults to plain JSON.
+
+    Returns:
+        any: The decrypted message.
+
+    Raises:
+        MessageValidationError: If the message does not match its declared type.
+    """
+    plaintext = decrypt_message(mail_box, encrypted_message, tracer)
+    return load_message(plaintext, tracer, decoder)
+
+
+class LazyMessage:
+    """
+    An authenticated plaintext parsed on the first call to get.
+
+    Stored as request["decrypted_message"] by nacl_middleware in lazy mode. The
+    message is authenticated and decrypted before the handler runs, so only the
+    parsing is deferred.
+
+    Attributes:
+        plaintext (Optional[bytes]): The decrypted message, until it is parsed.
+    """
+
+    __slots__ = (
+        "plaintext",
+        "_tracer",
+        "_log",
+        "_decoder",
+        "_message",
+    )
+
+    def __init__(
+        self,
+        plaintext: bytes,
+        tracer: Tracer = NoopTracer(),
+        log=getLogger(),
+        decoder: Optional[MessageDecoder] = None,
+    ) -> None:
+        """
+        Initializes the lazy message.
+
+        Args:
+            plaintext (bytes): The authenticated plaintext.
+            tracer (Tracer, optional): Receives the nacl.loads span. Defaults to a NoopTracer.
+            log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+            decoder (Optional[MessageDecoder], optional): Decodes the message into its declared type. Defaults to plain JSON.
+        """
+        self.plaintext = plaintext
+        self._tracer = tracer
+        self._log = log
+        self._decoder = decoder
+        self._message = _missing
+
+    @property
+    def opened(self) -> bool:
+        """Whether the message was parsed."""
+        return self._message is not _missing
+
+    def get(self) -> any:
+        """
+        Returns the decrypted message, parsing it on the first call.
+
+        Returns:
+            any: The decrypted message.
+
+        Raises:
+            HTTPUnauthorized: If the message cannot be parsed.
+            HTTPBadRequest: If the message does not match its declared type.
+        """
+        if self._message is _missing:
+            try:
+                self._message = load_message(self.plaintext, self._tracer, self._decoder)
+            except MessageValidationError as e:
+                self._log.debug(f"Invalid message: {e}")
+                raise HTTPBadRequest(reason="Invalid message!", text=str(e)) from e
+            except Exception as e:
+                self._log.debug(f"Failed to open message: {e}")
+                raise HTTPUnauthorized(
+                    reason="Failed to retrieve a valid message!"
+                ) from e
+            self.plaintext = None
+        return self._message
+
+
+def decrypted_message(request: Request) -> any:
+    """
+    Returns the decrypted message of a request, whether the middleware is lazy or not.
+
+    Args:
+        request (Request): The request.
+
+    Returns:
+        any: The decrypted message.
+
+    Raises:
+        HTTPUnauthorized: If the message cannot be decrypted or parsed.
+        HTTPBadRequest: If the message does not match its declared type.
+    """
+    message = request["decrypted_message"]
+    if isinstance(message, LazyMessage):
+        return message.get()
+    return message
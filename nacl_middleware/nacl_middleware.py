@@ -1,13 +1,14 @@
+from functools import partial
 from inspect import signature
 from logging import getLogger
-from operator import itemgetter
-from sys import exc_info
 from traceback import format_exception
-from typing import Tuple
+from typing import Optional, Tuple
 
 from aiohttp import WSCloseCode
 from aiohttp.typedefs import Handler, Middleware
 from aiohttp.web import (
+    HTTPBadRequest,
+    HTTPServiceUnavailable,
     HTTPUnauthorized,
     Request,
     Response,
@@ -17,10 +18,14 @@ from aiohttp.web import (
 )
 from nacl.public import PrivateKey
 
-from nacl_middleware.nacl_utils import MailBox
-from nacl_middleware.utils import is_exclude
-
-mailBoxes = {}
+from nacl_middleware.cache import KeyCache
+from nacl_middleware.deadline import DEADLINE_HEADER, DeadlineExceeded, DeadlinePolicy
+from nacl_middleware.engine import NaclEngine
+from nacl_middleware.sketch import HeavyHitters
+from nacl_middleware.sse import EventStream
+from nacl_middleware.tracing import Tracer
+from nacl_middleware.typed import MESSAGE_TYPE_ATTRIBUTE
+from nacl_middleware.utils import get_encrypted_parameters
 
 
 def nacl_middleware(
@@ -28,6 +33,14 @@ def nacl_middleware(
     exclude_routes: Tuple = tuple(),
     exclude_methods: Tuple = tuple(),
     log=getLogger(),
+    max_ciphertext_size: Optional[int] = None,
+    max_plaintext_size: Optional[int] = None,
+    key_cache: Optional[KeyCache] = None,
+    tracer: Optional[Tracer] = None,
+    lazy: bool = False,
+    deadlines: Optional[DeadlinePolicy] = None,
+    heavy_hitters: Optional[HeavyHitters] = None,
+    message_type: Optional[type] = None,
 ) -> Middleware:
     """
     Middleware function that handles NaCl encryption and decryption.
@@ -37,34 +50,34 @@ def nacl_middleware(
         exclude_routes (Tuple, optional): Tuple of routes to exclude from encryption/decryption. Defaults to an empty tuple.
         exclude_methods (Tuple, optional): Tuple of HTTP methods to exclude from encryption/decryption. Defaults to an empty tuple.
         log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+        max_ciphertext_size (Optional[int], optional): Maximum length of the encoded encryptedMessage. Defaults to no limit.
+        max_plaintext_size (Optional[int], optional): Maximum size in bytes of the decrypted message. Defaults to no limit.
+        key_cache (Optional[KeyCache], optional): Cache of the shared keys, built with the same private key. Defaults to an in-memory KeyCache.
+        tracer (Optional[Tracer], optional): Receives a span for each stage of a request. Defaults to a NoopTracer.
+        lazy (bool, optional): Authenticate and decrypt the message, but store a LazyMessage as request["decrypted_message"], parsed on first access. Defaults to False.
+        deadlines (Optional[DeadlinePolicy], optional): Answer the requests whose deadline has passed with 503 instead of running their handler. Defaults to None.
+        heavy_hitters (Optional[HeavyHitters], optional): Count the requests and encrypted bytes per client public key, once their message is authenticated. Defaults to None.
+        message_type (Optional[type], optional): Decode the messages into a dataclass, a TypedDict or a msgspec Struct, unless the route declares its own with the message_type decorator. Messages that do not match get 400 instead of 401. Defaults to plain JSON.
 
     Returns:
         Middleware: The middleware function.
 
     """
 
-    def nacl_decryptor(public_key, encrypted_message) -> Tuple[any, MailBox]:
-        """
-        Decrypts the encrypted message using the public key.
-
-        Args:
-            public_key: The public key used for encryption.
-            encrypted_message: The encrypted message to decrypt.
-
-        Returns:
-            Tuple[any, MailBox]: A tuple containing the decrypted message and the MailBox object.
-
-        """
-        if public_key in mailBoxes:
-            my_mail_box = mailBoxes[public_key]
-        else:
-            my_mail_box = MailBox(private_key, public_key)
-            mailBoxes[public_key] = my_mail_box
-
-        log.debug("Decrypting message...")
-        message = my_mail_box.unbox(encrypted_message)
-        log.debug(f"Message {message} decrypted!")
-        return message, my_mail_box
+    engine = NaclEngine(
+        private_key,
+        exclude_routes,
+        exclude_methods,
+        log,
+        max_ciphertext_size,
+        max_plaintext_size,
+        key_cache,
+        tracer,
+        lazy,
+        deadlines,
+        heavy_hitters,
+        message_type,
+    )
 
     @middleware
     async def returned_middleware(request: Request, handler: Handler) -> StreamResponse:
@@ -80,40 +93,43 @@ def nacl_middleware(
 
         Raises:
             HTTPUnauthorized: If a valid message cannot be retrieved.
+            HTTPBadRequest: If the message does not match its declared type.
+            HTTPServiceUnavailable: If the request deadline has passed.
 
         """
-        if not (
-            is_exclude(request, exclude_routes) or request.method in exclude_methods
-        ):
+        if engine.is_excluded(request.method, request.path):
+            return await handler(request)
 
+        with engine.tracer.span("nacl.request") as request_span:
+            request_span.set_attribute("http.method", request.method)
+            request_span.set_attribute("http.target", request.path)
             try:
-                log.debug("Retrieving publicKey and encryptedMessage from message...")
-                publicKey, encryptedMessage = itemgetter(
-                    "publicKey", "encryptedMessage"
-                )(request.query)
-                log.debug(
-                    f"PublicKey {publicKey} and EncryptedMessage {encryptedMessage} retrieved!"
-                )
-
-                decrypted_message, my_mail_box = nacl_decryptor(
-                    publicKey, encryptedMessage
+                decrypted_message, my_mail_box = await engine.open(
+                    partial(get_encrypted_parameters, request),
+                    request.headers.get(DEADLINE_HEADER),
+                    getattr(handler, MESSAGE_TYPE_ATTRIBUTE, None),
                 )
 
                 request["mail_box"] = my_mail_box
                 request["decrypted_message"] = decrypted_message
+            except DeadlineExceeded as e:
+                request_span.set_attribute("nacl.shed", True)
+                raise HTTPServiceUnavailable(
+                    reason="Request deadline has passed!"
+                ) from e
             except Exception:
-                the_exc_info = exc_info()
-                exception_str = "".join(format_exception(*the_exc_info))
-                log.debug(f"Exception body: {exception_str}")
-                exception = HTTPUnauthorized(
-                    reason="Failed to retrieve a valid message!", body=exception_str
+                request_span.set_attribute("nacl.rejected", True)
+                rejection = engine.reject()
+                exception_type = (
+                    HTTPBadRequest if rejection.status == 400 else HTTPUnauthorized
                 )
+                exception = exception_type(reason=rejection.reason, body=rejection.body)
 
                 # Inspect the handler's signature
                 return_annotation = signature(handler).return_annotation
                 if return_annotation == WebSocketResponse:
                     log.debug("WebSocketResponse hook.")
-                    log.debug(f"Exception is {exception_str}")
+                    log.debug(f"Exception is {rejection.body}")
                     socket = WebSocketResponse()
                     await socket.prepare(request)
                     await socket.close(
@@ -121,7 +137,7 @@ def nacl_middleware(
                         message="".join(format_exception(exception)),
                     )
                     return socket
-                elif return_annotation == Response:
+                elif return_annotation in (Response, EventStream):
                     log.debug("Response hook.")
                     log.debug(f"headers: {exception.headers}")
                     log.debug(f"status: {exception.status}")
@@ -134,6 +150,7 @@ def nacl_middleware(
                         body=exception.body,
                     )
 
-        return await handler(request)
+            with engine.tracer.span("nacl.handler"):
+                return await handler(request)
 
     return returned_middleware
@@ -1,8 +1,15 @@
 from json import dumps, loads
 from typing import Union
 
+from nacl.bindings import (
+    crypto_box_BEFORENMBYTES,
+    crypto_box_easy_afternm,
+    crypto_box_NONCEBYTES,
+    crypto_box_open_easy_afternm,
+)
 from nacl.encoding import Base64Encoder, HexEncoder
 from nacl.public import Box, PrivateKey, PublicKey
+from nacl.utils import random
 
 
 class Nacl:
@@ -12,10 +19,10 @@ class Nacl:
 
     private_key: PrivateKey
 
-    def __init__(
-        self, private_key: PrivateKey = PrivateKey.generate(), encoder=HexEncoder
-    ) -> None:
-        self.private_key = private_key
+    def __init__(self, private_key: PrivateKey = None, encoder=HexEncoder) -> None:
+        self.private_key = (
+            private_key if private_key is not None else PrivateKey.generate()
+        )
         self.encoder = encoder
 
     def _decode(self, parameter: Union[PrivateKey, PublicKey]) -> str:
@@ -66,8 +73,16 @@ def custom_loads(obj) -> any:
 
 
 class MailBox:
-    _private_key: PrivateKey
-    _box: Box
+    """
+    Encrypts and decrypts the messages exchanged with one peer.
+
+    Only the 32 bytes shared key precomputed from the key pair is kept, in a slotted
+    object, so caching many MailBoxes costs little memory.
+    """
+
+    __slots__ = ("_shared_key",)
+
+    _shared_key: bytes
 
     def __init__(self, private_key: PrivateKey, hex_public_key: str) -> None:
         """
@@ -80,8 +95,68 @@ class MailBox:
         Returns:
         None
         """
-        self._private_key = private_key
-        self._box = Box(self._private_key, PublicKey(hex_public_key, HexEncoder))
+        self._shared_key = Box(
+            private_key, PublicKey(hex_public_key, HexEncoder)
+        ).shared_key()
+
+    @classmethod
+    def from_shared_key(cls, shared_key: bytes) -> "MailBox":
+        """
+        Builds a MailBox straight from a precomputed shared key, skipping the key exchange.
+
+        Parameters:
+        shared_key (bytes): The shared key returned by shared_key().
+
+        Returns:
+        MailBox: The MailBox wrapping the shared key.
+        """
+        if len(shared_key) != crypto_box_BEFORENMBYTES:
+            raise ValueError(
+                f"Shared key must be {crypto_box_BEFORENMBYTES} bytes long!"
+            )
+        mail_box = cls.__new__(cls)
+        mail_box._shared_key = bytes(shared_key)
+        return mail_box
+
+    def shared_key(self) -> bytes:
+        """
+        Returns the precomputed shared key.
+
+        Returns:
+        bytes: The 32 bytes shared key.
+        """
+        return self._shared_key
+
+    def decrypt(self, encrypted_message: str) -> bytes:
+        """
+        Decrypts the encrypted message without parsing it.
+
+        Parameters:
+        encrypted_message (str): The base64 encoded nonce and ciphertext.
+
+        Returns:
+        bytes: The plaintext.
+        """
+        encrypted = Base64Encoder.decode(encrypted_message)
+        return crypto_box_open_easy_afternm(
+            encrypted[crypto_box_NONCEBYTES:],
+            encrypted[:crypto_box_NONCEBYTES],
+            self._shared_key,
+        )
+
+    def encrypt(self, plaintext: bytes) -> str:
+        """
+        Encrypts the plaintext with a random nonce.
+
+        Parameters:
+        plaintext (bytes): The plaintext.
+
+        Returns:
+        str: The base64 encoded nonce and ciphertext.
+        """
+        nonce = random(crypto_box_NONCEBYTES)
+        encrypted = crypto_box_easy_afternm(plaintext, nonce, self._shared_key)
+        return Base64Encoder.encode(nonce + encrypted).decode()
 
     def unbox(self, encrypted_message: str) -> any:
         """
@@ -93,8 +168,7 @@ class MailBox:
         Returns:
         any: The decrypted message.
         """
-        decrypted_message = self._box.decrypt(encrypted_message, encoder=Base64Encoder)
-        return custom_loads(decrypted_message)
+        return custom_loads(self.decrypt(encrypted_message))
 
     def box(self, message: any) -> str:
         """
@@ -106,4 +180,4 @@ class MailBox:
         Returns:
         str: The encrypted message as a string.
         """
-        return self._box.encrypt(dumps(message).encode(), encoder=Base64Encoder).decode()
+        return self.encrypt(dumps(message).encode())
@@ -0,0 +1,321 @@
+"""Pytest plugin with fixtures for fast in-process testing of encrypted applications.
+
+The plugin is registered through the ``pytest11`` entry point, so installing the
+package is enough to use its fixtures:
+
+.. code-block:: python
+
+    async def test_thanks(nacl_client, nacl_server_keys, nacl_recorder):
+        app = Application(
+            middlewares=[
+                nacl_middleware(nacl_server_keys.private_key),
+                nacl_recorder.middleware,
+            ]
+        )
+        app.router.add_get("/handle_thanks", thanks_handler)
+        client = await nacl_client(app)
+        assert await client.send("/handle_thanks", "Thank you!") == "You are welcome!"
+        nacl_recorder.assert_received("Thank you!", path="/handle_thanks")
+
+Coroutine tests requesting ``nacl_loop``, or ``nacl_client`` which depends on it, run
+in the ``nacl_loop`` event loop. Tests using only the other fixtures need another way
+to run coroutines, such as pytest-asyncio. Servers bind an ephemeral localhost port, so tests can run in parallel.
+"""
+
+from asyncio import AbstractEventLoop, new_event_loop
+from inspect import iscoroutinefunction, signature
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from aiohttp import ClientResponse, ClientWebSocketResponse, WSMsgType
+from aiohttp.test_utils import TestClient, TestServer
+from aiohttp.typedefs import Handler
+from aiohttp.web import Application, Request, StreamResponse, middleware
+from pytest import fixture, hookimpl
+
+from nacl_middleware.lazy import decrypted_message
+from nacl_middleware.nacl_utils import MailBox, Nacl
+
+
+class NaclWebSocket:
+    """
+    An encrypted WebSocket connection opened by NaclTestClient.ws_connect.
+
+    Attributes:
+        socket (ClientWebSocketResponse): The underlying client WebSocket.
+    """
+
+    socket: ClientWebSocketResponse
+
+    def __init__(self, socket: ClientWebSocketResponse, mail_box: MailBox) -> None:
+        self.socket = socket
+        self._mail_box = mail_box
+
+    async def send(self, message: any) -> None:
+        """
+        Encrypts and sends a message.
+
+        Args:
+            message (any): The message to send.
+        """
+        await self.socket.send_str(self._mail_box.box(message))
+
+    async def receive(self) -> any:
+        """
+        Receives and decrypts the next text message.
+
+        Returns:
+            any: The decrypted message.
+        """
+        message = await self.socket.receive()
+        assert message.type == WSMsgType.TEXT, f"Unexpected message {message}"
+        return self._mail_box.unbox(message.data)
+
+    async def receive_json(self) -> any:
+        """
+        Receives the next message as plain JSON, as sent with send_json.
+
+        Returns:
+            any: The parsed message.
+        """
+        return await self.socket.receive_json()
+
+    async def close(self) -> None:
+        """Closes the connection."""
+        await self.socket.close()
+
+
+class NaclTestClient:
+    """
+    An in-process client that encrypts its requests for an application served by TestServer.
+
+    Attributes:
+        client (TestClient): The underlying aiohttp test client.
+        keys (Nacl): The client key pair.
+        mail_box (MailBox): The MailBox shared with the server.
+    """
+
+    client: TestClient
+    keys: Nacl
+    mail_box: MailBox
+
+    def __init__(
+        self, client: TestClient, keys: Nacl, server_hex_public_key: str
+    ) -> None:
+        self.client = client
+        self.keys = keys
+        self.mail_box = MailBox(keys.private_key, server_hex_public_key)
+        self._hex_public_key = keys.decoded_public_key()
+
+    def params(self, message: any) -> dict:
+        """
+        Returns the query parameters carrying an encrypted message.
+
+        Args:
+            message (any): The message to encrypt.
+
+        Returns:
+            dict: The publicKey and encryptedMessage parameters.
+        """
+        return {
+            "publicKey": self._hex_public_key,
+            "encryptedMessage": self.mail_box.box(message),
+        }
+
+    def box(self, message: any) -> str:
+        """Encrypts a message for the server."""
+        return self.mail_box.box(message)
+
+    def unbox(self, encrypted_message: str) -> any:
+        """Decrypts a message from the server."""
+        return self.mail_box.unbox(encrypted_message)
+
+    async def request(
+        self, method: str, path: str, message: any, **kwargs
+    ) -> ClientResponse:
+        """
+        Sends a request with the encrypted message in its query.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The request path.
+            message (any): The message to encrypt.
+            **kwargs: Extra arguments for TestClient.request.
+
+        Returns:
+            ClientResponse: The raw response.
+        """
+        return await self.client.request(
+            method, path, params=self.params(message), **kwargs
+        )
+
+    async def get(self, path: str, message: any, **kwargs) -> ClientResponse:
+        """Sends a GET request with the encrypted message in its query."""
+        return await self.request("GET", path, message, **kwargs)
+
+    async def send(self, path: str, message: any, method: str = "GET", **kwargs) -> any:
+        """
+        Sends an encrypted message and returns the decrypted reply.
+
+        Args:
+            path (str): The request path.
+            message (any): The message to encrypt.
+            method (str, optional): The HTTP method. Defaults to "GET".
+            **kwargs: Extra arguments for TestClient.request.
+
+        Returns:
+            any: The decrypted response body.
+        """
+        response = await self.request(method, path, message, **kwargs)
+        text = await response.text()
+        assert response.status == 200, f"Unexpected status {response.status}: {text}"
+        return self.unbox(text)
+
+    async def ws_connect(self, path: str, message: any, **kwargs) -> NaclWebSocket:
+        """
+        Opens a WebSocket authenticated with an encrypted message.
+
+        Args:
+            path (str): The WebSocket path.
+            message (any): The message to encrypt in the query.
+            **kwargs: Extra arguments for TestClient.ws_connect.
+
+        Returns:
+            NaclWebSocket: The encrypted connection.
+        """
+        socket = await self.client.ws_connect(
+            path, params=self.params(message), **kwargs
+        )
+        return NaclWebSocket(socket, self.mail_box)
+
+    async def close(self) -> None:
+        """Closes the client and its server."""
+        await self.client.close()
+
+
+class DecryptedMessageRecorder:
+    """
+    Records the decrypted messages seen by the application.
+
+    Add ``middleware`` after nacl_middleware to record request["decrypted_message"].
+    Lazy messages are decrypted by the recorder.
+
+    Attributes:
+        messages (List[Tuple[str, any]]): The recorded (path, decrypted message) pairs.
+    """
+
+    messages: List[Tuple[str, any]]
+
+    def __init__(self) -> None:
+        self.messages = []
+
+    @middleware
+    async def middleware(self, request: Request, handler: Handler) -> StreamResponse:
+        if "decrypted_message" in request:
+            self.messages.append((request.path, decrypted_message(request)))
+        return await handler(request)
+
+    def received(self, path: Optional[str] = None) -> list:
+        """
+        Returns the decrypted messages, optionally only those sent to path.
+
+        Args:
+            path (Optional[str], optional): The request path. Defaults to all paths.
+
+        Returns:
+            list: The decrypted messages.
+        """
+        return [
+            message
+            for message_path, message in self.messages
+            if path is None or message_path == path
+        ]
+
+    def assert_received(self, message: any, path: Optional[str] = None) -> None:
+        """
+        Asserts that message was decrypted, optionally for a request to path.
+
+        Args:
+            message (any): The expected decrypted message.
+            path (Optional[str], optional): The request path. Defaults to any path.
+        """
+        received = self.received(path)
+        assert message in received, f"{message!r} not in {received!r}"
+
+
+@hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem) -> Optional[bool]:
+    """
+    Runs coroutine tests requesting nacl_loop, directly or through nacl_client, in it.
+    """
+    if not (iscoroutinefunction(pyfuncitem.obj) and "nacl_loop" in pyfuncitem.funcargs):
+        return None
+    loop: AbstractEventLoop = pyfuncitem.funcargs["nacl_loop"]
+    parameters = signature(pyfuncitem.obj).parameters
+    arguments = {
+        name: value for name, value in pyfuncitem.funcargs.items() if name in parameters
+    }
+    loop.run_until_complete(pyfuncitem.obj(**arguments))
+    return True
+
+
+@fixture
+def nacl_loop() -> Iterator[AbstractEventLoop]:
+    """A fresh event loop, closed after the test."""
+    loop = new_event_loop()
+    yield loop
+    loop.close()
+
+
+@fixture(scope="session")
+def nacl_server_keys() -> Nacl:
+    """The server key pair, generated once per session."""
+    return Nacl()
+
+
+@fixture
+def nacl_client_keys() -> Nacl:
+    """A fresh client key pair."""
+    return Nacl()
+
+
+@fixture
+def nacl_recorder() -> DecryptedMessageRecorder:
+    """A recorder of the decrypted messages seen by the application."""
+    return DecryptedMessageRecorder()
+
+
+@fixture
+def nacl_client(
+    nacl_loop: AbstractEventLoop, nacl_server_keys: Nacl, nacl_client_keys: Nacl
+) -> Iterator[Callable]:
+    """
+    A factory serving an application in-process and returning a NaclTestClient for it.
+
+    The factory takes the application and, optionally, the client key pair and the
+    server hex public key. They default to nacl_client_keys and nacl_server_keys.
+    """
+    clients = []
+
+    async def factory(
+        app: Application,
+        keys: Optional[Nacl] = None,
+        server_hex_public_key: Optional[str] = None,
+    ) -> NaclTestClient:
+        client = TestClient(TestServer(app), loop=nacl_loop)
+        await client.start_server()
+        nacl_client = NaclTestClient(
+            client,
+            keys if keys is not None else nacl_client_keys,
+            (
+                server_hex_public_key
+                if server_hex_public_key is not None
+                else nacl_server_keys.decoded_public_key()
+            ),
+        )
+        clients.append(nacl_client)
+        return nacl_client
+
+    yield factory
+
+    for client in clients:
+        nacl_loop.run_until_complete(client.close())
@@ -0,0 +1,461 @@
+"""Registry of encrypted WebSocket connections."""
+
+from asyncio import (
+    CancelledError,
+    Handle,
+    Queue,
+    QueueEmpty,
+    QueueFull,
+    Task,
+    get_running_loop,
+)
+from enum import Enum, auto
+from logging import getLogger
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Union
+
+from aiohttp import WSCloseCode
+from aiohttp.web import WebSocketResponse
+
+from nacl_middleware.group import Group
+from nacl_middleware.nacl_utils import MailBox
+from nacl_middleware.sse import EventStream
+
+
+class SlowConsumerPolicy(Enum):
+    """What to do with a message for a connection whose outbound queue is full.
+
+    Attributes:
+        DropOldest: Drop the oldest queued message to make room.
+        DropNewest: Drop the new message.
+        Disconnect: Close the connection.
+    """
+
+    DropOldest = auto()
+    DropNewest = auto()
+    Disconnect = auto()
+
+
+class Connection:
+    """
+    An encrypted WebSocket connection with a bounded outbound queue.
+
+    A writer task sends the queued messages in order, so a slow consumer only holds
+    up to max_queue_size encrypted messages.
+
+    Attributes:
+        socket (Union[WebSocketResponse, EventStream]): The WebSocket, or an encrypted event stream.
+        mail_box (MailBox): The MailBox shared with the client.
+        public_key (str): The hex encoded client public key.
+        topics (Set[str]): The topics the connection is subscribed to.
+        dropped (int): Number of messages dropped because the queue was full.
+    """
+
+    __slots__ = (
+        "socket",
+        "mail_box",
+        "public_key",
+        "topics",
+        "dropped",
+        "_queue",
+        "_writer",
+    )
+
+    socket: Union[WebSocketResponse, EventStream]
+    mail_box: MailBox
+    public_key: str
+    topics: Set[str]
+    dropped: int
+    _queue: Queue
+    _writer: Optional[Task]
+
+    def __init__(
+        self,
+        socket: Union[WebSocketResponse, EventStream],
+        mail_box: MailBox,
+        public_key: str,
+        max_queue_size: int,
+    ) -> None:
+        self.socket = socket
+        self.mail_box = mail_box
+        self.public_key = public_key
+        self.topics = set()
+        self.dropped = 0
+        self._queue = Queue(max_queue_size)
+        self._writer = None
+
+    @property
+    def queued(self) -> int:
+        """Number of messages waiting to be sent."""
+        return self._queue.qsize()
+
+
+class ConnectionRegistry:
+    """
+    Indexes encrypted WebSocket connections by socket, client public key and topic.
+
+    EventStream responses can be added as sockets too, and receive the same messages.
+
+    Adding and removing connections are O(1). Messages are encrypted for each
+    connection and go through its bounded outbound queue, whose overflow is handled
+    according to the slow consumer policy.
+
+    With group_topics, each topic has a Group: topic broadcasts are encrypted once and
+    the key messages of each rotation are queued ahead of the broadcasts they unlock.
+    Membership changes only mark the group key stale. Stale keys are rotated once per
+    event loop iteration, or right before a broadcast, so a burst of subscribers or a
+    mass disconnect costs one rotation per group instead of one per member.
+
+    Attributes:
+        max_queue_size (int): Capacity of each outbound queue.
+        policy (SlowConsumerPolicy): What to do when an outbound queue is full.
+        group_topics (bool): Whether topic broadcasts use group encryption.
+    """
+
+    max_queue_size: int
+    policy: SlowConsumerPolicy
+    group_topics: bool
+    _connections: Dict[WebSocketResponse, Connection]
+    _by_public_key: Dict[str, Dict[WebSocketResponse, Connection]]
+    _by_topic: Dict[str, Dict[WebSocketResponse, Connection]]
+    _groups: Dict[str, Group]
+    _stale_groups: Set[str]
+    _rotation: Optional[Handle]
+    _closing: Set[Task]
+
+    def __init__(
+        self,
+        max_queue_size: int = 64,
+        policy: SlowConsumerPolicy = SlowConsumerPolicy.DropOldest,
+        group_topics: bool = False,
+        rotate_on_join: bool = True,
+        log=getLogger(),
+    ) -> None:
+        """
+        Initializes the registry.
+
+        Args:
+            max_queue_size (int, optional): Capacity of each outbound queue. Defaults to 64.
+            policy (SlowConsumerPolicy, optional): What to do when an outbound queue is full. Defaults to SlowConsumerPolicy.DropOldest.
+            group_topics (bool, optional): Encrypt topic broadcasts once with a group key. Defaults to False.
+            rotate_on_join (bool, optional): Rotate a group key when a member joins, see Group. Defaults to True.
+            log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+        """
+        self.max_queue_size = max_queue_size
+        self.policy = policy
+        self.group_topics = group_topics
+        self._rotate_on_join = rotate_on_join
+        self._log = log
+        self._connections = {}
+        self._by_public_key = {}
+        self._by_topic = {}
+        self._groups = {}
+        self._stale_groups = set()
+        self._rotation = None
+        self._closing = set()
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def __iter__(self) -> Iterator[Connection]:
+        return iter(list(self._connections.values()))
+
+    def __contains__(self, socket: WebSocketResponse) -> bool:
+        return socket in self._connections
+
+    def add(
+        self,
+        socket: WebSocketResponse,
+        mail_box: MailBox,
+        public_key: str,
+        topics: Iterable[str] = (),
+    ) -> Connection:
+        """
+        Registers a prepared WebSocket and starts its writer task.
+
+        Args:
+            socket (WebSocketResponse): The WebSocket.
+            mail_box (MailBox): The MailBox shared with the client.
+            public_key (str): The hex encoded client public key.
+            topics (Iterable[str], optional): Topics to subscribe to. Defaults to none.
+
+        Returns:
+            Connection: The registered connection.
+        """
+        connection = Connection(socket, mail_box, public_key, self.max_queue_size)
+        self._connections[socket] = connection
+        self._by_public_key.setdefault(public_key, {})[socket] = connection
+        for topic in topics:
+            self.subscribe(socket, topic)
+        connection._writer = get_running_loop().create_task(self._write(connection))
+        return connection
+
+    def remove(self, socket: WebSocketResponse) -> Optional[Connection]:
+        """
+        Unregisters a WebSocket, dropping its queued messages.
+
+        Args:
+            socket (WebSocketResponse): The WebSocket.
+
+        Returns:
+            Optional[Connection]: The removed connection, or None if it was not registered.
+        """
+        connection = self._connections.pop(socket, None)
+        if connection is None:
+            return None
+        self._discard(self._by_public_key, connection.public_key, socket)
+        if connection._writer is not None:
+            connection._writer.cancel()
+        for topic in connection.topics:
+            self._discard(self._by_topic, topic, socket)
+            self._leave_group(topic, socket)
+        return connection
+
+    def _deliver_keys(self, key_messages: Dict[WebSocketResponse, str]) -> None:
+        for socket, key_message in key_messages.items():
+            connection = self._connections.get(socket)
+            if connection is not None:
+                self.enqueue(connection, key_message, essential=True)
+
+    def _leave_group(self, topic: str, socket: WebSocketResponse) -> None:
+        group = self._groups.get(topic)
+        if group is None or not group.leave(socket):
+            return
+        if len(group):
+            self._schedule_rotation(topic)
+        else:
+            del self._groups[topic]
+            self._stale_groups.discard(topic)
+
+    def _schedule_rotation(self, topic: str) -> None:
+        self._stale_groups.add(topic)
+        if self._rotation is None:
+            self._rotation = get_running_loop().call_soon(self._rotate_groups)
+
+    def _rotate_groups(self) -> None:
+        self._rotation = None
+        topics, self._stale_groups = self._stale_groups, set()
+        for topic in topics:
+            self._rotate_group(topic)
+
+    def _rotate_group(self, topic: str) -> None:
+        self._stale_groups.discard(topic)
+        group = self._groups.get(topic)
+        if group is not None:
+            self._deliver_keys(group.rotate())
+
+    def group(self, topic: str) -> Optional[Group]:
+        """Returns the Group of a topic, if it has subscribers and group_topics is on."""
+        return self._groups.get(topic)
+
+    @staticmethod
+    def _discard(
+        index: Dict[str, Dict[WebSocketResponse, Connection]],
+        key: str,
+        socket: WebSocketResponse,
+    ) -> None:
+        sockets = index.get(key)
+        if sockets is not None:
+            sockets.pop(socket, None)
+            if not sockets:
+                del index[key]
+
+    def get(self, socket: WebSocketResponse) -> Optional[Connection]:
+        """Returns the connection of a WebSocket, if registered."""
+        return self._connections.get(socket)
+
+    def subscribe(self, socket: WebSocketResponse, topic: str) -> None:
+        """
+        Subscribes a registered WebSocket to a topic.
+
+        Args:
+            socket (WebSocketResponse): The WebSocket.
+            topic (str): The topic.
+        """
+        connection = self._connections[socket]
+        if topic in connection.topics:
+            return
+        connection.topics.add(topic)
+        self._by_topic.setdefault(topic, {})[socket] = connection
+        if self.group_topics:
+            group = self._groups.get(topic)
+            if group is None:
+                group = self._groups[topic] = Group(topic, self._rotate_on_join)
+            self._deliver_keys(group.join(socket, connection.mail_box))
+            if group.stale:
+                self._schedule_rotation(topic)
+
+    def unsubscribe(self, socket: WebSocketResponse, topic: str) -> None:
+        """
+        Unsubscribes a registered WebSocket from a topic.
+
+        Args:
+            socket (WebSocketResponse): The WebSocket.
+            topic (str): The topic.
+        """
+        connection = self._connections.get(socket)
+        if connection is not None and topic in connection.topics:
+            connection.topics.discard(topic)
+            self._discard(self._by_topic, topic, socket)
+            self._leave_group(topic, socket)
+
+    def by_public_key(self, public_key: str) -> List[Connection]:
+        """Returns the connections of a client public key."""
+        return list(self._by_public_key.get(public_key, {}).values())
+
+    def by_topic(self, topic: str) -> List[Connection]:
+        """Returns the connections subscribed to a topic."""
+        return list(self._by_topic.get(topic, {}).values())
+
+    def enqueue(
+        self,
+        connection: Connection,
+        text: str,
+        essential: bool = False,
+        event_id: Optional[str] = None,
+    ) -> bool:
+        """
+        Queues an already encrypted message for a connection.
+
+        Args:
+            connection (Connection): The connection.
+            text (str): The encrypted message.
+            essential (bool, optional): Never drop the message once queued, and make room for it even under SlowConsumerPolicy.DropNewest, as for group keys. A full queue holding only essential messages disconnects the connection. Defaults to False.
+            event_id (Optional[str], optional): The event id sent along to an EventStream, ignored for WebSockets. Defaults to None.
+
+        Returns:
+            bool: Whether the message was queued.
+        """
+        if not isinstance(connection.socket, EventStream):
+            event_id = None
+        item = (text, event_id, essential)
+        try:
+            connection._queue.put_nowait(item)
+            return True
+        except QueueFull:
+            pass
+        connection.dropped += 1
+        if self.policy == SlowConsumerPolicy.DropOldest or (
+            essential and self.policy == SlowConsumerPolicy.DropNewest
+        ):
+            if self._drop_oldest(connection):
+                connection._queue.put_nowait(item)
+                return True
+            # Only key messages are queued, and none can be dropped.
+        elif self.policy == SlowConsumerPolicy.DropNewest:
+            return False
+        self._log.info(f"Disconnecting slow consumer {connection.public_key}")
+        self.remove(connection.socket)
+        task = get_running_loop().create_task(
+            connection.socket.close(
+                code=WSCloseCode.TRY_AGAIN_LATER, message=b"Slow consumer"
+            )
+        )
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+        return False
+
+    @staticmethod
+    def _drop_oldest(connection: Connection) -> bool:
+        """
+        Drops the oldest queued message that is not essential.
+
+        Key messages are never dropped, as the client could not decrypt any later
+        broadcast of their group without them.
+        """
+        items = []
+        while not connection._queue.empty():
+            items.append(connection._queue.get_nowait())
+        dropped = False
+        for item in items:
+            if not dropped and not item[2]:
+                dropped = True
+            else:
+                connection._queue.put_nowait(item)
+        return dropped
+
+    def send(self, socket: WebSocketResponse, message: any) -> bool:
+        """
+        Encrypts a message for a registered WebSocket and queues it.
+
+        Args:
+            socket (WebSocketResponse): The WebSocket.
+            message (any): The message.
+
+        Returns:
+            bool: Whether the message was queued.
+        """
+        connection = self._connections.get(socket)
+        if connection is None:
+            return False
+        return self.enqueue(connection, connection.mail_box.box(message))
+
+    def broadcast(
+        self,
+        message: any,
+        topic: Optional[str] = None,
+        event_id: Optional[str] = None,
+    ) -> int:
+        """
+        Encrypts a message for every connection, or those subscribed to topic, and queues it.
+
+        With group_topics, a topic broadcast is encrypted once with the group key and
+        the same text is queued for every subscriber.
+
+        Args:
+            message (any): The message.
+            topic (Optional[str], optional): The topic. Defaults to every connection.
+            event_id (Optional[str], optional): The event id sent along to EventStream connections, see EventHistory. Defaults to None.
+
+        Returns:
+            int: Number of connections the message was queued for.
+        """
+        connections = self.by_topic(topic) if topic is not None else list(self)
+        group = self._groups.get(topic) if topic is not None else None
+        if group is not None:
+            if group.stale:
+                self._rotate_group(topic)
+            text = group.box(message)
+            return sum(
+                self.enqueue(connection, text, event_id=event_id)
+                for connection in connections
+            )
+        return sum(
+            self.enqueue(connection, connection.mail_box.box(message), event_id=event_id)
+            for connection in connections
+        )
+
+    async def _write(self, connection: Connection) -> None:
+        try:
+            while True:
+                text, event_id, _ = await connection._queue.get()
+                if event_id is None:
+                    await connection.socket.send_str(text)
+                else:
+                    await connection.socket.send_str(text, event_id)
+        except CancelledError:
+            pass
+        except Exception as e:
+            self._log.info(f"Failed to write to {connection.public_key}: {e}")
+            self.remove(connection.socket)
+
+    async def close(
+        self, code: int = WSCloseCode.GOING_AWAY, message: bytes = b"Server shutdown"
+    ) -> None:
+        """
+        Closes and unregisters every connection.
+
+        The groups are dropped first, so their keys are not rotated for members about
+        to be disconnected.
+
+        Args:
+            code (int, optional): The close code. Defaults to WSCloseCode.GOING_AWAY.
+            message (bytes, optional): The close message. Defaults to b"Server shutdown".
+        """
+        self._groups.clear()
+        self._stale_groups.clear()
+        if self._rotation is not None:
+            self._rotation.cancel()
+            self._rotation = None
+        for connection in list(self):
+            self.remove(connection.socket)
+            await connection.socket.close(code=code, message=message)
@@ -0,0 +1,141 @@
+"""Memoization of the plaintext results of idempotent encrypted endpoints."""
+
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from json import dumps
+from time import monotonic
+from typing import Optional, Tuple
+
+from aiohttp.web import Request, Response
+from nacl.encoding import RawEncoder
+from nacl.hash import blake2b
+
+from nacl_middleware.lazy import decrypted_message
+from nacl_middleware.nacl_utils import MailBox
+from nacl_middleware.typed import to_builtins
+
+
+class ResponseCache:
+    """
+    Caches the plaintext results of handlers that are pure functions of the decrypted
+    request, and encrypts them for each requesting client.
+
+    A decorated handler returns its plaintext result instead of a Response. The result
+    is cached by method, path and a hash of the decrypted message. On a hit the handler
+    is skipped and the cached plaintext is boxed with a fresh nonce for the MailBox of
+    the request, so ciphertexts stay unique. Only decorate handlers whose result does
+    not depend on the client.
+
+    Attributes:
+        ttl (float): Seconds a result is kept.
+        max_size (int): Maximum number of results kept, least recently used first out.
+        max_entry_size (Optional[int]): Results larger than this many bytes are not cached.
+        hits (int): Number of requests answered from the cache.
+        misses (int): Number of requests that ran the handler.
+    """
+
+    ttl: float
+    max_size: int
+    max_entry_size: Optional[int]
+    hits: int
+    misses: int
+    _entries: "OrderedDict[Tuple[str, str, bytes], Tuple[float, bytes]]"
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        max_size: int = 1024,
+        max_entry_size: Optional[int] = None,
+        clock: Callable[[], float] = monotonic,
+    ) -> None:
+        """
+        Initializes the cache.
+
+        Args:
+            ttl (float, optional): Seconds a result is kept. Defaults to 60.0.
+            max_size (int, optional): Maximum number of results kept. Defaults to 1024.
+            max_entry_size (Optional[int], optional): Maximum size in bytes of a cached result. Defaults to no limit.
+            clock (Callable[[], float], optional): Returns the current time in seconds. Defaults to monotonic.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """Drops every cached result."""
+        self._entries.clear()
+
+    @staticmethod
+    def key(request: Request) -> Tuple[str, str, bytes]:
+        """
+        Returns the cache key of a request.
+
+        Args:
+            request (Request): The request, already processed by nacl_middleware.
+
+        Returns:
+            Tuple[str, str, bytes]: The method, the path and a hash of the decrypted message.
+        """
+        message = dumps(
+            decrypted_message(request), sort_keys=True, default=to_builtins
+        ).encode()
+        return request.method, request.path, blake2b(message, encoder=RawEncoder)
+
+    def _get(self, key: Tuple[str, str, bytes]) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, plaintext = entry
+        if expires <= self._clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return plaintext
+
+    def _set(self, key: Tuple[str, str, bytes], plaintext: bytes) -> None:
+        if self.max_entry_size is not None and len(plaintext) > self.max_entry_size:
+            return
+        self._entries[key] = (self._clock() + self.ttl, plaintext)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __call__(
+        self, handler: Callable[[Request], Awaitable[any]]
+    ) -> Callable[[Request], Awaitable[Response]]:
+        """
+        Decorates a handler returning a plaintext result.
+
+        Args:
+            handler (Callable[[Request], Awaitable[any]]): The handler, returning any JSON serializable result.
+
+        Returns:
+            Callable[[Request], Awaitable[Response]]: The aiohttp handler, replying with the boxed result.
+        """
+
+        async def cached_handler(request: Request) -> Response:
+            mail_box: MailBox = request["mail_box"]
+            key = self.key(request)
+            plaintext = self._get(key)
+            if plaintext is None:
+                self.misses += 1
+                plaintext = dumps(await handler(request)).encode()
+                self._set(key, plaintext)
+            else:
+                self.hits += 1
+            return Response(text=mail_box.encrypt(plaintext))
+
+        # Not functools.wraps: the middleware must see the Response annotation, not
+        # the one of the wrapped handler.
+        cached_handler.__name__ = handler.__name__
+        cached_handler.__qualname__ = handler.__qualname__
+        cached_handler.__doc__ = handler.__doc__
+        cached_handler.__dict__.update(handler.__dict__)
+        return cached_handler
@@ -0,0 +1,305 @@
+"""Multi-process server runner sharing one listening port."""
+
+from asyncio import Event, get_running_loop, run
+from collections.abc import Callable
+from logging import getLogger
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from os import cpu_count, getpid
+from signal import SIGINT, SIGTERM, signal
+from socket import SO_REUSEADDR, SOL_SOCKET, socket
+from ssl import SSLContext
+from time import monotonic, process_time
+from typing import List, Optional
+
+from aiohttp.typedefs import Handler
+from aiohttp.web import (
+    AppKey,
+    Application,
+    AppRunner,
+    Request,
+    SockSite,
+    StreamResponse,
+    middleware,
+)
+
+try:
+    from socket import SO_REUSEPORT
+except ImportError:  # pragma: no cover, not available on Windows
+    SO_REUSEPORT = None
+
+stats_key = AppKey("nacl_stats", Callable[[], dict])
+"""Application key of an optional callable returning extra worker stats."""
+
+
+def _bind(host: str, port: int, reuse_port: bool) -> socket:
+    sock = socket()
+    sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def _serve(
+    app_factory: Callable[[], Application],
+    sock: Optional[socket],
+    address: tuple,
+    commands: Connection,
+    ssl_context: Optional[SSLContext],
+    shutdown_timeout: float,
+) -> None:
+    """Worker process: serves its own application instance until told to stop."""
+    started = monotonic()
+    counters = {"requests": 0, "in_flight": 0}
+
+    @middleware
+    async def count_requests(request: Request, handler: Handler) -> StreamResponse:
+        counters["requests"] += 1
+        counters["in_flight"] += 1
+        try:
+            return await handler(request)
+        finally:
+            counters["in_flight"] -= 1
+
+    def stats(app: Application) -> dict:
+        worker_stats = {
+            "pid": getpid(),
+            "uptime": monotonic() - started,
+            "process_time": process_time(),
+            **counters,
+        }
+        if stats_key in app:
+            worker_stats.update(app[stats_key]())
+        return worker_stats
+
+    async def main(sock: Optional[socket]) -> None:
+        loop = get_running_loop()
+        stop_event = Event()
+        app = app_factory()
+        app.middlewares.insert(0, count_requests)
+
+        def on_command() -> None:
+            try:
+                command = commands.recv()
+            except EOFError:
+                command = "stop"
+            if command == "stats":
+                commands.send(stats(app))
+            elif command == "stop":
+                loop.remove_reader(commands.fileno())
+                stop_event.set()
+
+        loop.add_reader(commands.fileno(), on_command)
+        for signal_number in (SIGINT, SIGTERM):
+            loop.add_signal_handler(signal_number, stop_event.set)
+
+        if sock is None:
+            sock = _bind(*address, reuse_port=True)
+        runner = AppRunner(app, shutdown_timeout=shutdown_timeout)
+        await runner.setup()
+        site = SockSite(runner, sock, ssl_context=ssl_context)
+        await site.start()
+        commands.send("ready")
+        await stop_event.wait()
+        await runner.cleanup()
+
+    run(main(sock))
+
+
+class MultiProcessRunner:
+    """
+    Serves an application from several worker processes listening on the same port.
+
+    Each worker calls app_factory to build its own application, so every worker has its
+    own middleware instance and key cache. The workers either accept from one socket
+    bound by the parent, or bind their own SO_REUSEPORT sockets and let the kernel
+    balance the connections.
+
+    Attributes:
+        host (str): The host address to listen on.
+        port (int): The port to listen on, the bound one once started.
+        workers (int): Number of worker processes.
+        reuse_port (bool): Whether the workers bind their own SO_REUSEPORT sockets.
+    """
+
+    host: str
+    port: int
+    workers: int
+    reuse_port: bool
+    _processes: List[Process]
+    _commands: List[Connection]
+
+    def __init__(
+        self,
+        app_factory: Callable[[], Application],
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        workers: Optional[int] = None,
+        ssl_context: Optional[SSLContext] = None,
+        reuse_port: bool = False,
+        shutdown_timeout: float = 10.0,
+        log=getLogger(),
+    ) -> None:
+        """
+        Initializes the runner.
+
+        Args:
+            app_factory (Callable[[], Application]): Builds the application of a worker. Must be picklable on platforms spawning processes.
+            host (str, optional): The host address to listen on. Defaults to "0.0.0.0".
+            port (int, optional): The port to listen on, 0 for any free port. Defaults to 8080.
+            workers (Optional[int], optional): Number of worker processes. Defaults to the number of CPUs.
+            ssl_context (Optional[SSLContext], optional): TLS context of the workers. Defaults to None.
+            reuse_port (bool, optional): Have each worker bind its own SO_REUSEPORT socket. Defaults to False.
+            shutdown_timeout (float, optional): Seconds given to open connections on shutdown. Defaults to 10.0.
+            log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+        """
+        if reuse_port and SO_REUSEPORT is None:
+            raise ValueError("SO_REUSEPORT is not supported on this platform!")
+        self._app_factory = app_factory
+        self.host = host
+        self.port = port
+        self.workers = workers or cpu_count() or 1
+        self._ssl_context = ssl_context
+        self.reuse_port = reuse_port
+        self._shutdown_timeout = shutdown_timeout
+        self._log = log
+        self._socket = None
+        self._processes = []
+        self._commands = []
+
+    def start(self, timeout: float = 30.0) -> None:
+        """
+        Binds the port and starts the workers, returning once they all serve.
+
+        Args:
+            timeout (float, optional): Seconds to wait for each worker. Defaults to 30.0.
+
+        Raises:
+            RuntimeError: If a worker fails to start.
+        """
+        # With SO_REUSEPORT the parent socket only reserves the port and never
+        # listens, so the kernel balances between the workers' sockets.
+        self._socket = _bind(self.host, self.port, self.reuse_port)
+        if not self.reuse_port:
+            self._socket.listen(128)
+        self.port = self._socket.getsockname()[1]
+        for _ in range(self.workers):
+            parent_end, worker_end = Pipe()
+            process = Process(
+                target=_serve,
+                args=(
+                    self._app_factory,
+                    None if self.reuse_port else self._socket,
+                    (self.host, self.port),
+                    worker_end,
+                    self._ssl_context,
+                    self._shutdown_timeout,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+            self._commands.append(parent_end)
+        for process, commands in zip(self._processes, self._commands):
+            if not commands.poll(timeout) or commands.recv() != "ready":
+                self.stop()
+                raise RuntimeError(f"Worker {process.pid} failed to start!")
+        self._log.info(f"Serving on {self.host}:{self.port} with {self.workers} workers")
+
+    def status(self) -> List[dict]:
+        """
+        Returns the status of each worker.
+
+        Returns:
+            List[dict]: The pid, liveness and exit code of each worker.
+        """
+        return [
+            {
+                "pid": process.pid,
+                "alive": process.is_alive(),
+                "exitcode": process.exitcode,
+            }
+            for process in self._processes
+        ]
+
+    def stats(self, timeout: float = 5.0) -> dict:
+        """
+        Collects and aggregates the stats of the live workers.
+
+        Numeric stats are summed into totals. Each worker reports its pid, uptime,
+        process_time, requests, in_flight and whatever the callable stored in the
+        application under stats_key returns.
+
+        Args:
+            timeout (float, optional): Seconds to wait for each worker. Defaults to 5.0.
+
+        Returns:
+            dict: The totals and the stats of each worker.
+        """
+        workers = []
+        for process, commands in zip(self._processes, self._commands):
+            if not process.is_alive():
+                continue
+            try:
+                commands.send("stats")
+                if commands.poll(timeout):
+                    workers.append(commands.recv())
+            except (BrokenPipeError, EOFError):
+                continue
+        totals = {}
+        for worker_stats in workers:
+            for name, value in worker_stats.items():
+                if name != "pid" and isinstance(value, (int, float)):
+                    totals[name] = totals.get(name, 0) + value
+        return {"workers": workers, "totals": totals}
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Gracefully stops the workers, terminating those still running after timeout.
+
+        Args:
+            timeout (Optional[float], optional): Seconds to wait for each worker. Defaults to the shutdown timeout plus 5 seconds.
+        """
+        if timeout is None:
+            timeout = self._shutdown_timeout + 5
+        for commands in self._commands:
+            try:
+                commands.send("stop")
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                self._log.info(f"Terminating worker {process.pid}")
+                process.terminate()
+                process.join()
+        for commands in self._commands:
+            commands.close()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        self._processes = []
+        self._commands = []
+
+    def run(self) -> None:
+        """
+        Starts the workers and blocks until SIGINT or SIGTERM, then stops them gracefully.
+        """
+        stopping = []
+
+        def on_signal(signal_number, frame) -> None:
+            stopping.append(signal_number)
+
+        previous = {number: signal(number, on_signal) for number in (SIGINT, SIGTERM)}
+        try:
+            self.start()
+            while not stopping and any(p.is_alive() for p in self._processes):
+                for process in self._processes:
+                    process.join(0.5)
+                    if stopping:
+                        break
+        finally:
+            self.stop()
+            for number, handler in previous.items():
+                signal(number, handler)
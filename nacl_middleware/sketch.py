@@ -0,0 +1,268 @@
+"""Heavy hitter tracking of client public keys in fixed memory."""
+
+from array import array
+from collections.abc import Callable
+from hashlib import blake2b
+from heapq import heapify, heappop, heappush
+from typing import Awaitable, Dict, List, NamedTuple, Optional, Tuple
+
+from aiohttp.web import HTTPBadRequest, Request, Response, json_response
+
+
+class CountMinSketch:
+    """
+    Estimates the counts of a stream of keys in fixed memory.
+
+    Each key is counted in one counter of each row, chosen by hashing. The estimate of
+    a key is the minimum of its counters, which is never below the true count. Counters
+    are only raised as far as needed (conservative update), which keeps the estimates
+    of rare keys close to their true counts.
+
+    Attributes:
+        width (int): Number of counters per row.
+        depth (int): Number of rows.
+    """
+
+    width: int
+    depth: int
+    _table: array
+
+    def __init__(self, width: int = 2048, depth: int = 4) -> None:
+        """
+        Initializes the sketch with zeroed counters.
+
+        Args:
+            width (int, optional): Number of counters per row. Defaults to 2048.
+            depth (int, optional): Number of rows, at most 16. Defaults to 4.
+        """
+        if width < 1 or not 1 <= depth <= 16:
+            raise ValueError("Width must be positive and depth between 1 and 16!")
+        self.width = width
+        self.depth = depth
+        self._table = array("Q", bytes(8 * width * depth))
+
+    def _indexes(self, key: str) -> List[int]:
+        digest = blake2b(key.encode(), digest_size=4 * self.depth).digest()
+        return [
+            row * self.width
+            + int.from_bytes(digest[4 * row : 4 * row + 4], "little") % self.width
+            for row in range(self.depth)
+        ]
+
+    def add(self, key: str, count: int = 1) -> int:
+        """
+        Counts a key.
+
+        Args:
+            key (str): The key.
+            count (int, optional): The amount to add. Defaults to 1.
+
+        Returns:
+            int: The new estimate of the key.
+        """
+        table = self._table
+        indexes = self._indexes(key)
+        estimate = min(table[index] for index in indexes) + count
+        for index in indexes:
+            if table[index] < estimate:
+                table[index] = estimate
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        """
+        Estimates the count of a key.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            int: The estimate, never below the true count.
+        """
+        table = self._table
+        return min(table[index] for index in self._indexes(key))
+
+    def halve(self) -> None:
+        """Halves every counter, so older counts weigh less than recent ones."""
+        table = self._table
+        for index in range(len(table)):
+            table[index] >>= 1
+
+
+class HeavyHitter(NamedTuple):
+    """A client public key among the heaviest."""
+
+    public_key: str
+    requests: int
+    bytes: int
+
+
+class HeavyHitters:
+    """
+    Tracks the client public keys sending the most encrypted bytes, in fixed memory.
+
+    Requests and encrypted bytes are counted per key by two Count-Min sketches, and a
+    min heap keeps the top keys by bytes. After sample_size requests every count is
+    halved, so the estimates follow the recent traffic.
+
+    Pass it to the middleware to record every request. The admit method implements
+    TinyLFU admission for the key cache backends: a new key only evicts the least
+    recently used one when it was requested more often, so one-off keys cannot push
+    hot keys out of the cache.
+
+    Attributes:
+        top_size (int): Number of heaviest keys kept.
+        sample_size (int): Number of requests between two halvings.
+        requests (CountMinSketch): Requests per key.
+        bytes (CountMinSketch): Encrypted bytes per key.
+        total_requests (int): Number of requests recorded.
+        total_bytes (int): Number of encrypted bytes recorded.
+    """
+
+    top_size: int
+    sample_size: int
+    requests: CountMinSketch
+    bytes: CountMinSketch
+    total_requests: int
+    total_bytes: int
+    _top: Dict[str, int]
+    _heap: List[Tuple[int, str]]
+
+    def __init__(
+        self,
+        top_size: int = 32,
+        width: int = 2048,
+        depth: int = 4,
+        sample_size: Optional[int] = None,
+    ) -> None:
+        """
+        Initializes the tracker.
+
+        Args:
+            top_size (int, optional): Number of heaviest keys kept. Defaults to 32.
+            width (int, optional): Number of counters per row of the sketches. Defaults to 2048.
+            depth (int, optional): Number of rows of the sketches. Defaults to 4.
+            sample_size (Optional[int], optional): Number of requests between two halvings. Defaults to 10 times width.
+        """
+        self.top_size = top_size
+        self.sample_size = sample_size if sample_size is not None else 10 * width
+        self.requests = CountMinSketch(width, depth)
+        self.bytes = CountMinSketch(width, depth)
+        self.total_requests = 0
+        self.total_bytes = 0
+        self._sampled = 0
+        self._top = {}
+        self._heap = []
+
+    def record(self, public_key: str, size: int) -> None:
+        """
+        Records a request.
+
+        Args:
+            public_key (str): The hex encoded client public key.
+            size (int): The encrypted message size.
+        """
+        self.total_requests += 1
+        self.total_bytes += size
+        self.requests.add(public_key)
+        self._update_top(public_key, self.bytes.add(public_key, size))
+        self._sampled += 1
+        if self._sampled >= self.sample_size:
+            self._age()
+
+    def _update_top(self, public_key: str, estimate: int) -> None:
+        top = self._top
+        heap = self._heap
+        if public_key not in top and len(top) >= self.top_size:
+            # Entries whose key left the top or got a newer estimate are stale.
+            while top.get(heap[0][1]) != heap[0][0]:
+                heappop(heap)
+            if estimate <= heap[0][0]:
+                return
+            del top[heappop(heap)[1]]
+        top[public_key] = estimate
+        heappush(heap, (estimate, public_key))
+        if len(heap) > 4 * self.top_size:
+            self._rebuild_heap()
+
+    def _rebuild_heap(self) -> None:
+        self._heap = [(estimate, key) for key, estimate in self._top.items()]
+        heapify(self._heap)
+
+    def _age(self) -> None:
+        self._sampled = 0
+        self.requests.halve()
+        self.bytes.halve()
+        for key in self._top:
+            self._top[key] >>= 1
+        self._rebuild_heap()
+
+    def top(self, count: Optional[int] = None) -> List[HeavyHitter]:
+        """
+        Returns the heaviest keys.
+
+        Args:
+            count (Optional[int], optional): Maximum number of keys. Defaults to top_size.
+
+        Returns:
+            List[HeavyHitter]: The keys with their estimated requests and bytes, heaviest first.
+        """
+        ranked = sorted(self._top.items(), key=lambda item: -item[1])[:count]
+        return [
+            HeavyHitter(key, self.requests.estimate(key), size) for key, size in ranked
+        ]
+
+    def admit(self, candidate: str, victim: str) -> bool:
+        """
+        Tells whether a new key should replace a cached one, for cache admission.
+
+        Args:
+            candidate (str): The hex encoded public key to cache.
+            victim (str): The hex encoded public key it would evict.
+
+        Returns:
+            bool: True if the candidate was requested more often than the victim.
+        """
+        return self.requests.estimate(candidate) > self.requests.estimate(victim)
+
+    def stats(self, count: Optional[int] = None) -> dict:
+        """
+        Returns the totals and the heaviest keys, ready to be serialized to JSON.
+
+        Args:
+            count (Optional[int], optional): Maximum number of keys. Defaults to top_size.
+
+        Returns:
+            dict: The total requests and bytes, and the heaviest keys.
+        """
+        return {
+            "total_requests": self.total_requests,
+            "total_bytes": self.total_bytes,
+            "top": [hitter._asdict() for hitter in self.top(count)],
+        }
+
+
+def heavy_hitters_handler(
+    heavy_hitters: HeavyHitters,
+) -> Callable[[Request], Awaitable[Response]]:
+    """
+    Builds a handler reporting the heaviest keys as JSON, for an admin route.
+
+    The route must be excluded from the middleware, and should only be reachable by
+    operators. The optional count query parameter limits the number of keys.
+
+    Args:
+        heavy_hitters (HeavyHitters): The tracker.
+
+    Returns:
+        Callable[[Request], Awaitable[Response]]: The handler.
+    """
+
+    async def handler(request: Request) -> Response:
+        count = request.query.get("count")
+        try:
+            count = int(count) if count is not None else None
+        except ValueError as e:
+            raise HTTPBadRequest(reason="Invalid count!") from e
+        return json_response(heavy_hitters.stats(count))
+
+    return handler
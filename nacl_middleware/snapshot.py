@@ -0,0 +1,227 @@
+"""Sealed snapshots of the shared key cache, to start warm after a restart."""
+
+from asyncio import CancelledError, get_running_loop, sleep
+from collections.abc import AsyncIterator
+from logging import getLogger
+from os import replace
+from pathlib import Path
+from typing import Iterable, List, Tuple, Union
+
+from aiohttp.web import Application
+from nacl.bindings import crypto_box_BEFORENMBYTES, crypto_box_PUBLICKEYBYTES
+from nacl.encoding import RawEncoder
+from nacl.exceptions import CryptoError
+from nacl.hash import blake2b
+from nacl.public import PrivateKey
+from nacl.secret import SecretBox
+
+from nacl_middleware.cache import KeyCache
+
+RECORD_SIZE = crypto_box_PUBLICKEYBYTES + crypto_box_BEFORENMBYTES
+"""Size of a snapshot record: the raw client public key then the shared key."""
+
+_PERSON = b"nacl-snapshot"
+
+
+def snapshot_box(private_key: PrivateKey) -> SecretBox:
+    """
+    Returns the SecretBox sealing the snapshots, keyed by a hash of the server private key.
+
+    Args:
+        private_key (PrivateKey): The server private key.
+
+    Returns:
+        SecretBox: The SecretBox.
+    """
+    key = blake2b(
+        b"",
+        digest_size=SecretBox.KEY_SIZE,
+        key=bytes(private_key),
+        person=_PERSON,
+        encoder=RawEncoder,
+    )
+    return SecretBox(key)
+
+
+def write_snapshot(
+    path: Union[str, Path],
+    private_key: PrivateKey,
+    entries: Iterable[Tuple[str, bytes]],
+) -> int:
+    """
+    Seals entries into a snapshot file, atomically replacing any previous one.
+
+    Args:
+        path (Union[str, Path]): The snapshot file.
+        private_key (PrivateKey): The server private key.
+        entries (Iterable[Tuple[str, bytes]]): The hex encoded public keys and shared keys.
+
+    Returns:
+        int: Number of entries written.
+    """
+    records = bytearray()
+    for hex_public_key, shared_key in entries:
+        records += bytes.fromhex(hex_public_key)
+        records += shared_key
+    path = Path(path)
+    temporary = path.with_name(path.name + ".tmp")
+    temporary.write_bytes(snapshot_box(private_key).encrypt(bytes(records)))
+    replace(temporary, path)
+    return len(records) // RECORD_SIZE
+
+
+def read_snapshot(
+    path: Union[str, Path], private_key: PrivateKey
+) -> List[Tuple[str, bytes]]:
+    """
+    Reads and opens a snapshot file.
+
+    Args:
+        path (Union[str, Path]): The snapshot file.
+        private_key (PrivateKey): The server private key.
+
+    Returns:
+        List[Tuple[str, bytes]]: The hex encoded public keys and shared keys, in file order.
+
+    Raises:
+        ValueError: If the file was not sealed with this private key or is corrupted.
+    """
+    # The whole file is needed to check the MAC, so there is nothing to gain by mapping it.
+    try:
+        records = snapshot_box(private_key).decrypt(Path(path).read_bytes())
+    except CryptoError as e:
+        raise ValueError(f"Invalid snapshot {path}!") from e
+    if len(records) % RECORD_SIZE:
+        raise ValueError(f"Invalid snapshot {path}!")
+    view = memoryview(records)
+    return [
+        (
+            view[offset : offset + crypto_box_PUBLICKEYBYTES].hex(),
+            bytes(view[offset + crypto_box_PUBLICKEYBYTES : offset + RECORD_SIZE]),
+        )
+        for offset in range(0, len(records), RECORD_SIZE)
+    ]
+
+
+class Snapshotter:
+    """
+    Periodically snapshots the hottest entries of a KeyCache and warms it at startup.
+
+    The backend of the KeyCache must be local, such as MemoryCache, SharedKeyArena or
+    TieredCache.
+
+    Attributes:
+        path (Path): The snapshot file.
+        count (int): Maximum number of entries snapshotted.
+        interval (float): Seconds between snapshots.
+    """
+
+    path: Path
+    count: int
+    interval: float
+
+    def __init__(
+        self,
+        key_cache: KeyCache,
+        private_key: PrivateKey,
+        path: Union[str, Path],
+        count: int = 10000,
+        interval: float = 300.0,
+        log=getLogger(),
+    ) -> None:
+        """
+        Initializes the snapshotter.
+
+        Args:
+            key_cache (KeyCache): The cache to snapshot and warm.
+            private_key (PrivateKey): The server private key, which also seals the file.
+            path (Union[str, Path]): The snapshot file.
+            count (int, optional): Maximum number of entries snapshotted. Defaults to 10000.
+            interval (float, optional): Seconds between snapshots. Defaults to 300.0.
+            log (Logger, optional): Logger object for logging debug messages. Defaults to getLogger().
+
+        Raises:
+            TypeError: If the backend of the cache cannot list its hottest entries.
+        """
+        try:
+            key_cache.hottest(0)
+        except NotImplementedError:
+            raise TypeError(
+                f"{type(key_cache.backend).__name__} does not support snapshots!"
+            ) from None
+        self._key_cache = key_cache
+        self._private_key = private_key
+        self.path = Path(path)
+        self.count = count
+        self.interval = interval
+        self._log = log
+
+    async def load(self) -> int:
+        """
+        Warms the cache from the snapshot file. A missing or invalid file is ignored.
+
+        Returns:
+            int: Number of entries loaded.
+        """
+        try:
+            entries = await get_running_loop().run_in_executor(
+                None, read_snapshot, self.path, self._private_key
+            )
+        except FileNotFoundError:
+            return 0
+        except ValueError as e:
+            self._log.info(f"Ignoring snapshot: {e}")
+            return 0
+        loaded = await self._key_cache.warm(entries)
+        self._log.info(f"Loaded {loaded} shared keys from {self.path}")
+        return loaded
+
+    async def save(self) -> int:
+        """
+        Writes the hottest entries of the cache to the snapshot file.
+
+        Returns:
+            int: Number of entries written.
+        """
+        entries = self._key_cache.hottest(self.count)
+        return await get_running_loop().run_in_executor(
+            None, write_snapshot, self.path, self._private_key, entries
+        )
+
+    async def _save_logged(self) -> None:
+        try:
+            await self.save()
+        except Exception as e:
+            self._log.info(f"Failed to write snapshot: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await sleep(self.interval)
+            await self._save_logged()
+
+    async def context(self, app: Application) -> AsyncIterator[None]:
+        """
+        Cleanup context loading the snapshot before the application serves, snapshotting
+        periodically while it does, and once more on shutdown.
+
+        Args:
+            app (Application): The application.
+        """
+        await self.load()
+        task = get_running_loop().create_task(self._run())
+        yield
+        task.cancel()
+        try:
+            await task
+        except CancelledError:
+            pass
+        await self._save_logged()
+
+    def attach(self, app: Application) -> None:
+        """
+        Registers the snapshotter with an application.
+
+        Args:
+            app (Application): The application.
+        """
+        app.cleanup_ctx.append(self.context)
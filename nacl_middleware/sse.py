@@ -0,0 +1,358 @@
+"""Encrypted Server-Sent Events, a one-way alternative to WebSockets."""
+
+from asyncio import Event, TimeoutError, sleep, wait_for
+from collections import deque
+from collections.abc import AsyncIterator
+from itertools import count
+from typing import TYPE_CHECKING, Deque, Iterable, List, Optional, Tuple
+
+from aiohttp import ClientResponse
+from aiohttp.web import Request, StreamResponse
+
+from nacl_middleware.nacl_utils import MailBox
+
+if TYPE_CHECKING:
+    from nacl_middleware.registry import ConnectionRegistry
+
+LAST_EVENT_ID_HEADER = "Last-Event-ID"
+"""Request header of a reconnecting EventSource."""
+
+BATCH_EVENT = "batch"
+"""Event type of several messages boxed together as a list."""
+
+_Pending = Tuple[bool, any, Optional[str]]
+
+
+class EventStream(StreamResponse):
+    """
+    An encrypted text/event-stream response.
+
+    Messages sent with ``send`` are boxed with the client MailBox. When several are
+    waiting to be written, they are boxed together as a single ``batch`` event holding
+    their list, which costs one encryption and one write. Already encrypted texts, such
+    as group broadcasts, are written as they are with ``send_str``. A comment is written
+    after ``heartbeat`` idle seconds, so proxies keep the connection open and
+    disconnected clients are noticed.
+
+    The stream can be added to a ConnectionRegistry in place of a WebSocket, to receive
+    its messages and topic broadcasts.
+
+    Attributes:
+        mail_box (MailBox): The MailBox shared with the client.
+        heartbeat (float): Idle seconds before a heartbeat comment.
+        batch_delay (float): Seconds to wait for more messages before writing.
+        max_pending (int): Number of waiting messages above which senders wait.
+        last_event_id (Optional[str]): The Last-Event-ID of a reconnecting client.
+    """
+
+    mail_box: MailBox
+    heartbeat: float
+    batch_delay: float
+    max_pending: int
+    last_event_id: Optional[str]
+    _pending: List[_Pending]
+
+    def __init__(
+        self,
+        mail_box: MailBox,
+        heartbeat: float = 15.0,
+        batch_delay: float = 0.0,
+        max_pending: int = 256,
+    ) -> None:
+        """
+        Initializes the stream.
+
+        Args:
+            mail_box (MailBox): The MailBox shared with the client, request["mail_box"].
+            heartbeat (float, optional): Idle seconds before a heartbeat comment. Defaults to 15.0.
+            batch_delay (float, optional): Seconds to wait for more messages before writing. Defaults to 0.0.
+            max_pending (int, optional): Number of waiting messages above which senders wait. Defaults to 256.
+        """
+        super().__init__(
+            headers={
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+            }
+        )
+        self.mail_box = mail_box
+        self.heartbeat = heartbeat
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        self.last_event_id = None
+        self._pending = []
+        self._wakeup = Event()
+        self._drained = Event()
+        self._closed = False
+
+    async def prepare(self, request: Request):
+        self.last_event_id = request.headers.get(
+            LAST_EVENT_ID_HEADER, request.query.get("lastEventId")
+        )
+        return await super().prepare(request)
+
+    @property
+    def closed(self) -> bool:
+        """Whether the stream is closed."""
+        return self._closed
+
+    def _push(self, boxed: bool, payload: any, event_id: Optional[str]) -> None:
+        if self._closed:
+            raise ConnectionResetError("Cannot write to a closed event stream")
+        self._pending.append((boxed, payload, event_id))
+        self._wakeup.set()
+
+    async def _wait_room(self) -> None:
+        while len(self._pending) >= self.max_pending and not self._closed:
+            self._drained.clear()
+            await self._drained.wait()
+
+    async def send(self, message: any, event_id: Optional[str] = None) -> None:
+        """
+        Queues a message, boxed with the client MailBox when written.
+
+        Args:
+            message (any): The message.
+            event_id (Optional[str], optional): The event id, for clients to resume from. Defaults to None.
+
+        Raises:
+            ConnectionResetError: If the stream is closed.
+        """
+        await self._wait_room()
+        self._push(False, message, event_id)
+
+    async def send_str(self, data: str, event_id: Optional[str] = None) -> None:
+        """
+        Queues an already encrypted text, as WebSocketResponse.send_str.
+
+        Args:
+            data (str): The encrypted text.
+            event_id (Optional[str], optional): The event id, for clients to resume from. Defaults to None.
+
+        Raises:
+            ConnectionResetError: If the stream is closed, so a ConnectionRegistry drops it.
+        """
+        await self._wait_room()
+        self._push(True, data, event_id)
+
+    def resume(self, history: "EventHistory", topics: Iterable[str] = ()) -> bool:
+        """
+        Queues the events a reconnecting client missed.
+
+        Call it before adding the stream to a ConnectionRegistry, without awaiting in
+        between, so no event is missed or repeated.
+
+        Args:
+            history (EventHistory): The history of the published events.
+            topics (Iterable[str], optional): Topics the client is subscribed to, besides the events published to everyone. Defaults to none.
+
+        Returns:
+            bool: False if some missed events are no longer in the history, so the client should reload its state.
+        """
+        if self.last_event_id is None:
+            return True
+        events = history.since(self.last_event_id, topics)
+        if events is None:
+            return False
+        for event_id, message in events:
+            self._push(False, message, event_id)
+        return True
+
+    def _encode(self, pending: List[_Pending]) -> bytes:
+        lines = []
+        index = 0
+        while index < len(pending):
+            boxed, payload, event_id = pending[index]
+            index += 1
+            event = None
+            if not boxed:
+                messages = [payload]
+                while index < len(pending) and not pending[index][0]:
+                    _, payload, next_id = pending[index]
+                    messages.append(payload)
+                    event_id = next_id if next_id is not None else event_id
+                    index += 1
+                if len(messages) > 1:
+                    event = BATCH_EVENT
+                    payload = self.mail_box.box(messages)
+                else:
+                    payload = self.mail_box.box(messages[0])
+            if event is not None:
+                lines.append(f"event: {event}\n")
+            if event_id is not None:
+                lines.append(f"id: {event_id}\n")
+            lines.append(f"data: {payload}\n\n")
+        return "".join(lines).encode()
+
+    async def run(self) -> None:
+        """
+        Writes the queued messages until the stream is closed or the client disconnects.
+
+        Await it in the handler, after prepare.
+        """
+        try:
+            while True:
+                try:
+                    await wait_for(self._wakeup.wait(), self.heartbeat)
+                except TimeoutError:
+                    await self.write(b":\n\n")
+                    continue
+                if self.batch_delay and not self._closed:
+                    await sleep(self.batch_delay)
+                self._wakeup.clear()
+                pending, self._pending = self._pending, []
+                self._drained.set()
+                if pending:
+                    await self.write(self._encode(pending))
+                if self._closed:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._closed = True
+            # Messages queued before a disconnect are never written.
+            self._pending = []
+            self._drained.set()
+
+    async def close(self, code: Optional[int] = None, message: bytes = b"") -> None:
+        """
+        Ends the stream once the queued messages are written, as WebSocketResponse.close.
+
+        Args:
+            code (Optional[int], optional): Ignored, for compatibility with WebSockets. Defaults to None.
+            message (bytes, optional): Ignored, for compatibility with WebSockets. Defaults to b"".
+        """
+        self._closed = True
+        self._wakeup.set()
+
+
+class EventHistory:
+    """
+    The recently published events, for reconnecting clients to catch up.
+
+    Events get increasing ids and are kept in memory up to max_events.
+
+    Attributes:
+        max_events (int): Number of events kept.
+    """
+
+    max_events: int
+    _events: Deque[Tuple[int, Optional[str], any]]
+
+    def __init__(self, max_events: int = 1024) -> None:
+        """
+        Initializes the history.
+
+        Args:
+            max_events (int, optional): Number of events kept. Defaults to 1024.
+        """
+        self.max_events = max_events
+        self._events = deque(maxlen=max_events)
+        self._ids = count(1)
+        self._last_id = 0
+
+    @property
+    def last_id(self) -> str:
+        """Id of the last event appended."""
+        return str(self._last_id)
+
+    def append(self, message: any, topic: Optional[str] = None) -> str:
+        """
+        Records an event.
+
+        Args:
+            message (any): The message.
+            topic (Optional[str], optional): The topic it is published to. Defaults to everyone.
+
+        Returns:
+            str: The event id.
+        """
+        self._last_id = next(self._ids)
+        self._events.append((self._last_id, topic, message))
+        return str(self._last_id)
+
+    def publish(
+        self, registry: "ConnectionRegistry", message: any, topic: Optional[str] = None
+    ) -> str:
+        """
+        Records an event and broadcasts it through a ConnectionRegistry with its id.
+
+        Args:
+            registry (ConnectionRegistry): The registry.
+            message (any): The message.
+            topic (Optional[str], optional): The topic. Defaults to every connection.
+
+        Returns:
+            str: The event id.
+        """
+        event_id = self.append(message, topic)
+        registry.broadcast(message, topic, event_id=event_id)
+        return event_id
+
+    def since(
+        self, last_event_id: str, topics: Iterable[str] = ()
+    ) -> Optional[List[Tuple[str, any]]]:
+        """
+        Returns the events after an id.
+
+        Args:
+            last_event_id (str): The id of the last event received.
+            topics (Iterable[str], optional): Topics of interest, besides the events published to everyone. Defaults to none.
+
+        Returns:
+            Optional[List[Tuple[str, any]]]: The ids and messages of the later events, or None if some are no longer kept or the id is unknown.
+        """
+        try:
+            last = int(last_event_id)
+        except ValueError:
+            return None
+        if last > self._last_id:
+            return None
+        oldest = self._events[0][0] if self._events else self._last_id + 1
+        if last < oldest - 1:
+            return None
+        topics = set(topics)
+        return [
+            (str(event_id), message)
+            for event_id, topic, message in self._events
+            if event_id > last and (topic is None or topic in topics)
+        ]
+
+
+async def read_events(
+    response: ClientResponse, opener: any
+) -> AsyncIterator[Tuple[Optional[str], any]]:
+    """
+    Reads an EventStream on the client side, unpacking batches.
+
+    Args:
+        response (ClientResponse): The text/event-stream response.
+        opener (any): Decrypts the data of the events, a MailBox, or a GroupKeyring for group broadcasts.
+
+    Yields:
+        Tuple[Optional[str], any]: The id of the event, if any, and each decrypted message.
+    """
+    event = None
+    event_id = None
+    data = []
+    async for line in response.content:
+        line = line.decode().rstrip("\r\n")
+        if line:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "id":
+                event_id = value
+            elif field == "data":
+                data.append(value)
+            continue
+        if data:
+            message = opener.unbox("\n".join(data))
+            if event == BATCH_EVENT:
+                for item in message:
+                    yield event_id, item
+            else:
+                yield event_id, message
+        event = None
+        data = []
@@ -0,0 +1,242 @@
+"""Event loop stall detection, attributing blocking time to the middleware stages."""
+
+from asyncio import AbstractEventLoop, current_task, get_running_loop
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from logging import getLogger
+from threading import Event, Thread
+from time import monotonic
+from typing import AsyncIterator, Deque, Dict, Iterator, List, NamedTuple, Optional
+
+from aiohttp.web import Application
+
+from nacl_middleware.tracing import NoopTracer, Span, Tracer
+
+OUTSIDE_STAGE = "outside"
+"""Stage of the stalls happening outside of any middleware span."""
+
+DEFAULT_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+"""Upper bounds in seconds of the stall histogram buckets."""
+
+_size_attributes = ("nacl.ciphertext_size", "nacl.plaintext_size")
+
+
+class Stall(NamedTuple):
+    """A period during which the event loop did not run its callbacks."""
+
+    stage: str
+    duration: float
+    payload_size: Optional[int]
+    target: Optional[str]
+
+
+class _Frame(Span):
+    __slots__ = ("name", "attributes", "_inner")
+
+    def __init__(self, name: str, attributes: Dict[str, any], inner: Span) -> None:
+        self.name = name
+        self.attributes = attributes
+        self._inner = inner
+
+    def set_attribute(self, key: str, value: any) -> None:
+        self.attributes[key] = value
+        self._inner.set_attribute(key, value)
+
+
+class StallMonitor(Tracer):
+    """
+    A Tracer detecting event loop stalls and the middleware stage that caused them.
+
+    A callback scheduled every interval on the event loop records when it last ran,
+    and a watchdog thread checks it is not late. When it is later than threshold, the
+    loop is blocked: the watchdog looks up the span the running task is in, with its
+    payload size and path, and once the loop runs again the stall duration is added to
+    the histogram of that stage. Stalls in nacl.decrypt or nacl.loads call for the
+    offload option or lower size limits, stalls in nacl.handler for faster handlers.
+
+    Pass the monitor as the tracer of the middleware. The spans are forwarded to
+    another tracer, if given.
+
+    Attributes:
+        threshold (float): Lateness in seconds from which the loop is stalled.
+        interval (float): Seconds between two checks.
+        buckets (tuple): Upper bounds in seconds of the histogram buckets.
+        stalls (Deque[Stall]): The latest stalls, oldest first.
+    """
+
+    threshold: float
+    interval: float
+    buckets: tuple
+    stalls: Deque[Stall]
+    _stacks: Dict[any, List[_Frame]]
+    _histograms: Dict[str, List[int]]
+
+    def __init__(
+        self,
+        threshold: float = 0.05,
+        interval: float = 0.01,
+        tracer: Optional[Tracer] = None,
+        buckets: tuple = DEFAULT_BUCKETS,
+        max_stalls: int = 1000,
+        log=getLogger(),
+    ) -> None:
+        """
+        Initializes the monitor.
+
+        Args:
+            threshold (float, optional): Lateness in seconds from which the loop is stalled. Defaults to 0.05.
+            interval (float, optional): Seconds between two checks. Defaults to 0.01.
+            tracer (Optional[Tracer], optional): Receives the spans too. Defaults to a NoopTracer.
+            buckets (tuple, optional): Upper bounds in seconds of the histogram buckets. Defaults to DEFAULT_BUCKETS.
+            max_stalls (int, optional): Number of stalls kept. Defaults to 1000.
+            log (Logger, optional): Logger object for logging stalls. Defaults to getLogger().
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.buckets = tuple(buckets)
+        self.stalls = deque(maxlen=max_stalls)
+        self._tracer = tracer if tracer is not None else NoopTracer()
+        self._log = log
+        self._stacks = {}
+        self._histograms = {}
+        self._totals: Dict[str, float] = {}
+        self._loop: Optional[AbstractEventLoop] = None
+        self._thread: Optional[Thread] = None
+        self._stopped = Event()
+        self._beat = 0.0
+        self._suspect: List[_Frame] = []
+        self._suspected = False
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        try:
+            task = current_task()
+        except RuntimeError:
+            task = None
+        stack = self._stacks.get(task)
+        if stack is None:
+            stack = self._stacks[task] = []
+        with self._tracer.span(name, **attributes) as inner:
+            frame = _Frame(name, dict(attributes), inner)
+            stack.append(frame)
+            try:
+                yield frame
+            finally:
+                stack.pop()
+                if not stack:
+                    del self._stacks[task]
+
+    def start(self) -> None:
+        """Starts monitoring the running event loop."""
+        if self._thread is not None:
+            return
+        self._loop = get_running_loop()
+        self._stopped.clear()
+        self._beat = monotonic()
+        self._loop.call_later(self.interval, self._heartbeat)
+        self._thread = Thread(target=self._watch, name="nacl-stall-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops monitoring."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _heartbeat(self) -> None:
+        now = monotonic()
+        late = now - self._beat - self.interval
+        if late > self.threshold:
+            self._record(late)
+        self._suspect = []
+        self._suspected = False
+        self._beat = now
+        if not self._stopped.is_set():
+            self._loop.call_later(self.interval, self._heartbeat)
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            if self._suspected:
+                continue
+            late = monotonic() - self._beat - self.interval
+            if late > min(self.threshold, self.interval):
+                self._suspect = self._running_stack()
+                self._suspected = True
+
+    def _running_stack(self) -> List[_Frame]:
+        try:
+            return list(self._stacks.get(current_task(self._loop), ()))
+        except RuntimeError:
+            return []
+
+    def _record(self, duration: float) -> None:
+        frames = self._suspect[::-1]
+        stage = frames[0].name if frames else OUTSIDE_STAGE
+        payload_size = next(
+            (
+                frame.attributes[key]
+                for frame in frames
+                for key in _size_attributes
+                if key in frame.attributes
+            ),
+            None,
+        )
+        target = next(
+            (
+                frame.attributes["http.target"]
+                for frame in frames
+                if "http.target" in frame.attributes
+            ),
+            None,
+        )
+        stall = Stall(stage, duration, payload_size, target)
+        self.stalls.append(stall)
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            histogram = self._histograms[stage] = [0] * (len(self.buckets) + 1)
+        histogram[bisect_left(self.buckets, duration)] += 1
+        self._totals[stage] = self._totals.get(stage, 0.0) + duration
+        self._log.warning(
+            f"Event loop stalled {duration * 1000:.1f} ms in {stage}"
+            + (f", payload of {payload_size} bytes" if payload_size is not None else "")
+        )
+
+    def histogram(self) -> Dict[str, dict]:
+        """
+        Returns the histogram of the stall durations per stage.
+
+        Returns:
+            Dict[str, dict]: For each stage, the count and total seconds of its stalls, and the bucket counts keyed by upper bound, "+Inf" last.
+        """
+        return {
+            stage: {
+                "count": sum(counts),
+                "total": self._totals[stage],
+                "buckets": dict(zip([*map(str, self.buckets), "+Inf"], counts)),
+            }
+            for stage, counts in self._histograms.items()
+        }
+
+    async def context(self, app: Application) -> AsyncIterator[None]:
+        """
+        Cleanup context monitoring the event loop while the application serves.
+
+        Args:
+            app (Application): The application.
+        """
+        self.start()
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def attach(self, app: Application) -> None:
+        """
+        Registers the monitor with an application.
+
+        Args:
+            app (Application): The application.
+        """
+        app.cleanup_ctx.append(self.context)
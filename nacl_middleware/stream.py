@@ -0,0 +1,226 @@
+"""Streaming encrypted uploads decrypted chunk by chunk."""
+
+from collections.abc import AsyncIterator
+from struct import Struct
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from aiohttp.web import HTTPRequestEntityTooLarge, HTTPUnauthorized, Request
+from nacl.bindings import (
+    crypto_secretstream_xchacha20poly1305_ABYTES,
+    crypto_secretstream_xchacha20poly1305_init_pull,
+    crypto_secretstream_xchacha20poly1305_init_push,
+    crypto_secretstream_xchacha20poly1305_keygen,
+    crypto_secretstream_xchacha20poly1305_pull,
+    crypto_secretstream_xchacha20poly1305_push,
+    crypto_secretstream_xchacha20poly1305_state,
+    crypto_secretstream_xchacha20poly1305_TAG_FINAL,
+    crypto_secretstream_xchacha20poly1305_TAG_MESSAGE,
+)
+from nacl.encoding import Base64Encoder
+from nacl.exceptions import CryptoError
+
+from nacl_middleware.lazy import decrypted_message
+from nacl_middleware.nacl_utils import MailBox
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+"""Default plaintext size of the frames, and of the largest frame accepted."""
+
+_length = Struct(">I")
+
+
+class StreamEncryptor:
+    """
+    Client side of an encrypted upload.
+
+    The upload gets its own random key, boxed together with the stream header for the
+    server as the encryptedMessage of the request query. The request body is a
+    sequence of frames, each a 4 bytes big endian length followed by a chunk encrypted
+    with crypto_secretstream. The last frame is tagged final, so dropping, reordering
+    or truncating frames is detected.
+
+    Attributes:
+        encrypted_message (str): The encryptedMessage to send in the request query.
+    """
+
+    encrypted_message: str
+
+    def __init__(self, mail_box: MailBox, metadata: any = None) -> None:
+        """
+        Starts an upload.
+
+        Args:
+            mail_box (MailBox): The MailBox shared with the server.
+            metadata (any, optional): Data sent along in the encryptedMessage. Defaults to None.
+        """
+        key = crypto_secretstream_xchacha20poly1305_keygen()
+        self._state = crypto_secretstream_xchacha20poly1305_state()
+        header = crypto_secretstream_xchacha20poly1305_init_push(self._state, key)
+        self.encrypted_message = mail_box.box(
+            {
+                "streamKey": Base64Encoder.encode(key).decode(),
+                "streamHeader": Base64Encoder.encode(header).decode(),
+                "metadata": metadata,
+            }
+        )
+
+    def push(self, chunk: bytes, final: bool = False) -> bytes:
+        """
+        Encrypts a chunk into a frame.
+
+        Args:
+            chunk (bytes): The plaintext chunk.
+            final (bool, optional): Whether this is the last chunk. Defaults to False.
+
+        Returns:
+            bytes: The frame.
+        """
+        tag = (
+            crypto_secretstream_xchacha20poly1305_TAG_FINAL
+            if final
+            else crypto_secretstream_xchacha20poly1305_TAG_MESSAGE
+        )
+        encrypted = crypto_secretstream_xchacha20poly1305_push(
+            self._state, chunk, tag=tag
+        )
+        return _length.pack(len(encrypted)) + encrypted
+
+    def frames(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Encrypts chunks into frames, the last one tagged final.
+
+        Args:
+            chunks (Iterable[bytes]): The plaintext chunks, at most the server's max_chunk_size each.
+
+        Yields:
+            bytes: The frames.
+        """
+        previous = None
+        for chunk in chunks:
+            if previous is not None:
+                yield self.push(previous)
+            previous = chunk
+        yield self.push(previous if previous is not None else b"", final=True)
+
+
+def read_chunks(
+    source: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    Reads a file in chunks, for StreamEncryptor.frames.
+
+    Args:
+        source (BinaryIO): The file.
+        chunk_size (int, optional): The chunk size. Defaults to DEFAULT_CHUNK_SIZE.
+
+    Yields:
+        bytes: The chunks.
+    """
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _open_stream(request: Request) -> object:
+    message = decrypted_message(request)
+    try:
+        key = Base64Encoder.decode(message["streamKey"])
+        header = Base64Encoder.decode(message["streamHeader"])
+        state = crypto_secretstream_xchacha20poly1305_state()
+        crypto_secretstream_xchacha20poly1305_init_pull(state, header, key)
+    except (CryptoError, KeyError, TypeError, ValueError) as e:
+        raise HTTPUnauthorized(reason="Invalid encrypted stream header!") from e
+    return state
+
+
+async def decrypt_stream(
+    request: Request, max_chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """
+    Reads an upload made with StreamEncryptor from the request body, one frame at a time.
+
+    Only one frame is held in memory at once, whatever the size of the upload.
+
+    Args:
+        request (Request): The request, already processed by nacl_middleware.
+        max_chunk_size (int, optional): Largest plaintext chunk accepted. Defaults to DEFAULT_CHUNK_SIZE.
+
+    Yields:
+        bytes: The plaintext chunks.
+
+    Raises:
+        HTTPUnauthorized: If a frame is forged, reordered or missing, or the upload is truncated.
+        HTTPRequestEntityTooLarge: If a frame is larger than max_chunk_size.
+    """
+    state = _open_stream(request)
+    max_frame_size = max_chunk_size + crypto_secretstream_xchacha20poly1305_ABYTES
+    while True:
+        (length,) = _length.unpack(await _read_exactly(request, _length.size))
+        if length > max_frame_size:
+            raise HTTPRequestEntityTooLarge(max_size=max_frame_size, actual_size=length)
+        frame = await _read_exactly(request, length)
+        try:
+            chunk, tag = crypto_secretstream_xchacha20poly1305_pull(state, frame)
+        except CryptoError as e:
+            raise HTTPUnauthorized(reason="Invalid encrypted stream frame!") from e
+        yield chunk
+        if tag == crypto_secretstream_xchacha20poly1305_TAG_FINAL:
+            break
+    if await request.content.read(1):
+        raise HTTPUnauthorized(reason="Data after the final stream frame!")
+
+
+async def _read_exactly(request: Request, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = await request.content.read(size - len(data))
+        if not chunk:
+            raise HTTPUnauthorized(reason="Truncated encrypted stream!")
+        data += chunk
+    return bytes(data)
+
+
+async def spool_stream(
+    request: Request,
+    destination: BinaryIO,
+    max_chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_size: Optional[int] = None,
+) -> int:
+    """
+    Writes an upload made with StreamEncryptor to a file, such as a temporary file.
+
+    Args:
+        request (Request): The request, already processed by nacl_middleware.
+        destination (BinaryIO): The file.
+        max_chunk_size (int, optional): Largest plaintext chunk accepted. Defaults to DEFAULT_CHUNK_SIZE.
+        max_size (Optional[int], optional): Largest upload accepted, in bytes. Defaults to no limit.
+
+    Returns:
+        int: Number of plaintext bytes written.
+
+    Raises:
+        HTTPUnauthorized: If the upload is forged, reordered or truncated.
+        HTTPRequestEntityTooLarge: If a frame or the upload is too large.
+    """
+    size = 0
+    async for chunk in decrypt_stream(request, max_chunk_size):
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            raise HTTPRequestEntityTooLarge(max_size=max_size, actual_size=size)
+        destination.write(chunk)
+    return size
+
+
+def stream_metadata(request: Request) -> any:
+    """
+    Returns the metadata sent along with an upload.
+
+    Args:
+        request (Request): The request, already processed by nacl_middleware.
+
+    Returns:
+        any: The metadata given to StreamEncryptor.
+    """
+    message = decrypted_message(request)
+    return message.get("metadata") if isinstance(message, dict) else None
@@ -0,0 +1,148 @@
+"""Per-stage tracing hooks of the middleware."""
+
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+from typing import ContextManager, Deque, Dict, Iterator, List, NamedTuple, Optional
+
+
+class Span:
+    """A timed stage. Attributes can be added while it runs."""
+
+    def set_attribute(self, key: str, value: any) -> None:
+        """
+        Sets an attribute of the span.
+
+        Args:
+            key (str): The attribute name.
+            value (any): The attribute value.
+        """
+
+
+class Tracer:
+    """
+    Emits a span for each stage of a request.
+
+    The middleware opens the spans nacl.request, nacl.parse, nacl.key_lookup,
+    nacl.decrypt, nacl.loads and nacl.handler, with the sizes of the payload and
+    whether the shared key was cached as attributes.
+    """
+
+    def span(self, name: str, **attributes) -> ContextManager[Span]:
+        """
+        Opens a span, closed when the returned context manager exits.
+
+        Args:
+            name (str): The stage name.
+            **attributes: The initial attributes.
+
+        Returns:
+            ContextManager[Span]: The span.
+        """
+        raise NotImplementedError()
+
+
+class _NoopSpan(Span):
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+
+_noop_span = _NoopSpan()
+
+
+class NoopTracer(Tracer):
+    """The default tracer: every span is the same inert object."""
+
+    def span(self, name: str, **attributes) -> ContextManager[Span]:
+        return _noop_span
+
+
+class FinishedSpan(NamedTuple):
+    """A span recorded by TimingTracer."""
+
+    name: str
+    duration: float
+    attributes: Dict[str, any]
+
+
+class _TimingSpan(Span):
+    __slots__ = ("attributes",)
+
+    def __init__(self, attributes: Dict[str, any]) -> None:
+        self.attributes = attributes
+
+    def set_attribute(self, key: str, value: any) -> None:
+        self.attributes[key] = value
+
+
+class TimingTracer(Tracer):
+    """
+    Records the latest finished spans in memory, without any dependency.
+
+    Attributes:
+        spans (Deque[FinishedSpan]): The finished spans, oldest first.
+    """
+
+    spans: Deque[FinishedSpan]
+
+    def __init__(self, max_spans: int = 10000) -> None:
+        """
+        Initializes the tracer.
+
+        Args:
+            max_spans (int, optional): Number of finished spans kept. Defaults to 10000.
+        """
+        self.spans = deque(maxlen=max_spans)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        span = _TimingSpan(attributes)
+        started = perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.set_attribute("error", type(e).__name__)
+            raise
+        finally:
+            self.spans.append(
+                FinishedSpan(name, perf_counter() - started, span.attributes)
+            )
+
+    def durations(self, name: str) -> List[float]:
+        """
+        Returns the durations of the recorded spans of a stage.
+
+        Args:
+            name (str): The stage name.
+
+        Returns:
+            List[float]: The durations in seconds.
+        """
+        return [span.duration for span in self.spans if span.name == name]
+
+
+class OpenTelemetryTracer(Tracer):
+    """
+    Adapter emitting the spans through OpenTelemetry.
+
+    Requires the opentelemetry-api package, installed with the otel extra.
+    """
+
+    def __init__(self, tracer: Optional[any] = None) -> None:
+        """
+        Initializes the adapter.
+
+        Args:
+            tracer (Optional[opentelemetry.trace.Tracer], optional): The OpenTelemetry tracer. Defaults to the one of the global tracer provider.
+        """
+        if tracer is None:
+            from opentelemetry.trace import get_tracer
+
+            tracer = get_tracer("nacl_middleware")
+        self._tracer = tracer
+
+    def span(self, name: str, **attributes) -> ContextManager[Span]:
+        return self._tracer.start_as_current_span(name, attributes=attributes)
@@ -0,0 +1,343 @@
+"""Typed decoding of decrypted messages into dataclasses, TypedDicts or msgspec Structs."""
+
+import types
+from collections.abc import Callable
+from dataclasses import MISSING, fields, is_dataclass
+from functools import lru_cache
+from json import loads
+from typing import (
+    Any,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    TypeVar,
+    Union,
+    get_args,
+    get_origin,
+    get_type_hints,
+)
+
+MESSAGE_TYPE_ATTRIBUTE = "nacl_message_type"
+"""Handler attribute set by the message_type decorator."""
+
+_Handler = TypeVar("_Handler")
+_Converter = Callable[[any, str], any]
+
+
+class MessageValidationError(ValueError):
+    """Raised when a decrypted message does not match its declared type."""
+
+
+def _msgspec():
+    try:
+        import msgspec
+    except ImportError:
+        return None
+    return msgspec
+
+
+def _type_name(message_type: any) -> str:
+    return getattr(message_type, "__name__", repr(message_type))
+
+
+def _invalid(expected: str, value: any, path: str) -> MessageValidationError:
+    return MessageValidationError(
+        f"Expected `{expected}`, got `{type(value).__name__}` - at `{path}`"
+    )
+
+
+def _scalar(expected: type) -> _Converter:
+    name = expected.__name__
+
+    def convert(value: any, path: str) -> any:
+        # bool is an int, but true is not a valid integer.
+        if type(value) is not expected:
+            raise _invalid(name, value, path)
+        return value
+
+    return convert
+
+
+def _convert_float(value: any, path: str) -> float:
+    if type(value) not in (int, float):
+        raise _invalid("float", value, path)
+    return float(value)
+
+
+def _convert_none(value: any, path: str) -> None:
+    if value is not None:
+        raise _invalid("null", value, path)
+    return None
+
+
+def _convert_any(value: any, path: str) -> any:
+    return value
+
+
+def _is_typed_dict(message_type: any) -> bool:
+    return (
+        isinstance(message_type, type)
+        and issubclass(message_type, dict)
+        and hasattr(message_type, "__required_keys__")
+    )
+
+
+def _compile_union(args: tuple, memo: Dict[any, _Converter]) -> _Converter:
+    options = [_compile(arg, memo) for arg in args]
+    expected = " | ".join(_type_name(arg) for arg in args)
+
+    def convert_union(value: any, path: str) -> any:
+        for option in options:
+            try:
+                return option(value, path)
+            except MessageValidationError:
+                pass
+        raise _invalid(expected, value, path)
+
+    return convert_union
+
+
+def _compile_literal(args: tuple, memo: Dict[any, _Converter]) -> _Converter:
+    def convert_literal(value: any, path: str) -> any:
+        if not any(type(value) is type(arg) and value == arg for arg in args):
+            raise MessageValidationError(f"Invalid value {value!r} - at `{path}`")
+        return value
+
+    return convert_literal
+
+
+def _compile_list(args: tuple, memo: Dict[any, _Converter]) -> _Converter:
+    item = _compile(args[0] if args else Any, memo)
+
+    def convert_list(value: any, path: str) -> list:
+        if type(value) is not list:
+            raise _invalid("array", value, path)
+        return [item(element, f"{path}[{index}]") for index, element in enumerate(value)]
+
+    return convert_list
+
+
+def _compile_dict(args: tuple, memo: Dict[any, _Converter]) -> _Converter:
+    if args and args[0] is not str:
+        raise TypeError(f"Message dict keys must be str, not {args[0]!r}!")
+    item = _compile(args[1] if args else Any, memo)
+
+    def convert_dict(value: any, path: str) -> dict:
+        if type(value) is not dict:
+            raise _invalid("object", value, path)
+        return {key: item(element, f"{path}.{key}") for key, element in value.items()}
+
+    return convert_dict
+
+
+_generic_compilers = {
+    Union: _compile_union,
+    Literal: _compile_literal,
+    list: _compile_list,
+    dict: _compile_dict,
+}
+# X | Y unions only exist from Python 3.10.
+if getattr(types, "UnionType", None) is not None:
+    _generic_compilers[types.UnionType] = _compile_union
+
+
+def _compile(message_type: any, memo: Dict[any, _Converter]) -> _Converter:
+    """Builds the converter of a type, once for all the messages."""
+    if message_type in memo:
+        return memo[message_type]
+    if message_type in (Any, object):
+        return _convert_any
+    if message_type is None or message_type is type(None):
+        return _convert_none
+    if message_type in (str, int, bool):
+        return _scalar(message_type)
+    if message_type is float:
+        return _convert_float
+    if message_type in (list, dict):
+        return _generic_compilers[message_type]((), memo)
+    compiler = _generic_compilers.get(get_origin(message_type))
+    if compiler is not None:
+        return compiler(get_args(message_type), memo)
+    if is_dataclass(message_type) and isinstance(message_type, type):
+        return _compile_record(message_type, memo, True)
+    if _is_typed_dict(message_type):
+        return _compile_record(message_type, memo, False)
+    raise TypeError(f"Unsupported message type {message_type!r}!")
+
+
+def _compile_record(
+    message_type: type, memo: Dict[any, _Converter], dataclass: bool
+) -> _Converter:
+    """Builds the converter of a dataclass or a TypedDict, which may be recursive."""
+    converters: List[tuple] = []
+    name = message_type.__name__
+
+    def convert_record(value: any, path: str) -> any:
+        if type(value) is not dict:
+            raise _invalid("object", value, path)
+        arguments = {}
+        for key, required, convert in converters:
+            if key in value:
+                arguments[key] = convert(value[key], f"{path}.{key}")
+            elif required:
+                raise MessageValidationError(
+                    f"Object missing required field `{key}` - at `{path}`"
+                )
+        return message_type(**arguments) if dataclass else arguments
+
+    memo[message_type] = convert_record
+    hints = get_type_hints(message_type)
+    if dataclass:
+        for field in fields(message_type):
+            if field.init:
+                required = field.default is MISSING and field.default_factory is MISSING
+                converters.append(
+                    (field.name, required, _compile(hints[field.name], memo))
+                )
+    else:
+        required_keys = message_type.__required_keys__
+        for key, hint in hints.items():
+            converters.append((key, key in required_keys, _compile(hint, memo)))
+    convert_record.__name__ = f"convert_{name}"
+    return convert_record
+
+
+class MessageDecoder:
+    """
+    Decodes decrypted messages into a declared type, with a decoder compiled once.
+
+    With msgspec installed, the plaintext is decoded and validated in a single pass by
+    a msgspec.json.Decoder, for msgspec Structs as well as dataclasses and TypedDicts,
+    without building an intermediate dict. Without it, dataclasses and TypedDicts are
+    supported by a converter compiled from their type hints, run on the parsed JSON.
+    Fields may be str, int, float, bool, None, Any, Optional, Union, Literal, lists,
+    dicts with str keys, and nested dataclasses or TypedDicts. Unknown fields are
+    ignored in both cases.
+
+    Attributes:
+        message_type (type): The declared type.
+        uses_msgspec (bool): Whether msgspec decodes the messages.
+    """
+
+    message_type: type
+    uses_msgspec: bool
+
+    def __init__(self, message_type: type, use_msgspec: Optional[bool] = None) -> None:
+        """
+        Compiles the decoder.
+
+        Args:
+            message_type (type): A dataclass, a TypedDict, or a msgspec Struct.
+            use_msgspec (Optional[bool], optional): Decode with msgspec. Defaults to whether it is installed.
+
+        Raises:
+            TypeError: If the type, or one of its fields, is not supported.
+            ImportError: If msgspec is required but not installed.
+        """
+        msgspec = _msgspec() if use_msgspec is not False else None
+        if use_msgspec and msgspec is None:
+            raise ImportError("msgspec is not installed!")
+        self.message_type = message_type
+        self.uses_msgspec = msgspec is not None
+        if msgspec is not None:
+            self._decoder = msgspec.json.Decoder(message_type)
+            self._validation_error = msgspec.ValidationError
+            self._convert = msgspec.convert
+        else:
+            self._converter = _compile(message_type, {})
+
+    def decode(self, plaintext: bytes) -> any:
+        """
+        Decodes a decrypted plaintext.
+
+        Args:
+            plaintext (bytes): The JSON plaintext.
+
+        Returns:
+            any: An instance of the declared type.
+
+        Raises:
+            MessageValidationError: If the message does not match the declared type.
+            ValueError: If the plaintext is not valid JSON.
+        """
+        if not self.uses_msgspec:
+            return self._converter(loads(plaintext), "$")
+        try:
+            return self._decoder.decode(plaintext)
+        except self._validation_error as e:
+            raise MessageValidationError(str(e)) from e
+
+    def convert(self, message: any) -> any:
+        """
+        Converts an already parsed message, such as the content of a deadline envelope.
+
+        Args:
+            message (any): The parsed message.
+
+        Returns:
+            any: An instance of the declared type.
+
+        Raises:
+            MessageValidationError: If the message does not match the declared type.
+        """
+        if not self.uses_msgspec:
+            return self._converter(message, "$")
+        try:
+            return self._convert(message, self.message_type)
+        except self._validation_error as e:
+            raise MessageValidationError(str(e)) from e
+
+
+def to_builtins(value: any) -> any:
+    """
+    Converts a typed message to JSON serializable values, as a json.dumps default.
+
+    Args:
+        value (any): A dataclass instance or a msgspec Struct.
+
+    Returns:
+        any: Its fields as a dict, or the builtins of the Struct.
+
+    Raises:
+        TypeError: If the value is of another type.
+    """
+    if is_dataclass(value) and not isinstance(value, type):
+        return {field.name: getattr(value, field.name) for field in fields(value)}
+    msgspec = _msgspec()
+    if msgspec is not None and isinstance(value, msgspec.Struct):
+        return msgspec.to_builtins(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+@lru_cache(maxsize=256)
+def decoder_for(message_type: type) -> MessageDecoder:
+    """
+    Returns the decoder of a type, compiled on the first call.
+
+    Args:
+        message_type (type): A dataclass, a TypedDict, or a msgspec Struct.
+
+    Returns:
+        MessageDecoder: The decoder.
+    """
+    return MessageDecoder(message_type)
+
+
+def message_type(declared_type: type) -> Callable[[_Handler], _Handler]:
+    """
+    Declares the type of the decrypted message of a route, over the middleware one.
+
+    Args:
+        declared_type (type): A dataclass, a TypedDict, or a msgspec Struct.
+
+    Returns:
+        Callable[[_Handler], _Handler]: The decorator, which returns the handler itself.
+    """
+    decoder_for(declared_type)
+
+    def decorator(handler: _Handler) -> _Handler:
+        setattr(handler, MESSAGE_TYPE_ATTRIBUTE, declared_type)
+        return handler
+
+    return decorator
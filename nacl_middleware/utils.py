@@ -1,7 +1,37 @@
-from re import fullmatch
-from typing import Tuple
+from operator import itemgetter
+from re import compile, fullmatch
+from typing import Optional, Tuple
 
 from aiohttp.web import Request
+from nacl.bindings import (
+    crypto_box_BOXZEROBYTES,
+    crypto_box_NONCEBYTES,
+    crypto_box_ZEROBYTES,
+)
+
+BOX_OVERHEAD = crypto_box_NONCEBYTES + crypto_box_ZEROBYTES - crypto_box_BOXZEROBYTES
+MIN_ENCRYPTED_MESSAGE_LENGTH = -(-BOX_OVERHEAD // 3) * 4
+
+_base64_pattern = compile(r"[A-Za-z0-9+/]*={0,2}")
+
+get_parameters = itemgetter("publicKey", "encryptedMessage")
+
+
+def is_excluded_path(path: str, exclude: Tuple) -> bool:
+    """
+    Check if a path matches any pattern in the exclude list.
+
+    Args:
+        path (str): The request path.
+        exclude (Tuple): A tuple of patterns to exclude.
+
+    Returns:
+        bool: True if the path matches any pattern in the exclude list, False otherwise.
+    """
+    for pattern in exclude:
+        if fullmatch(pattern, path):
+            return True
+    return False
 
 
 def is_exclude(request: Request, exclude: Tuple) -> bool:
@@ -15,7 +45,74 @@ def is_exclude(request: Request, exclude: Tuple) -> bool:
     Returns:
         bool: True if the request path matches any pattern in the exclude list, False otherwise.
     """
-    for pattern in exclude:
-        if fullmatch(pattern, request.path):
-            return True
-    return False
+    return is_excluded_path(request.path, exclude)
+
+
+async def get_encrypted_parameters(request: Request) -> Tuple[str, str]:
+    """
+    Get the publicKey and encryptedMessage parameters of the request.
+
+    They are read from the query string or, failing that, from a form encoded body.
+
+    Args:
+        request (Request): The request object.
+
+    Returns:
+        Tuple[str, str]: The hex encoded client public key and the encrypted message.
+
+    Raises:
+        KeyError: If the parameters are missing.
+    """
+    parameters = request.query
+    if (
+        "encryptedMessage" not in parameters
+        and request.body_exists
+        and request.content_type == "application/x-www-form-urlencoded"
+    ):
+        parameters = await request.post()
+    return get_parameters(parameters)
+
+
+def validate_encrypted_message(
+    encrypted_message: str,
+    max_ciphertext_size: Optional[int] = None,
+    max_plaintext_size: Optional[int] = None,
+) -> None:
+    """
+    Cheaply validate the shape of a base64 encoded box before decoding it.
+
+    The checks only look at the raw string, so oversized or malformed payloads are
+    rejected without allocating the decoded buffer or touching any crypto.
+
+    Args:
+        encrypted_message (str): The base64 encoded nonce, MAC and ciphertext.
+        max_ciphertext_size (Optional[int]): Maximum length of the encoded message. Defaults to no limit.
+        max_plaintext_size (Optional[int]): Maximum size in bytes of the decrypted payload. Defaults to no limit.
+
+    Raises:
+        ValueError: If the message is too large, too short or is not valid base64.
+    """
+    length = len(encrypted_message)
+    if max_ciphertext_size is not None and length > max_ciphertext_size:
+        raise ValueError(
+            f"Encrypted message length {length} exceeds the limit of {max_ciphertext_size}!"
+        )
+    if length < MIN_ENCRYPTED_MESSAGE_LENGTH:
+        raise ValueError(
+            f"Encrypted message length {length} is shorter than a nonce and MAC!"
+        )
+    if length % 4:
+        raise ValueError(f"Encrypted message length {length} is not a multiple of 4!")
+    if max_plaintext_size is not None:
+        padding = (
+            2
+            if encrypted_message.endswith("==")
+            else 1 if encrypted_message.endswith("=") else 0
+        )
+        plaintext_size = length // 4 * 3 - padding - BOX_OVERHEAD
+        if plaintext_size > max_plaintext_size:
+            raise ValueError(
+                f"Plaintext size {plaintext_size} exceeds the limit of {max_plaintext_size}!"
+            )
+    if not _base64_pattern.fullmatch(encrypted_message):
+        raise ValueError("Encrypted message is not valid base64!")
@@ -0,0 +1,77 @@
+"""A tiny in-process server speaking enough of the Redis protocol for the tests."""
+
+from asyncio import AbstractServer, StreamReader, StreamWriter, start_server
+
+
+class FakeRedisServer:
+    """
+    Serves GET, SET, DEL, PING, AUTH and SELECT from a dictionary.
+
+    Attributes:
+        data (dict): The stored values.
+        raw_replies (dict): Replies sent as they are to a GET of their key.
+        commands (list): The names of the commands received.
+        port (int): The port the server is listening on once started.
+    """
+
+    data: dict
+    raw_replies: dict
+    commands: list
+    port: int
+    _server: AbstractServer
+
+    def __init__(self) -> None:
+        self.data = {}
+        self.raw_replies = {}
+        self.commands = []
+        self.port = None
+        self._server = None
+
+    async def start(self) -> None:
+        """Starts listening on an ephemeral localhost port."""
+        self._server = await start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """Stops the server."""
+        self._server.close()
+        await self._server.wait_closed()
+
+    @staticmethod
+    async def _read_command(reader: StreamReader) -> list:
+        line = await reader.readline()
+        if not line:
+            return None
+        arguments = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            arguments.append((await reader.readexactly(length + 2))[:-2])
+        return arguments
+
+    def _reply(self, command: bytes, arguments: list) -> bytes:
+        if command in (b"PING", b"AUTH", b"SELECT"):
+            return b"+OK\r\n" if command != b"PING" else b"+PONG\r\n"
+        if command == b"GET" and arguments[0] in self.raw_replies:
+            return self.raw_replies[arguments[0]]
+        if command == b"GET":
+            value = self.data.get(arguments[0])
+            if value is None:
+                return b"$-1\r\n"
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == b"SET":
+            self.data[arguments[0]] = arguments[1]
+            return b"+OK\r\n"
+        if command == b"DEL":
+            return b":%d\r\n" % (self.data.pop(arguments[0], None) is not None)
+        return b"-ERR unknown command\r\n"
+
+    async def _handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        while True:
+            arguments = await self._read_command(reader)
+            if arguments is None:
+                break
+            command = arguments[0].upper()
+            self.commands.append(command.decode())
+            writer.write(self._reply(command, arguments[1:]))
+            await writer.drain()
+        writer.close()
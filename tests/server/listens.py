@@ -13,6 +13,9 @@ class Listens:
     async def _notify_listeners(self, new_status) -> Future:
         pass
 
+    async def notify(self, value) -> None:
+        pass
+
     def add_listener(self, callback: callable) -> None:
         pass
 
@@ -67,6 +70,7 @@ class Listens:
     Methods:
         __init__(): Initializes the Listens object.
         _notify_listeners(new_status): Notifies all listeners of a change in status.
+        notify(value): Awaits all listeners with a value.
         add_listener(callback): Adds a new listener to the list of listeners.
         stop_listening(): Removes all listeners from the list.
     """
@@ -97,6 +101,15 @@ class Listens:
         coroutines = [listener(new_status) for listener in self._listeners]
         return gather(*coroutines)
 
+    async def notify(self, value) -> None:
+        """
+        Awaits all listeners with a value, without going through the status slot.
+
+        Args:
+            value: The value to be passed to the listeners.
+        """
+        await gather(*[listener(value) for listener in self._listeners])
+
     def add_listener(self, callback: callable) -> None:
         """
         Adds a new listener to the list of listeners.
@@ -1,6 +1,6 @@
 """WebSocket server definition."""
 
-from asyncio import CancelledError, Event, create_task, new_event_loop, set_event_loop
+from asyncio import CancelledError, Event, new_event_loop, set_event_loop
 from operator import itemgetter
 from ssl import Purpose, SSLContext, create_default_context
 from typing import TypedDict
@@ -20,6 +20,8 @@ from aiohttp_middlewares.cors import DEFAULT_ALLOW_HEADERS, DEFAULT_ALLOW_METHOD
 from nacl.public import PrivateKey
 
 from nacl_middleware import MailBox, Nacl, nacl_middleware
+from nacl_middleware.dispatcher import MessageDispatcher
+from nacl_middleware.registry import ConnectionRegistry
 from tests.server.errors import ERROR_NO_SERVER, ERROR_SERVER_RUNNING
 from tests.server.logger import log
 from tests.server.server import EngineServer, ServerStatus
@@ -49,6 +51,7 @@ class WebSocketServer(EngineServer):
     _private_key: PrivateKey
     _runner: AppRunner
     _site: TCPSite
+    _dispatcher: MessageDispatcher
     ssl_context: SSLContext
 
     def __init__(
@@ -70,6 +73,7 @@ class WebSocketServer(EngineServer):
         self._app = None
         self._private_key = private_key
         self._remotes = remotes
+        self._dispatcher = MessageDispatcher(self._handle_message, log=log)
         if ssl:
             self._ssl_context = create_default_context(
                 Purpose.CLIENT_AUTH, cafile=ssl["cert_path"]
@@ -114,28 +118,16 @@ class WebSocketServer(EngineServer):
         log.info("WebSocket connection starting")
         socket = WebSocketResponse()
         await socket.prepare(request)
-        sockets: list[WebSocketResponse] = request.app[app_keys["websockets"]]
+        registry: ConnectionRegistry = request.app[app_keys["websockets"]]
         mail_box: MailBox = itemgetter("mail_box")(request)
-        socket["mail_box"] = mail_box
-        sockets.append(socket)
+        registry.add(socket, mail_box, request.query["publicKey"])
         log.info("WebSocket connection ready")
 
         try:
             async for message in socket:
                 if message.type == WSMsgType.TEXT:
-                    try:
-                        log.debug("Decrypting message...")
-                        decrypted: dict = mail_box.unbox(message.data)
-                        log.debug(f"Received encrypted message {decrypted}")
-                    except Exception:
-                        log.info(f"Failed decrypting data: {message.data}")
-                        continue
-
-                    if decrypted == "close":
-                        await socket.close()
-                        continue
-
-                    self.data.status = {"decrypted": decrypted, "socket": socket}
+                    # Waits while the socket's own queue is full, pausing its reads only.
+                    await self._dispatcher.put(socket, (socket, mail_box, message.data))
 
                 elif message.type == WSMsgType.ERROR:
                     log.info(
@@ -147,10 +139,33 @@ class WebSocketServer(EngineServer):
         finally:
             await socket.close()
 
-        sockets.remove(socket)
+        registry.remove(socket)
         log.info("WebSocket connection closed")
         return socket
 
+    async def _handle_message(self, message: tuple) -> None:
+        """Decrypts a WebSocket message and hands it to the message callbacks.
+
+        Messages of a socket are handled in order, by one dispatcher worker at a time.
+
+        Args:
+            message: The socket, its MailBox and the encrypted message.
+        """
+        socket, mail_box, data = message
+        try:
+            log.debug("Decrypting message...")
+            decrypted: dict = mail_box.unbox(data)
+            log.debug(f"Received encrypted message {decrypted}")
+        except Exception:
+            log.info(f"Failed decrypting data: {data}")
+            return
+
+        if decrypted == "close":
+            await socket.close()
+            return
+
+        await self.data.notify({"decrypted": decrypted, "socket": socket})
+
     def _start(self) -> None:
         """Starts the server.
 
@@ -176,14 +191,7 @@ class WebSocketServer(EngineServer):
             ]
         )
 
-        async def on_shutdown(app) -> None:
-            sockets: list[WebSocketResponse] = app[app_keys["websockets"]]
-            for ws in set(sockets):
-                await ws.close()
-
-        self._app.on_shutdown.append(on_shutdown)
-
-        self._app[app_keys["websockets"]] = []
+        self._app[app_keys["websockets"]] = ConnectionRegistry(log=log)
 
         self._app.router.add_get("/", index)
         self._app.router.add_get("/protocol", self.protocol)
@@ -200,10 +208,12 @@ class WebSocketServer(EngineServer):
             self._site = site = TCPSite(
                 runner, host=self._host, port=self._port, ssl_context=self._ssl_context
             )
+            self._dispatcher.start()
             await site.start()
             self.listened.status = ServerStatus.Running
             await self._stop_event.wait()
             await runner.cleanup()
+            await self._dispatcher.stop(drain=False)
             self._app = None
             self._loop = None
             self.listened.status = ServerStatus.Stopped
@@ -228,35 +238,20 @@ class WebSocketServer(EngineServer):
             app: The web application shutting down.
         """
 
-        sockets: list[WebSocketResponse] = app.get(app_keys["websockets"], [])
-        for socket in sockets:
-            await socket.close(code=WSCloseCode.GOING_AWAY, message="Server shutdown")
+        registry: ConnectionRegistry = app.get(app_keys["websockets"])
+        if registry is not None:
+            await registry.close(code=WSCloseCode.GOING_AWAY, message=b"Server shutdown")
 
     async def _broadcast_message(self, data: dict) -> None:
         """Broadcasts a message to connected clients.
 
         Args:
-            data: The data to broadcast. Internally it's sent with WebSocketResponse.send_json.
+            data: The data to broadcast. It is boxed for each socket by the registry.
         """
 
         if not self._app:
             return
 
-        sockets: list[WebSocketResponse] = self._app.get(app_keys["websockets"], [])
-
-        async def task(socket: WebSocketResponse):
-            try:
-                mail_box: MailBox = itemgetter("mail_box")(socket)
-                await socket.send_str(mail_box.box(data))
-            except Exception as e:
-                print(
-                    f"Failed to update websocket {socket} {id(socket)} {socket.closed}: {e}",
-                    flush=True,
-                )
-
-        # Create background tasks for each socket
-        for socket in sockets:
-            create_task(task(socket))
-
-        # Filter out closed sockets
-        sockets[:] = [socket for socket in sockets if not socket.closed]
+        registry: ConnectionRegistry = self._app[app_keys["websockets"]]
+        # Each socket has a bounded outbound queue, slow consumers drop messages.
+        registry.broadcast(data)
@@ -0,0 +1,167 @@
+from urllib.parse import urlencode
+
+from nacl_middleware import MailBox, Nacl
+from nacl_middleware.asgi import NaclASGIMiddleware
+from nacl_middleware.deadline import DeadlinePolicy, box_with_deadline
+from tests.utils import run
+
+server = Nacl()
+client = Nacl()
+mail_box = MailBox(client.private_key, server.decoded_public_key())
+
+
+def encrypted_query(message: any) -> bytes:
+    return urlencode(
+        {
+            "publicKey": client.decoded_public_key(),
+            "encryptedMessage": mail_box.box(message),
+        }
+    ).encode()
+
+
+async def echo(scope, receive, send) -> None:
+    if scope["type"] == "websocket":
+        await receive()
+        await send({"type": "websocket.accept"})
+        return
+    body = b""
+    if scope.get("method") == "POST":
+        body = (await receive())["body"]
+    state = scope.get("state", {})
+    reply = state["mail_box"].box(state["decrypted_message"]) if state else "plain"
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": reply.encode() + body})
+
+
+def call(scope: dict, messages: list = ()) -> list:
+    app = NaclASGIMiddleware(echo, server.private_key, exclude_routes=("/public",))
+    queue = list(messages)
+    sent = []
+
+    async def receive() -> dict:
+        return queue.pop(0)
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+
+    run(app({"headers": [], "query_string": b"", **scope}, receive, send))
+    return sent
+
+
+def test_http_query() -> None:
+    sent = call(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "query_string": encrypted_query({"a": 1}),
+        }
+    )
+    assert sent[0]["status"] == 200
+    assert mail_box.unbox(sent[1]["body"].decode()) == {"a": 1}
+
+
+def test_http_form_body_is_replayed() -> None:
+    body = encrypted_query("form")
+    sent = call(
+        {
+            "type": "http",
+            "method": "POST",
+            "path": "/",
+            "headers": [(b"content-type", b"application/x-www-form-urlencoded")],
+        },
+        [{"type": "http.request", "body": body, "more_body": False}],
+    )
+    reply = sent[1]["body"]
+    assert reply.endswith(body)
+    assert mail_box.unbox(reply[: -len(body)].decode()) == "form"
+
+
+def test_large_form_body_is_rejected() -> None:
+    app = NaclASGIMiddleware(echo, server.private_key, max_body_size=64)
+    received = []
+    sent = []
+
+    async def receive() -> dict:
+        received.append(None)
+        return {"type": "http.request", "body": b"x" * 32, "more_body": True}
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/x-www-form-urlencoded")],
+    }
+    run(app(scope, receive, send))
+    assert sent[0]["status"] == 413
+    assert len(received) == 3
+
+    sent.clear()
+    headers = scope["headers"] + [(b"content-length", b"1000")]
+    run(app({**scope, "headers": headers}, receive, send))
+    assert sent[0]["status"] == 413
+    assert len(received) == 3
+
+
+def test_rejections() -> None:
+    sent = call(
+        {"type": "http", "method": "GET", "path": "/", "query_string": b"publicKey=00"}
+    )
+    assert sent[0]["status"] == 401
+
+    sent = call(
+        {"type": "websocket", "path": "/", "query_string": b""},
+        [{"type": "websocket.connect"}],
+    )
+    assert [message["type"] for message in sent] == [
+        "websocket.accept",
+        "websocket.close",
+    ]
+    assert sent[1]["code"] == 1002
+
+
+def test_excluded_and_websocket() -> None:
+    sent = call({"type": "http", "method": "GET", "path": "/public"})
+    assert sent[1]["body"] == b"plain"
+
+    sent = call(
+        {"type": "websocket", "path": "/", "query_string": encrypted_query("hi")},
+        [{"type": "websocket.connect"}],
+    )
+    assert sent == [{"type": "websocket.accept"}]
+
+
+def test_expired_requests_are_shed() -> None:
+    encrypted_message, headers = box_with_deadline(mail_box, "late", -5.0)
+    query = urlencode(
+        {
+            "publicKey": client.decoded_public_key(),
+            "encryptedMessage": encrypted_message,
+        }
+    ).encode()
+    policy = DeadlinePolicy()
+    app = NaclASGIMiddleware(echo, server.private_key, deadlines=policy)
+    sent = []
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": b""}
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/echo",
+        "query_string": query,
+        "headers": [
+            (name.lower().encode(), value.encode()) for name, value in headers.items()
+        ],
+    }
+    run(app(scope, receive, send))
+    assert sent[0]["status"] == 503
+    assert policy.stats()["shed_before_decrypt"] == 1
@@ -0,0 +1,89 @@
+from io import BytesIO
+from json import dumps, loads
+from struct import pack
+
+from nacl.encoding import Base64Encoder
+from pytest import raises
+
+from nacl_middleware import MailBox, Nacl
+from nacl_middleware.batch import main, process_archive
+
+server = Nacl()
+clients = [Nacl() for _ in range(3)]
+mail_boxes = [
+    MailBox(client.private_key, server.decoded_public_key()) for client in clients
+]
+
+
+def test_jsonl_round_trip() -> None:
+    messages = [{"index": index} for index in range(50)]
+    archive = b"".join(
+        dumps(
+            {
+                "publicKey": clients[index % 3].decoded_public_key(),
+                "message": message,
+                "id": index,
+            }
+        ).encode()
+        + b"\n"
+        for index, message in enumerate(messages)
+    )
+    encrypted = BytesIO()
+    report = process_archive(
+        BytesIO(archive),
+        encrypted,
+        server.private_key,
+        "encrypt",
+        workers=2,
+        chunk_size=7,
+    )
+    assert report == {"records": 50, "failed": 0}
+    records = [loads(line) for line in encrypted.getvalue().splitlines()]
+    assert [record["id"] for record in records] == list(range(50))
+    assert mail_boxes[1].unbox(records[4]["encryptedMessage"]) == {"index": 4}
+
+    tampered_message = records[3]["encryptedMessage"] = records[4]["encryptedMessage"]
+    tampered = b"".join(dumps(record).encode() + b"\n" for record in records)
+    decrypted = BytesIO()
+    report = process_archive(
+        BytesIO(tampered), decrypted, server.private_key, workers=2, chunk_size=7
+    )
+    assert report == {"records": 50, "failed": 1}
+    records = [loads(line) for line in decrypted.getvalue().splitlines()]
+    assert [record.get("decryptedMessage") for record in records[:3]] == messages[:3]
+    assert "error" in records[3]
+    assert records[3]["encryptedMessage"] == tampered_message
+    assert records[49]["decryptedMessage"] == messages[49]
+
+
+def test_binary_decrypt_cli(tmp_path) -> None:
+    key_file = tmp_path / "server.key"
+    key_file.write_bytes(server.decoded_private_key().encode())
+    archive = tmp_path / "archive.bin"
+    with open(archive, "wb") as file:
+        for index in range(20):
+            client = clients[index % 3]
+            encrypted = Base64Encoder.decode(mail_boxes[index % 3].box([index]))
+            if index == 7:
+                encrypted = encrypted[:-1] + bytes([encrypted[-1] ^ 1])
+            file.write(
+                bytes(client.private_key.public_key)
+                + pack(">I", len(encrypted))
+                + encrypted
+            )
+    output = tmp_path / "archive.out"
+
+    with raises(SystemExit):
+        main(
+            ["decrypt", str(archive), str(output), "--private-key-file", str(key_file)]
+            + ["--format", "binary", "--workers", "2", "--chunk-size", "3"]
+        )
+
+    data = output.read_bytes()
+    plaintexts = []
+    while data:
+        length = int.from_bytes(data[32:36], "big")
+        assert data[:32] == bytes(clients[len(plaintexts) % 3].private_key.public_key)
+        plaintexts.append(loads(data[36 : 36 + length]) if length else None)
+        data = data[36 + length :]
+    assert plaintexts == [None if index == 7 else [index] for index in range(20)]
@@ -0,0 +1,76 @@
+from pytest import importorskip, mark, raises
+
+from nacl_middleware import KeyCache, bench
+from nacl_middleware.bench import (
+    BENCH_PATH,
+    STATS_PATH,
+    WEBSOCKET_PATH,
+    make_bench_app,
+    parse_arguments,
+    percentile,
+    run_load,
+    start_target,
+)
+from tests.utils import run
+
+
+def test_percentile() -> None:
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile(values, 100) == 100.0
+    assert percentile([], 50) == 0.0
+
+
+@mark.parametrize("transport", ["query", "body", "websocket"])
+async def test_run_load(nacl_client, nacl_server_keys, transport: str) -> None:
+    key_cache = KeyCache(nacl_server_keys.private_key)
+    client = await nacl_client(make_bench_app(nacl_server_keys.private_key, key_cache))
+    path = WEBSOCKET_PATH if transport == "websocket" else BENCH_PATH
+    report = await run_load(
+        str(client.client.make_url(path)),
+        nacl_server_keys.decoded_public_key(),
+        transport=transport,
+        concurrency=4,
+        requests=40,
+        churn=0.5,
+        stats_url=str(client.client.make_url(STATS_PATH)),
+    )
+    assert report["requests"] == 40
+    assert report["errors"] == 0
+    assert report["derivations"] == key_cache.derivations
+    assert 0.0 <= report["cache_hit_rate"] <= 1.0
+
+
+def test_asgi_stack() -> None:
+    importorskip("uvicorn")
+    process, port, server_hex_public_key = start_target(stack="asgi")
+    try:
+        report = run(
+            run_load(
+                f"http://127.0.0.1:{port}{BENCH_PATH}",
+                server_hex_public_key,
+                transport="body",
+                concurrency=4,
+                requests=40,
+                stats_url=f"http://127.0.0.1:{port}{STATS_PATH}",
+            )
+        )
+    finally:
+        process.terminate()
+        process.join()
+    assert (report["requests"], report["errors"], report["derivations"]) == (40, 0, 4)
+
+
+def test_asgi_stack_without_uvicorn(monkeypatch) -> None:
+    monkeypatch.setattr(bench, "find_spec", lambda name: None)
+    with raises(ImportError, match="uvicorn"):
+        start_target(stack="asgi")
+    with raises(SystemExit):
+        parse_arguments(["--stack", "asgi"])
+    assert (
+        parse_arguments(
+            ["--stack", "asgi", "--url", "http://host/", "--server-public-key", "00"]
+        ).stack
+        == "asgi"
+    )
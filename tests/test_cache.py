@@ -0,0 +1,237 @@
+from asyncio import create_task, gather, sleep
+from tracemalloc import get_traced_memory, start, stop
+
+from pytest import raises
+
+from nacl_middleware import KeyCache, MailBox, Nacl
+from nacl_middleware.cache import (
+    MemoryCache,
+    RedisCache,
+    RedisCacheError,
+    SharedKeyArena,
+    TieredCache,
+)
+from tests.fake_redis import FakeRedisServer
+from tests.utils import run
+
+server = Nacl()
+
+
+class SlowCache(MemoryCache):
+    """A MemoryCache whose lookups yield to the loop like a remote store would."""
+
+    async def get(self, key: str):
+        await sleep(0.01)
+        return await super().get(key)
+
+
+class SlowWriteCache(MemoryCache):
+    """A MemoryCache whose stores yield to the loop like a remote store would."""
+
+    async def set(self, key: str, value: bytes) -> None:
+        await sleep(0.01)
+        await super().set(key, value)
+
+
+def test_memory_cache_evicts_least_recently_used() -> None:
+    async def main() -> None:
+        cache = MemoryCache(max_size=2)
+        await cache.set("a", b"1")
+        await cache.set("b", b"2")
+        await cache.get("a")
+        await cache.set("c", b"3")
+        assert await cache.get("b") is None
+        assert await cache.get("a") == b"1"
+        assert len(cache) == 2
+
+    run(main())
+
+
+def test_tiered_cache_populates_local() -> None:
+    async def main() -> None:
+        remote = MemoryCache()
+        cache = TieredCache(remote)
+        await remote.set("a", b"1")
+        assert await cache.get("a") == b"1"
+        assert await cache.local.get("a") == b"1"
+        await cache.delete("a")
+        assert await remote.get("a") is None
+
+    run(main())
+
+
+def test_redis_cache_round_trip() -> None:
+    async def main() -> None:
+        fake = FakeRedisServer()
+        await fake.start()
+        cache = RedisCache("127.0.0.1", fake.port, db=1, password="secret", ttl=60)
+        assert await cache.get("a") is None
+        await cache.set("a", b"\x00\r\n1")
+        assert await cache.get("a") == b"\x00\r\n1"
+        await cache.delete("a")
+        assert await cache.get("a") is None
+        await cache.close()
+        await fake.stop()
+        assert fake.commands[:3] == ["AUTH", "SELECT", "GET"]
+
+    run(main())
+
+
+def test_redis_cache_resyncs_after_bad_replies() -> None:
+    async def main() -> None:
+        fake = FakeRedisServer()
+        await fake.start()
+        cache = RedisCache("127.0.0.1", fake.port, password="secret")
+        await cache.set("a", b"1")
+        fake.raw_replies[b"nacl:bad"] = b"?garbage\r\n$1\r\nx\r\n"
+        with raises(RedisCacheError):
+            await cache.get("bad")
+        assert await cache.get("a") == b"1"
+        assert fake.commands.count("AUTH") == 2
+
+        # A complete error reply keeps the connection.
+        with raises(RedisCacheError):
+            await cache.execute("UNKNOWN")
+        assert await cache.get("a") == b"1"
+        assert fake.commands.count("AUTH") == 2
+        await cache.close()
+        await fake.stop()
+
+    run(main())
+
+
+def test_key_cache_matches_mail_box() -> None:
+    client = Nacl()
+    client_mail_box = MailBox(client.private_key, server.decoded_public_key())
+
+    async def main() -> None:
+        key_cache = KeyCache(server.private_key)
+        for _ in range(2):
+            mail_box = await key_cache.get(client.decoded_public_key())
+            assert mail_box.unbox(client_mail_box.box("hello")) == "hello"
+        assert (key_cache.hits, key_cache.misses, key_cache.derivations) == (1, 1, 1)
+
+    run(main())
+
+
+def test_key_cache_coalesces_concurrent_misses() -> None:
+    client = Nacl()
+
+    async def main() -> None:
+        backend = SlowCache()
+        key_cache = KeyCache(server.private_key, TieredCache(backend, SlowCache()))
+        mail_boxes = await gather(
+            *[key_cache.get(client.decoded_public_key()) for _ in range(50)]
+        )
+        assert key_cache.derivations == 1
+        assert len({mail_box.shared_key() for mail_box in mail_boxes}) == 1
+        assert len(backend) == 1
+
+    run(main())
+
+
+def test_key_cache_survives_a_cancelled_derivation() -> None:
+    client = Nacl()
+
+    async def main() -> None:
+        key_cache = KeyCache(server.private_key, SlowWriteCache())
+        leader = create_task(key_cache.get(client.decoded_public_key()))
+        await sleep(0)
+        followers = gather(
+            *[key_cache.get(client.decoded_public_key()) for _ in range(3)]
+        )
+        await sleep(0)
+        leader.cancel()
+        mail_boxes = await followers
+        assert len({mail_box.shared_key() for mail_box in mail_boxes}) == 1
+        assert key_cache.derivations == 2
+        assert key_cache.derivations_saved == 2
+
+    run(main())
+
+
+def test_key_cache_survives_a_backend_outage() -> None:
+    client = Nacl()
+    client_mail_box = MailBox(client.private_key, server.decoded_public_key())
+
+    async def main() -> None:
+        fake = FakeRedisServer()
+        await fake.start()
+        port = fake.port
+        await fake.stop()
+        backend = TieredCache(RedisCache("127.0.0.1", port), MemoryCache())
+        key_cache = KeyCache(server.private_key, backend)
+        for _ in range(2):
+            mail_box = await key_cache.get(client.decoded_public_key())
+            assert mail_box.unbox(client_mail_box.box("hello")) == "hello"
+        key_cache = KeyCache(server.private_key, RedisCache("127.0.0.1", port))
+        await key_cache.get(client.decoded_public_key())
+        assert (key_cache.misses, key_cache.derivations) == (1, 1)
+
+    run(main())
+
+
+def test_key_cache_single_flight_offloaded_derivation() -> None:
+    clients = [Nacl() for _ in range(3)]
+
+    async def main() -> None:
+        key_cache = KeyCache(server.private_key, offload=True)
+        await gather(
+            *[
+                key_cache.get(client.decoded_public_key())
+                for _ in range(20)
+                for client in clients
+            ]
+        )
+        assert key_cache.derivations == 3
+        assert key_cache.derivations_saved == 57
+        assert key_cache.stats()["misses"] == 60
+
+    run(main())
+
+
+def test_shared_key_arena_clock_eviction() -> None:
+    keys = [Nacl().decoded_public_key() for _ in range(4)]
+
+    async def main() -> None:
+        arena = SharedKeyArena(3)
+        for index, key in enumerate(keys[:3]):
+            await arena.set(key, bytes([index]) * 32)
+        # A full sweep clears every reference bit, then evicts from the first slot.
+        await arena.set(keys[3], b"\x03" * 32)
+        assert await arena.get(keys[0]) is None
+        # keys[1] is referenced again, so the hand skips it.
+        assert await arena.get(keys[1]) == b"\x01" * 32
+        await arena.set(keys[0], b"\x00" * 32)
+        assert await arena.get(keys[2]) is None
+        await arena.delete(keys[1])
+        assert len(arena) == 2
+        assert await arena.get(keys[3]) == b"\x03" * 32
+
+    run(main())
+
+
+def test_per_client_memory_budget() -> None:
+    """Guards the per client costs documented in the README."""
+    clients = 5000
+    public_keys = [Nacl().decoded_public_key() for _ in range(clients)]
+    shared_keys = [bytes(32)] * clients
+
+    async def fill() -> SharedKeyArena:
+        arena = SharedKeyArena(clients)
+        for public_key, shared_key in zip(public_keys, shared_keys):
+            await arena.set(public_key, shared_key)
+        return arena
+
+    start()
+    try:
+        arena = run(fill())
+        arena_size = get_traced_memory()[0]
+        mail_boxes = [MailBox.from_shared_key(bytes(32)) for _ in range(clients)]
+        mail_boxes_size = get_traced_memory()[0] - arena_size
+    finally:
+        stop()
+    assert len(arena) == clients
+    assert arena_size / clients < 200
+    assert mail_boxes_size / clients < 128
+    assert not hasattr(mail_boxes[0], "__dict__")
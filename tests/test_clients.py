@@ -0,0 +1,81 @@
+from asyncio import gather
+
+from aiohttp.web import Application, Request, Response
+from nacl.public import PrivateKey
+
+from nacl_middleware import MailBox, Nacl, nacl_middleware
+from nacl_middleware.clients import (
+    ClientRegistry,
+    precompute_shared_keys,
+    read_client_keys,
+)
+from tests.utils import run
+
+server = Nacl()
+
+
+def test_parallel_precompute() -> None:
+    private_keys = [PrivateKey.generate() for _ in range(1100)]
+    public_keys = [bytes(key.public_key) for key in private_keys]
+    shared_keys = precompute_shared_keys(server.private_key, public_keys, workers=2)
+    assert len(shared_keys) == 32 * 1100
+    for index in (0, 555, 1099):
+        expected = MailBox(private_keys[index], server.decoded_public_key()).shared_key()
+        assert shared_keys[index * 32 : (index + 1) * 32] == expected
+
+
+def test_incremental_updates(tmp_path) -> None:
+    clients = [Nacl() for _ in range(4)]
+    keys = [client.decoded_public_key() for client in clients]
+    registry = ClientRegistry(server.private_key, keys[:2])
+    assert len(registry) == 2 and keys[0] in registry and keys[2] not in registry
+
+    assert run(registry.add(keys[1:3] + ["00", 7])) == (1, ["00", 7])
+    assert registry.remove([keys[0], "zz"]) == 1
+    assert run(registry.add([clients[3].private_key.public_key])) == (1, [])
+    assert sorted(registry._slots.values()) == [0, 1, 2]
+
+    others = [Nacl().decoded_public_key() for _ in range(3)]
+
+    async def add_concurrently() -> list:
+        return await gather(registry.add(others), registry.add(others[1:]))
+
+    added = run(add_concurrently())
+    assert sum(count for count, _ in added) == 3 and len(registry) == 6
+    assert registry.remove(others) == 3
+
+    registry_file = tmp_path / "clients.txt"
+    registry_file.write_text(f"# clients\n{keys[0]}\n\n{keys[1]}  # second\nbad\n")
+    assert run(registry.reload(registry_file)) == (1, 2)
+    assert {key for key in keys if key in registry} == set(keys[:2])
+
+    raw_file = tmp_path / "clients.bin"
+    raw_file.write_bytes(b"".join(read_client_keys(registry_file)))
+    assert list(read_client_keys(raw_file, raw=True)) == list(
+        read_client_keys(registry_file)
+    )
+
+
+async def echo_handler(request: Request) -> Response:
+    mail_box: MailBox = request["mail_box"]
+    return Response(text=mail_box.box(request["decrypted_message"]))
+
+
+async def test_unknown_clients_are_rejected(
+    nacl_client, nacl_server_keys, nacl_client_keys
+) -> None:
+    registry = ClientRegistry(
+        nacl_server_keys.private_key, [nacl_client_keys.decoded_public_key()]
+    )
+    app = Application(
+        middlewares=[nacl_middleware(nacl_server_keys.private_key, key_cache=registry)]
+    )
+    app.router.add_get("/echo", echo_handler)
+
+    client = await nacl_client(app, keys=nacl_client_keys)
+    assert await client.send("/echo", "known") == "known"
+
+    stranger = await nacl_client(app, keys=Nacl())
+    assert (await stranger.get("/echo", "unknown")).status == 401
+    assert registry.stats()["rejected"] == 1
+    assert registry.derivations == 1
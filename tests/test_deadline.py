@@ -0,0 +1,94 @@
+from aiohttp.web import Application, Request, Response
+from pytest import raises
+
+from nacl_middleware import MailBox, Nacl, nacl_middleware
+from nacl_middleware.deadline import (
+    DEADLINE_HEADER,
+    DeadlineExceeded,
+    DeadlinePolicy,
+    box_with_deadline,
+)
+from nacl_middleware.engine import NaclEngine
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_policy_verifies_the_hint() -> None:
+    keys = Nacl()
+    mail_box = MailBox(keys.private_key, Nacl().decoded_public_key())
+    clock = Clock()
+    policy = DeadlinePolicy(clock_skew=0.5, clock=clock)
+    encrypted_message, headers = box_with_deadline(mail_box, "hi", 2.0, clock)
+    message = mail_box.unbox(encrypted_message)
+    hint = headers[DEADLINE_HEADER]
+
+    policy.check_hint(hint)
+    assert policy.open(message, hint) == "hi"
+    assert policy.open("plain", None) == "plain"
+    with raises(ValueError):
+        policy.open(message, "1001.5")
+    with raises(ValueError):
+        policy.open("plain", hint)
+    with raises(ValueError):
+        DeadlinePolicy(required=True).open("plain", None)
+
+    clock.now = 1003.0
+    with raises(DeadlineExceeded):
+        policy.check_hint(hint)
+    with raises(DeadlineExceeded):
+        policy.open(message, None)
+    assert policy.stats() == {
+        "shed_before_decrypt": 1,
+        "shed_after_decrypt": 1,
+        "shed": 2,
+        "hint_mismatches": 2,
+    }
+    with raises(ValueError):
+        NaclEngine(keys.private_key, lazy=True, deadlines=policy)
+
+
+async def test_expired_requests_skip_the_handler(
+    nacl_client, nacl_server_keys, nacl_client_keys
+) -> None:
+    clock = Clock()
+    policy = DeadlinePolicy(clock_skew=0, clock=clock)
+    handled = []
+
+    async def echo_handler(request: Request) -> Response:
+        handled.append(request["decrypted_message"])
+        mail_box: MailBox = request["mail_box"]
+        return Response(text=mail_box.box(request["decrypted_message"]))
+
+    app = Application(
+        middlewares=[nacl_middleware(nacl_server_keys.private_key, deadlines=policy)]
+    )
+    app.router.add_get("/echo", echo_handler)
+    client = await nacl_client(app, keys=nacl_client_keys)
+
+    async def get(timeout: float, headers: bool = True):
+        encrypted_message, deadline_headers = box_with_deadline(
+            client.mail_box, "hello", timeout, clock
+        )
+        return await client.client.get(
+            "/echo",
+            params={
+                "publicKey": nacl_client_keys.decoded_public_key(),
+                "encryptedMessage": encrypted_message,
+            },
+            headers=deadline_headers if headers else None,
+        )
+
+    response = await get(5.0)
+    assert response.status == 200
+    assert client.unbox(await response.text()) == "hello"
+    assert (await get(-1.0)).status == 503
+    assert (await get(-1.0, headers=False)).status == 503
+    assert handled == ["hello"]
+    assert policy.stats()["shed_before_decrypt"] == 1
+    assert policy.stats()["shed_after_decrypt"] == 1
@@ -0,0 +1,84 @@
+from asyncio import Event, TimeoutError, sleep, wait_for
+
+from pytest import raises
+
+from nacl_middleware.dispatcher import MessageDispatcher
+
+
+async def test_ordering_per_key(nacl_loop) -> None:
+    handled = []
+
+    async def handler(message: tuple) -> None:
+        key, index = message
+        # Later messages finish faster, so only the dispatcher keeps them ordered.
+        await sleep(0.001 * (5 - index))
+        handled.append(message)
+
+    dispatcher = MessageDispatcher(handler, workers=3)
+    dispatcher.start()
+    for index in range(5):
+        for key in "abcd":
+            await dispatcher.put(key, (key, index))
+    await dispatcher.stop()
+    for key in "abcd":
+        assert [index for k, index in handled if k == key] == list(range(5))
+    assert dispatcher.handled == 20
+
+
+async def test_backpressure(nacl_loop) -> None:
+    release = Event()
+
+    async def handler(message: int) -> None:
+        await release.wait()
+
+    dispatcher = MessageDispatcher(handler, workers=1, max_queue_size=2)
+    dispatcher.start()
+    for index in range(3):
+        await dispatcher.put("a", index)
+    with raises(TimeoutError):
+        await wait_for(dispatcher.put("a", 3), 0.05)
+    # Only the full key waits.
+    await wait_for(dispatcher.put("b", 0), 0.05)
+    release.set()
+    await dispatcher.put("a", 4)
+    await dispatcher.stop()
+    assert dispatcher.handled == 5 and dispatcher.queued == 0
+
+
+async def test_slow_key_does_not_block_others(nacl_loop) -> None:
+    release = Event()
+    handled = []
+
+    async def handler(message: tuple) -> None:
+        key, index = message
+        if key == "slow":
+            await release.wait()
+        handled.append(message)
+
+    dispatcher = MessageDispatcher(handler, workers=2, max_queue_size=1)
+    dispatcher.start()
+    await dispatcher.put("slow", ("slow", 0))
+    await dispatcher.put("slow", ("slow", 1))
+    for index in range(20):
+        for key in "abc":
+            await wait_for(dispatcher.put(key, (key, index)), 0.5)
+    while len(handled) < 60:
+        await sleep(0.001)
+    assert all(key != "slow" for key, _ in handled)
+    release.set()
+    await dispatcher.stop()
+    assert handled[-2:] == [("slow", 0), ("slow", 1)]
+    assert dispatcher._queues == {}
+
+
+async def test_failures_are_counted(nacl_loop) -> None:
+    async def handler(message: int) -> None:
+        if message % 2:
+            raise ValueError(message)
+
+    dispatcher = MessageDispatcher(handler)
+    dispatcher.start()
+    for index in range(4):
+        await dispatcher.put(index, index)
+    await dispatcher.stop()
+    assert (dispatcher.handled, dispatcher.failed) == (2, 2)
@@ -0,0 +1,102 @@
+from asyncio import gather, sleep
+
+from aiohttp.web import Application, Request, Response
+
+from nacl_middleware import MailBox, Nacl, nacl_middleware
+from nacl_middleware.fairness import FairScheduler
+
+
+def make_app(private_key, scheduler: FairScheduler, served: list) -> Application:
+    async def echo_handler(request: Request) -> Response:
+        mail_box: MailBox = request["mail_box"]
+        served.append(request["decrypted_message"]["client"])
+        await sleep(0.01)
+        return Response(text=mail_box.box(request["decrypted_message"]))
+
+    app = Application(middlewares=[scheduler.middleware, nacl_middleware(private_key)])
+    app.router.add_route("*", "/echo", echo_handler)
+    return app
+
+
+async def test_quiet_client_is_not_starved(
+    nacl_client, nacl_server_keys, nacl_client_keys
+) -> None:
+    served = []
+    scheduler = FairScheduler(max_in_flight=1, max_queue_per_client=32, quantum=256)
+    app = make_app(nacl_server_keys.private_key, scheduler, served)
+    noisy = await nacl_client(app, keys=Nacl())
+    quiet = await nacl_client(app, keys=nacl_client_keys)
+    # Authenticated once, each key gets its own queue.
+    for client, name in ((noisy, "noisy"), (quiet, "quiet")):
+        assert await client.send("/echo", {"client": name}) == {"client": name}
+    served.clear()
+
+    async def quiet_request():
+        await sleep(0.005)
+        return await quiet.get("/echo", {"client": "quiet"})
+
+    responses = await gather(
+        *(noisy.get("/echo", {"client": "noisy", "pad": "x" * 2000}) for _ in range(10)),
+        quiet_request(),
+    )
+    assert all(response.status == 200 for response in responses)
+    assert served.index("quiet") <= 2
+    assert scheduler.stats() == {
+        "admitted": 13,
+        "rejected": 0,
+        "in_flight": 0,
+        "queued": 0,
+        "clients": 0,
+    }
+    assert not scheduler._active and not scheduler._active_keys
+
+
+async def test_queue_overflow_is_rejected(nacl_client, nacl_server_keys) -> None:
+    served = []
+    scheduler = FairScheduler(
+        max_in_flight=4, max_in_flight_per_client=1, max_queue_per_client=2
+    )
+    app = make_app(nacl_server_keys.private_key, scheduler, served)
+    client = await nacl_client(app, keys=Nacl())
+
+    responses = await gather(
+        *(client.get("/echo", {"client": "noisy"}) for _ in range(6))
+    )
+    statuses = sorted(response.status for response in responses)
+    assert statuses.count(200) >= 3 and statuses.count(429) >= 1
+    assert scheduler.rejected == statuses.count(429)
+
+
+async def test_unknown_keys_share_a_queue(nacl_client, nacl_server_keys) -> None:
+    served = []
+    registered = Nacl()
+    scheduler = FairScheduler(
+        max_in_flight=4,
+        max_in_flight_per_client=1,
+        max_queue_per_client=2,
+        known=lambda key: key == registered.decoded_public_key(),
+    )
+    app = make_app(nacl_server_keys.private_key, scheduler, served)
+    rotating = [await nacl_client(app, keys=Nacl()) for _ in range(6)]
+    client = await nacl_client(app, keys=registered)
+
+    responses = await gather(
+        *(
+            rotating_client.client.post(
+                "/echo", data=rotating_client.params({"client": "rotating"})
+            )
+            for rotating_client in rotating
+        ),
+        client.get("/echo", {"client": "registered"}),
+    )
+    statuses = [response.status for response in responses]
+    assert statuses[-1] == 200
+    assert statuses.count(429) == 3
+    assert scheduler.stats()["clients"] == 0
+
+
+async def test_weights_are_validated(nacl_client, nacl_server_keys) -> None:
+    scheduler = FairScheduler(weight=lambda key: 0, known=lambda key: True)
+    client = await nacl_client(make_app(nacl_server_keys.private_key, scheduler, []))
+    assert (await client.get("/echo", {"client": "weightless"})).status == 500
+    assert scheduler.stats()["clients"] == 0
@@ -0,0 +1,131 @@
+from asyncio import sleep
+
+from pytest import raises
+
+from nacl_middleware import MailBox, Nacl
+from nacl_middleware.group import Group, GroupKeyring
+from nacl_middleware.registry import ConnectionRegistry
+from tests.test_registry import FakeSocket
+
+server = Nacl()
+
+
+def keyring_pair() -> tuple:
+    client = Nacl()
+    server_mail_box = MailBox(server.private_key, client.decoded_public_key())
+    keyring = GroupKeyring(MailBox(client.private_key, server.decoded_public_key()))
+    return client.decoded_public_key(), server_mail_box, keyring
+
+
+def test_group_rotation() -> None:
+    group = Group("news")
+    _, mail_box_a, keyring_a = keyring_pair()
+    _, mail_box_b, keyring_b = keyring_pair()
+    assert group.join("a", mail_box_a) == {} and group.join("b", mail_box_b) == {}
+    with raises(RuntimeError):
+        group.box("too early")
+    key_messages = group.rotate()
+    assert set(key_messages) == {"a", "b"} and group.epoch == 2
+    assert group.rotate() == {}
+    keyring_a.unbox(key_messages["a"])
+    keyring_b.unbox(key_messages["b"])
+    envelope = group.box({"headline": "hi"})
+    assert keyring_a.unbox(envelope) == keyring_b.unbox(envelope) == {"headline": "hi"}
+
+    assert group.leave("b") and not group.leave("b")
+    key_messages = group.rotate()
+    assert set(key_messages) == {"a"}
+    keyring_a.unbox(key_messages["a"])
+    envelope = group.box("after")
+    assert keyring_a.unbox(envelope) == "after"
+    with raises(KeyError):
+        keyring_b.unbox(envelope)
+
+
+def test_group_without_join_rotation() -> None:
+    group = Group("news", rotate_on_join=False)
+    _, mail_box_a, _ = keyring_pair()
+    _, mail_box_b, _ = keyring_pair()
+    group.join("a", mail_box_a)
+    assert set(group.join("b", mail_box_b)) == {"b"}
+    assert group.epoch == 1
+
+
+async def test_registry_group_broadcast(nacl_loop) -> None:
+    registry = ConnectionRegistry(group_topics=True)
+    clients = []
+    for _ in range(3):
+        socket = FakeSocket()
+        public_key, server_mail_box, keyring = keyring_pair()
+        registry.add(socket, server_mail_box, public_key, ["news"])
+        clients.append((socket, keyring))
+    assert registry.broadcast({"headline": "hi"}, topic="news") == 3
+    await sleep(0)
+    broadcasts = {socket.sent[-1] for socket, _ in clients}
+    assert len(broadcasts) == 1
+    for socket, keyring in clients:
+        assert [keyring.unbox(text) for text in socket.sent][-1] == {"headline": "hi"}
+
+    leaver, _ = clients.pop()
+    registry.remove(leaver)
+    registry.broadcast("after", topic="news")
+    await sleep(0)
+    for socket, keyring in clients:
+        assert [keyring.unbox(text) for text in socket.sent][-1] == "after"
+    assert registry.group("news").epoch == 3
+    await registry.close()
+    assert registry.group("news") is None
+
+
+async def test_registry_coalesces_rotations(nacl_loop) -> None:
+    registry = ConnectionRegistry(group_topics=True)
+    sockets = []
+    for _ in range(4):
+        socket = FakeSocket()
+        public_key, server_mail_box, _ = keyring_pair()
+        registry.add(socket, server_mail_box, public_key, ["news"])
+        sockets.append(socket)
+    group = registry.group("news")
+    await sleep(0)
+    assert group.epoch == 2 and not group.stale
+
+    for socket in sockets[:3]:
+        registry.remove(socket)
+    assert group.stale
+    await sleep(0)
+    assert group.epoch == 3 and not group.stale
+    await sleep(0)
+    assert len(sockets[3].sent) == 2
+
+    socket = FakeSocket()
+    public_key, server_mail_box, _ = keyring_pair()
+    registry.add(socket, server_mail_box, public_key, ["news"])
+    await registry.close()
+    await sleep(0)
+    assert group.epoch == 3
+
+
+async def test_key_messages_are_never_dropped(nacl_loop) -> None:
+    registry = ConnectionRegistry(max_queue_size=2, group_topics=True)
+    slow = FakeSocket()
+    public_key, server_mail_box, keyring = keyring_pair()
+    registry.add(slow, server_mail_box, public_key, ["news"])
+    leaver = FakeSocket()
+    leaver_public_key, leaver_mail_box, _ = keyring_pair()
+    registry.add(leaver, leaver_mail_box, leaver_public_key, ["news"])
+    slow.flowing.clear()
+    # The writer takes the epoch 2 key message and stalls on the socket.
+    await sleep(0)
+    registry.broadcast("a", topic="news")
+
+    registry.remove(leaver)
+    await sleep(0)
+    registry.broadcast("b", topic="news")
+    registry.broadcast("c", topic="news")
+    assert registry.get(slow).dropped == 2
+
+    slow.flowing.set()
+    await sleep(0.01)
+    assert [keyring.unbox(text) for text in slow.sent][-1] == "c"
+    assert registry.group("news").epoch == 3
+    await registry.close()
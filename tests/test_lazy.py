@@ -0,0 +1,49 @@
+from aiohttp.web import Application, Request, Response
+
+from nacl_middleware import MailBox, nacl_middleware
+from nacl_middleware.lazy import LazyMessage, decrypted_message
+from nacl_middleware.tracing import TimingTracer
+
+
+async def reply_handler(request: Request) -> Response:
+    mail_box: MailBox = request["mail_box"]
+    return Response(text=mail_box.box("pong"))
+
+
+async def echo_handler(request: Request) -> Response:
+    mail_box: MailBox = request["mail_box"]
+    assert isinstance(request["decrypted_message"], LazyMessage)
+    return Response(text=mail_box.box(decrypted_message(request)))
+
+
+def make_app(private_key, tracer: TimingTracer) -> Application:
+    app = Application(
+        middlewares=[nacl_middleware(private_key, tracer=tracer, lazy=True)]
+    )
+    app.router.add_get("/reply", reply_handler)
+    app.router.add_get("/echo", echo_handler)
+    return app
+
+
+async def test_payload_never_read(nacl_client, nacl_server_keys) -> None:
+    tracer = TimingTracer()
+    client = await nacl_client(make_app(nacl_server_keys.private_key, tracer))
+    assert await client.send("/reply", {"ignored": True}) == "pong"
+    assert len(tracer.durations("nacl.decrypt")) == 1
+    assert tracer.durations("nacl.loads") == []
+
+
+async def test_payload_read(nacl_client, nacl_server_keys) -> None:
+    tracer = TimingTracer()
+    client = await nacl_client(make_app(nacl_server_keys.private_key, tracer))
+    assert await client.send("/echo", {"read": True}) == {"read": True}
+    assert len(tracer.durations("nacl.loads")) == 1
+
+
+async def test_tampered_payload_is_unauthorized(nacl_client, nacl_server_keys) -> None:
+    tracer = TimingTracer()
+    client = await nacl_client(make_app(nacl_server_keys.private_key, tracer))
+    params = client.params("tampered")
+    params["encryptedMessage"] = "A" * len(params["encryptedMessage"])
+    assert (await client.client.get("/echo", params=params)).status == 401
+    assert (await client.client.get("/reply", params=params)).status == 401
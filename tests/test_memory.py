@@ -0,0 +1,212 @@
+"""
+Memory budgets, failing when a change makes the middleware use more memory.
+
+The churn test sends NACL_MEMORY_REQUESTS requests, a few thousand by default. Set it
+to 1000000 for the full run before a release.
+"""
+
+from asyncio import sleep
+from gc import collect
+from logging import WARNING, getLogger
+from os import environ, sysconf
+from tracemalloc import get_traced_memory, reset_peak, start, stop
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from aiohttp import WSMsgType
+from aiohttp.test_utils import make_mocked_request
+from aiohttp.web import Application, Request, Response, WebSocketResponse
+from pytest import skip
+
+from nacl_middleware import KeyCache, MailBox, Nacl, nacl_middleware
+from nacl_middleware.cache import MemoryCache
+from nacl_middleware.registry import ConnectionRegistry
+from tests.utils import run
+
+REQUESTS = int(environ.get("NACL_MEMORY_REQUESTS", "5000"))
+"""Number of requests of the churn test."""
+
+REQUEST_BUDGET = 2048
+"""Peak bytes allocated by the middleware for a request, beyond an excluded request."""
+
+RETAINED_REQUEST_BUDGET = 8
+"""Bytes retained per request once the clients are cached."""
+
+KEY_BUDGET = 200
+"""Bytes retained per client in the default KeyCache."""
+
+WEBSOCKET_BUDGET = 48 * 1024
+"""Bytes per open encrypted WebSocket, client and server sides together."""
+
+RSS_GROWTH_BUDGET = 4 * 1024 * 1024
+"""Growth of the resident set size over the churn test once warmed up, whatever its
+number of requests, as in a steady state the allocator reuses its pages."""
+
+server = Nacl()
+
+# Other tests may enable debug logging, whose records would be counted.
+log = getLogger("tests.memory")
+log.setLevel(WARNING)
+# A plain protocol, as the default mock records every access to its properties.
+template = make_mocked_request(
+    "GET",
+    "/",
+    protocol=SimpleNamespace(
+        max_field_size=8190,
+        max_line_length=8190,
+        max_headers=128,
+        transport=None,
+        peername=None,
+        sockname=None,
+        ssl_context=None,
+    ),
+)
+
+
+def encrypted_path(path: str, client: Nacl, message: any) -> str:
+    mail_box = MailBox(client.private_key, server.decoded_public_key())
+    query = {
+        "publicKey": client.decoded_public_key(),
+        "encryptedMessage": mail_box.box(message),
+    }
+    return f"{path}?{urlencode(query)}"
+
+
+async def echo_handler(request: Request) -> Response:
+    mail_box: MailBox = request["mail_box"]
+    return Response(text=mail_box.box(request["decrypted_message"]))
+
+
+async def plain_handler(request: Request) -> Response:
+    return Response(text="plain")
+
+
+def mocked_request(path: str) -> Request:
+    return template.clone(rel_url=path)
+
+
+def resident_set_size() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * sysconf("SC_PAGE_SIZE")
+    except OSError:
+        skip("The resident set size is only read on Linux")
+
+
+def test_request_allocations() -> None:
+    middleware = nacl_middleware(server.private_key, exclude_routes=("/plain",), log=log)
+    clients = [Nacl() for _ in range(16)]
+    paths = [encrypted_path("/echo", client, {"hello": "world"}) for client in clients]
+
+    async def peak(path: str, handler) -> int:
+        request = mocked_request(path)
+        before = get_traced_memory()[0]
+        reset_peak()
+        await middleware(request, handler)
+        return get_traced_memory()[1] - before
+
+    async def main() -> tuple:
+        for path in paths:
+            await middleware(mocked_request(path), echo_handler)
+        collect()
+        start()
+        try:
+            encrypted = sorted([await peak(path, echo_handler) for path in paths * 8])
+            excluded = sorted(
+                [await peak(f"/plain?{path[6:]}", plain_handler) for path in paths * 8]
+            )
+            collect()
+            retained = get_traced_memory()[0]
+            for path in paths * 64:
+                await middleware(mocked_request(path), echo_handler)
+            collect()
+            retained = get_traced_memory()[0] - retained
+        finally:
+            stop()
+        middle = len(encrypted) // 2
+        return encrypted[middle] - excluded[middle], retained / (len(paths) * 64)
+
+    allocated, retained = run(main())
+    assert allocated < REQUEST_BUDGET
+    assert retained < RETAINED_REQUEST_BUDGET
+
+
+def test_cached_key_memory() -> None:
+    public_keys = [Nacl().decoded_public_key() for _ in range(2000)]
+
+    async def fill() -> KeyCache:
+        key_cache = KeyCache(server.private_key)
+        for public_key in public_keys:
+            await key_cache.lookup(public_key)
+        return key_cache
+
+    start()
+    try:
+        key_cache = run(fill())
+        size = get_traced_memory()[0]
+    finally:
+        stop()
+    assert len(key_cache.backend) == len(public_keys)
+    assert size / len(public_keys) < KEY_BUDGET
+
+
+async def test_websocket_memory(nacl_client, nacl_server_keys) -> None:
+    registry = ConnectionRegistry()
+
+    async def websocket_handler(request: Request) -> WebSocketResponse:
+        socket = WebSocketResponse()
+        await socket.prepare(request)
+        registry.add(socket, request["mail_box"], request.query["publicKey"])
+        try:
+            async for message in socket:
+                if message.type != WSMsgType.TEXT:
+                    break
+        finally:
+            registry.remove(socket)
+        return socket
+
+    app = Application(
+        middlewares=[nacl_middleware(nacl_server_keys.private_key, log=log)]
+    )
+    app.router.add_get("/ws", websocket_handler)
+    client = await nacl_client(app)
+    await (await client.ws_connect("/ws", "warm up")).close()
+
+    count = 50
+    collect()
+    start()
+    try:
+        before = get_traced_memory()[0]
+        sockets = [await client.ws_connect("/ws", "hello") for _ in range(count)]
+        while len(registry) < count:
+            await sleep(0.001)
+        size = get_traced_memory()[0] - before
+    finally:
+        stop()
+    for socket in sockets:
+        await socket.close()
+    assert size / count < WEBSOCKET_BUDGET
+
+
+def test_steady_state_with_key_churn() -> None:
+    middleware = nacl_middleware(
+        server.private_key,
+        log=log,
+        key_cache=KeyCache(server.private_key, MemoryCache(256)),
+    )
+    clients = [Nacl() for _ in range(1024)]
+    paths = [encrypted_path("/echo", client, {"n": 1}) for client in clients]
+
+    async def serve(requests: int) -> None:
+        for index in range(requests):
+            request = mocked_request(paths[index % len(paths)])
+            response = await middleware(request, echo_handler)
+            assert response.status == 200
+
+    warm_up = min(REQUESTS, 10 * len(paths))
+    run(serve(warm_up))
+    collect()
+    before = resident_set_size()
+    run(serve(REQUESTS))
+    collect()
+    assert resident_set_size() - before < RSS_GROWTH_BUDGET
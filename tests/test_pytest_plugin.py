@@ -0,0 +1,56 @@
+from aiohttp import WSMsgType
+from aiohttp.web import Application, Request, Response, WebSocketResponse
+
+from nacl_middleware import MailBox, Nacl, nacl_middleware
+from nacl_middleware.pytest_plugin import DecryptedMessageRecorder
+
+
+async def thanks_handler(request: Request) -> Response:
+    mail_box: MailBox = request["mail_box"]
+    if request["decrypted_message"] == "Thank you!":
+        return Response(text=mail_box.box("You are welcome!"))
+    return Response(text=mail_box.box("Pardon me?"))
+
+
+async def echo_handler(request: Request) -> WebSocketResponse:
+    mail_box: MailBox = request["mail_box"]
+    socket = WebSocketResponse()
+    await socket.prepare(request)
+    async for message in socket:
+        if message.type == WSMsgType.TEXT:
+            await socket.send_str(mail_box.box(mail_box.unbox(message.data)))
+    return socket
+
+
+def make_app(server_keys: Nacl, recorder: DecryptedMessageRecorder) -> Application:
+    app = Application(
+        middlewares=[nacl_middleware(server_keys.private_key), recorder.middleware]
+    )
+    app.router.add_get("/handle_thanks", thanks_handler)
+    app.router.add_get("/websocket", echo_handler)
+    return app
+
+
+async def test_http(nacl_client, nacl_server_keys, nacl_recorder) -> None:
+    client = await nacl_client(make_app(nacl_server_keys, nacl_recorder))
+    assert await client.send("/handle_thanks", "Thank you!") == "You are welcome!"
+    assert await client.send("/handle_thanks", "Hi") == "Pardon me?"
+    nacl_recorder.assert_received("Thank you!", path="/handle_thanks")
+    assert nacl_recorder.received() == ["Thank you!", "Hi"]
+
+
+async def test_websocket(nacl_client, nacl_server_keys, nacl_recorder) -> None:
+    client = await nacl_client(make_app(nacl_server_keys, nacl_recorder))
+    socket = await client.ws_connect("/websocket", {"hello": "there"})
+    await socket.send({"name": "Georgia"})
+    assert await socket.receive() == {"name": "Georgia"}
+    await socket.close()
+    nacl_recorder.assert_received({"hello": "there"}, path="/websocket")
+
+
+async def test_wrong_server_key(nacl_client, nacl_server_keys, nacl_recorder) -> None:
+    app = make_app(nacl_server_keys, nacl_recorder)
+    client = await nacl_client(app, server_hex_public_key=Nacl().decoded_public_key())
+    response = await client.get("/handle_thanks", "Thank you!")
+    assert response.status == 401
+    assert nacl_recorder.received() == []
@@ -0,0 +1,112 @@
+from asyncio import Event, sleep
+
+from nacl_middleware import MailBox, Nacl
+from nacl_middleware.registry import ConnectionRegistry, SlowConsumerPolicy
+
+server = Nacl()
+
+
+class FakeSocket:
+    """A stand-in for WebSocketResponse whose sends can be held back."""
+
+    def __init__(self) -> None:
+        self.sent = []
+        self.closed = False
+        self.close_code = None
+        self.flowing = Event()
+        self.flowing.set()
+
+    async def send_str(self, data: str) -> None:
+        await self.flowing.wait()
+        self.sent.append(data)
+
+    async def close(self, code: int = None, message: bytes = b"") -> None:
+        self.closed = True
+        self.close_code = code
+
+
+def connect(registry: ConnectionRegistry, topics=()) -> tuple:
+    client = Nacl()
+    socket = FakeSocket()
+    client_mail_box = MailBox(client.private_key, server.decoded_public_key())
+    server_mail_box = MailBox(server.private_key, client.decoded_public_key())
+    registry.add(socket, server_mail_box, client.decoded_public_key(), topics)
+    return socket, client_mail_box, client.decoded_public_key()
+
+
+async def test_indexes(nacl_loop) -> None:
+    registry = ConnectionRegistry()
+    socket_a, _, key_a = connect(registry, ["news"])
+    socket_b, _, _ = connect(registry, ["news", "sport"])
+    assert len(registry) == 2
+    assert [c.socket for c in registry.by_public_key(key_a)] == [socket_a]
+    assert {c.socket for c in registry.by_topic("news")} == {socket_a, socket_b}
+    registry.unsubscribe(socket_b, "news")
+    assert [c.socket for c in registry.by_topic("news")] == [socket_a]
+    registry.remove(socket_a)
+    assert socket_a not in registry
+    assert registry.by_topic("news") == []
+    assert registry.by_public_key(key_a) == []
+    await registry.close()
+    assert socket_b.closed and len(registry) == 0
+
+
+async def test_broadcast_by_topic(nacl_loop) -> None:
+    registry = ConnectionRegistry()
+    socket_a, mail_box_a, _ = connect(registry, ["news"])
+    socket_b, _, _ = connect(registry)
+    assert registry.broadcast({"headline": "hi"}, topic="news") == 1
+    assert registry.broadcast("all") == 2
+    await sleep(0)
+    assert [mail_box_a.unbox(text) for text in socket_a.sent] == [
+        {"headline": "hi"},
+        "all",
+    ]
+    assert len(socket_b.sent) == 1
+    await registry.close()
+
+
+async def test_slow_consumer_drop_oldest(nacl_loop) -> None:
+    registry = ConnectionRegistry(max_queue_size=2)
+    socket, mail_box, _ = connect(registry)
+    socket.flowing.clear()
+    await sleep(0)
+    for index in range(10):
+        registry.send(socket, index)
+    connection = registry.get(socket)
+    assert connection.queued == 2
+    assert connection.dropped == 8
+    socket.flowing.set()
+    await sleep(0.01)
+    assert [mail_box.unbox(text) for text in socket.sent] == [8, 9]
+    await registry.close()
+
+
+async def test_essential_messages_are_kept(nacl_loop) -> None:
+    registry = ConnectionRegistry(max_queue_size=1)
+    socket, _, _ = connect(registry)
+    socket.flowing.clear()
+    await sleep(0)
+    connection = registry.get(socket)
+    assert registry.enqueue(connection, "key", essential=True)
+    await sleep(0)
+    assert registry.enqueue(connection, "key", essential=True)
+    # Nothing but an essential message could make room.
+    assert not registry.send(socket, 0)
+    await sleep(0)
+    assert socket.closed and socket not in registry
+
+
+async def test_slow_consumer_disconnect(nacl_loop) -> None:
+    registry = ConnectionRegistry(max_queue_size=1, policy=SlowConsumerPolicy.Disconnect)
+    socket, _, _ = connect(registry)
+    socket.flowing.clear()
+    await sleep(0)
+    assert registry.send(socket, 0)
+    # The writer takes message 0 and stalls on the socket.
+    await sleep(0)
+    assert registry.send(socket, 1)
+    assert not registry.send(socket, 2)
+    await sleep(0)
+    assert socket.closed
+    assert socket not in registry
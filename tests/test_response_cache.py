@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+from typing import List
+
+from aiohttp.web import Application, Request
+
+from nacl_middleware import nacl_middleware
+from nacl_middleware.lazy import decrypted_message
+from nacl_middleware.response_cache import ResponseCache
+from nacl_middleware.typed import message_type
+
+
+@dataclass
+class Tag:
+    name: str
+
+
+@dataclass
+class Query:
+    name: str
+    tags: List[Tag]
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_app(private_key, cache: ResponseCache, calls: list) -> Application:
+    @cache
+    async def lookup(request: Request) -> dict:
+        calls.append(decrypted_message(request))
+        return {"value": decrypted_message(request)["name"].upper()}
+
+    app = Application(middlewares=[nacl_middleware(private_key, lazy=True)])
+    app.router.add_get("/lookup", lookup)
+    return app
+
+
+async def test_hits_are_boxed_freshly(nacl_client, nacl_server_keys) -> None:
+    calls = []
+    clock = Clock()
+    cache = ResponseCache(ttl=10, max_size=2, clock=clock)
+    client = await nacl_client(make_app(nacl_server_keys.private_key, cache, calls))
+
+    first = await client.get("/lookup", {"name": "a"})
+    second = await client.get("/lookup", {"name": "a"})
+    texts = [await first.text(), await second.text()]
+    assert texts[0] != texts[1]
+    assert [client.unbox(text) for text in texts] == [{"value": "A"}] * 2
+    assert (cache.hits, cache.misses, len(calls)) == (1, 1, 1)
+
+    for name in "bc":
+        assert await client.send("/lookup", {"name": name}) == {"value": name.upper()}
+    assert len(cache) == 2
+    assert await client.send("/lookup", {"name": "a"}) == {"value": "A"}
+    assert len(calls) == 4
+
+    clock.now = 11
+    assert await client.send("/lookup", {"name": "a"}) == {"value": "A"}
+    assert len(calls) == 5
+
+
+async def test_errors_and_large_results(nacl_client, nacl_server_keys) -> None:
+    calls = []
+    cache = ResponseCache(max_entry_size=10)
+    client = await nacl_client(make_app(nacl_server_keys.private_key, cache, calls))
+    for _ in range(2):
+        assert await client.send("/lookup", {"name": "long"}) == {"value": "LONG"}
+    assert len(cache) == 0
+
+    params = client.params({"name": "a"})
+    params["encryptedMessage"] = "A" * len(params["encryptedMessage"])
+    assert (await client.client.get("/lookup", params=params)).status == 401
+
+
+async def test_typed_messages(nacl_client, nacl_server_keys) -> None:
+    calls = []
+    cache = ResponseCache()
+
+    @message_type(Query)
+    @cache
+    async def query(request: Request) -> list:
+        calls.append(request["decrypted_message"])
+        return [tag.name for tag in request["decrypted_message"].tags]
+
+    @cache
+    @message_type(Query)
+    async def reversed_query(request: Request) -> list:
+        calls.append(request["decrypted_message"])
+        return [tag.name for tag in request["decrypted_message"].tags][::-1]
+
+    app = Application(middlewares=[nacl_middleware(nacl_server_keys.private_key)])
+    app.router.add_get("/query", query)
+    app.router.add_get("/reversed", reversed_query)
+    client = await nacl_client(app)
+
+    message = {"name": "q", "tags": [{"name": "a"}, {"name": "b"}]}
+    for _ in range(2):
+        assert await client.send("/query", message) == ["a", "b"]
+        assert await client.send("/reversed", message) == ["b", "a"]
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert calls == [Query("q", [Tag("a"), Tag("b")])] * 2
@@ -0,0 +1,54 @@
+from aiohttp import ClientSession
+from aiohttp.web import Application, Request, Response
+from nacl.public import PrivateKey
+
+from nacl_middleware import KeyCache, MailBox, Nacl, nacl_middleware
+from nacl_middleware.runner import MultiProcessRunner, stats_key
+from tests.utils import run
+
+server = Nacl()
+
+
+async def thanks_handler(request: Request) -> Response:
+    mail_box: MailBox = request["mail_box"]
+    return Response(text=mail_box.box(request["decrypted_message"]))
+
+
+def app_factory() -> Application:
+    key_cache = KeyCache(server.private_key)
+    app = Application(
+        middlewares=[nacl_middleware(server.private_key, key_cache=key_cache)]
+    )
+    app.router.add_get("/handle_thanks", thanks_handler)
+    app[stats_key] = key_cache.stats
+    return app
+
+
+async def send_messages(port: int, count: int) -> None:
+    client = Nacl()
+    mail_box = MailBox(client.private_key, server.decoded_public_key())
+    async with ClientSession() as session:
+        for index in range(count):
+            params = {
+                "publicKey": client.decoded_public_key(),
+                "encryptedMessage": mail_box.box(index),
+            }
+            async with session.get(
+                f"http://127.0.0.1:{port}/handle_thanks", params=params
+            ) as response:
+                assert mail_box.unbox(await response.text()) == index
+
+
+def test_multi_process_runner() -> None:
+    runner = MultiProcessRunner(app_factory, host="127.0.0.1", port=0, workers=2)
+    runner.start()
+    try:
+        assert all(worker["alive"] for worker in runner.status())
+        run(send_messages(runner.port, 10))
+        stats = runner.stats()
+        assert len(stats["workers"]) == 2
+        assert stats["totals"]["requests"] == 10
+        assert stats["totals"]["hits"] + stats["totals"]["misses"] == 10
+    finally:
+        runner.stop()
+    assert runner.status() == []
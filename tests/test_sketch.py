@@ -0,0 +1,89 @@
+from collections import Counter
+from random import Random
+
+from aiohttp.web import Application, Request, Response
+
+from nacl_middleware import MailBox, Nacl, nacl_middleware
+from nacl_middleware.cache import MemoryCache, SharedKeyArena
+from nacl_middleware.sketch import CountMinSketch, HeavyHitters, heavy_hitters_handler
+from tests.utils import run
+
+
+def test_count_min_sketch_bounds() -> None:
+    random = Random(7)
+    sketch = CountMinSketch(width=256, depth=4)
+    keys = [f"key{random.paretovariate(1.2):.0f}" for _ in range(20000)]
+    for key in keys:
+        sketch.add(key)
+    counts = Counter(keys)
+    errors = [sketch.estimate(key) - count for key, count in counts.items()]
+    assert min(errors) >= 0
+    assert sum(errors) / len(errors) < 20000 / 256
+    sketch.halve()
+    assert sketch.estimate("key1") <= counts["key1"]
+
+
+def test_heavy_hitters_and_admission() -> None:
+    heavy_hitters = HeavyHitters(top_size=4, width=512, sample_size=10**6)
+    hot = [Nacl().decoded_public_key() for _ in range(3)]
+    for index in range(3000):
+        heavy_hitters.record(f"{index:064x}", 100)
+        heavy_hitters.record(hot[index % 3], 1000 * (index % 3 + 1))
+    assert [hitter.public_key for hitter in heavy_hitters.top(3)] == hot[::-1]
+    assert heavy_hitters.top(1)[0].requests >= 1000
+    assert len(heavy_hitters.top()) == 4
+    assert heavy_hitters.stats()["total_requests"] == 6000
+
+    one_off = f"{1:064x}"
+
+    async def cached(backend) -> set:
+        for key in hot[:2] + [one_off]:
+            await backend.set(key, bytes(32))
+        return {key for key in hot + [one_off] if await backend.get(key)}
+
+    assert run(cached(MemoryCache(2, admission=heavy_hitters.admit))) == set(hot[:2])
+    assert run(cached(SharedKeyArena(2, admission=heavy_hitters.admit))) == set(hot[:2])
+    assert run(cached(MemoryCache(2))) == {hot[1], one_off}
+
+
+async def test_admin_route(nacl_client, nacl_server_keys, nacl_client_keys) -> None:
+    heavy_hitters = HeavyHitters()
+
+    async def echo_handler(request: Request) -> Response:
+        mail_box: MailBox = request["mail_box"]
+        return Response(text=mail_box.box(request["decrypted_message"]))
+
+    app = Application(
+        middlewares=[
+            nacl_middleware(
+                nacl_server_keys.private_key,
+                exclude_routes=("/admin/.*",),
+                heavy_hitters=heavy_hitters,
+            )
+        ]
+    )
+    app.router.add_get("/echo", echo_handler)
+    app.router.add_get("/admin/heavy-hitters", heavy_hitters_handler(heavy_hitters))
+    client = await nacl_client(app, keys=nacl_client_keys)
+    for _ in range(3):
+        assert await client.send("/echo", "hello") == "hello"
+
+    response = await client.client.get("/admin/heavy-hitters", params={"count": "1"})
+    report = await response.json()
+    assert report["total_requests"] == 3
+    assert report["top"][0]["public_key"] == nacl_client_keys.decoded_public_key()
+    assert report["top"][0]["requests"] == 3
+
+    # A box that does not open under the key it claims is not counted.
+    forged = nacl_client_keys.decoded_public_key()
+    encrypted_message = MailBox(
+        Nacl().private_key, nacl_server_keys.decoded_public_key()
+    ).box("hi")
+    response = await client.client.get(
+        "/echo", params={"publicKey": forged, "encryptedMessage": encrypted_message}
+    )
+    assert response.status == 401
+    assert heavy_hitters.requests.estimate(forged) == 3
+    assert heavy_hitters.total_requests == 3
+    bad = await client.client.get("/admin/heavy-hitters", params={"count": "x"})
+    assert bad.status == 400
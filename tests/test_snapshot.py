@@ -0,0 +1,109 @@
+from asyncio import sleep
+
+from aiohttp.web import Application, Request, Response
+from pytest import raises
+
+from nacl_middleware import KeyCache, MailBox, Nacl, nacl_middleware
+from nacl_middleware.cache import MemoryCache, RedisCache, SharedKeyArena
+from nacl_middleware.snapshot import Snapshotter, read_snapshot, write_snapshot
+from tests.utils import run
+
+server = Nacl()
+
+
+def test_snapshot_round_trip(tmp_path) -> None:
+    entries = [(Nacl().decoded_public_key(), bytes([n]) * 32) for n in range(3)]
+    path = tmp_path / "keys.snapshot"
+    assert write_snapshot(path, server.private_key, entries) == 3
+    assert read_snapshot(path, server.private_key) == entries
+    with raises(ValueError):
+        read_snapshot(path, Nacl().private_key)
+
+
+def test_hottest_entries_survive_restart(tmp_path) -> None:
+    clients = [Nacl().decoded_public_key() for _ in range(4)]
+    path = tmp_path / "keys.snapshot"
+
+    async def main() -> None:
+        key_cache = KeyCache(server.private_key, MemoryCache())
+        for client in clients + clients[:1]:
+            await key_cache.get(client)
+        assert await Snapshotter(key_cache, server.private_key, path, 2).save() == 2
+
+        restarted = KeyCache(server.private_key, SharedKeyArena(10))
+        assert await Snapshotter(restarted, server.private_key, path).load() == 2
+        await restarted.get(clients[0])
+        await restarted.get(clients[3])
+        assert (restarted.hits, restarted.derivations) == (2, 0)
+        assert {key for key, _ in restarted.hottest(2)} == {clients[0], clients[3]}
+
+    run(main())
+
+
+def test_invalid_snapshot_is_ignored(tmp_path) -> None:
+    path = tmp_path / "keys.snapshot"
+    path.write_bytes(b"garbage" * 10)
+    key_cache = KeyCache(server.private_key)
+    assert run(Snapshotter(key_cache, server.private_key, tmp_path / "none").load()) == 0
+    assert run(Snapshotter(key_cache, server.private_key, path).load()) == 0
+
+
+def test_snapshot_failures(tmp_path) -> None:
+    with raises(TypeError):
+        Snapshotter(KeyCache(server.private_key, RedisCache()), server.private_key, "x")
+
+    calls = []
+
+    class FailingCache(MemoryCache):
+        def hottest(self, count: int) -> list:
+            if count:
+                calls.append(count)
+                raise RuntimeError("unavailable")
+            return []
+
+    snapshotter = Snapshotter(
+        KeyCache(server.private_key, FailingCache()),
+        server.private_key,
+        tmp_path / "keys.snapshot",
+        interval=0,
+    )
+
+    async def main() -> None:
+        context = snapshotter.context(Application())
+        await context.__anext__()
+        await sleep(0.01)
+        with raises(StopAsyncIteration):
+            await context.__anext__()
+
+    run(main())
+    # The periodic task kept running after a failure, and so did the shutdown.
+    assert len(calls) > 2
+
+
+async def echo_handler(request: Request) -> Response:
+    mail_box: MailBox = request["mail_box"]
+    return Response(text=mail_box.box(request["decrypted_message"]))
+
+
+async def test_warm_before_first_request(
+    nacl_client, nacl_server_keys, nacl_client_keys, tmp_path
+) -> None:
+    path = tmp_path / "keys.snapshot"
+    shared_key = MailBox(
+        nacl_server_keys.private_key, nacl_client_keys.decoded_public_key()
+    ).shared_key()
+    write_snapshot(
+        path,
+        nacl_server_keys.private_key,
+        [(nacl_client_keys.decoded_public_key(), shared_key)],
+    )
+    key_cache = KeyCache(nacl_server_keys.private_key)
+    app = Application(
+        middlewares=[nacl_middleware(nacl_server_keys.private_key, key_cache=key_cache)]
+    )
+    app.router.add_get("/echo", echo_handler)
+    Snapshotter(key_cache, nacl_server_keys.private_key, path, interval=3600).attach(app)
+
+    client = await nacl_client(app)
+    assert await client.send("/echo", "warm") == "warm"
+    assert key_cache.derivations == 0
@@ -0,0 +1,109 @@
+from asyncio import sleep
+
+from aiohttp.web import Application, Request
+from pytest import raises
+
+from nacl_middleware import MailBox, Nacl, nacl_middleware
+from nacl_middleware.group import GroupKeyring
+from nacl_middleware.registry import ConnectionRegistry
+from nacl_middleware.sse import EventHistory, EventStream, read_events
+
+
+def make_app(private_key, registry: ConnectionRegistry, history: EventHistory):
+    async def events_handler(request: Request) -> EventStream:
+        stream = EventStream(request["mail_box"], heartbeat=0.05)
+        await stream.prepare(request)
+        if not stream.resume(history, ["news"]):
+            await stream.send({"reset": True})
+        registry.add(stream, request["mail_box"], request.query["publicKey"], ["news"])
+        try:
+            await stream.run()
+        finally:
+            registry.remove(stream)
+        return stream
+
+    app = Application(middlewares=[nacl_middleware(private_key)])
+    app.router.add_get("/events", events_handler)
+    return app
+
+
+async def wait_for_subscriber(registry: ConnectionRegistry) -> EventStream:
+    while not len(registry):
+        await sleep(0.005)
+    return next(iter(registry)).socket
+
+
+async def test_group_broadcasts_and_batches(
+    nacl_client, nacl_server_keys, nacl_client_keys
+) -> None:
+    registry = ConnectionRegistry(group_topics=True)
+    history = EventHistory()
+    app = make_app(nacl_server_keys.private_key, registry, history)
+    client = await nacl_client(app, keys=nacl_client_keys)
+    keyring = GroupKeyring(client.mail_box)
+
+    response = await client.get("/events", "subscribe")
+    assert response.status == 200
+    assert response.headers["Content-Type"] == "text/event-stream"
+    stream = await wait_for_subscriber(registry)
+    history.publish(registry, {"headline": "one"}, "news")
+    history.publish(registry, {"headline": "two"}, "news")
+    await sleep(0.01)
+    await stream.send("first")
+    await stream.send("second", event_id="custom")
+
+    received = []
+    async for event_id, message in read_events(response, keyring):
+        received.append((event_id, message))
+        if len(received) == 5:
+            break
+    assert "groupKey" in received[0][1]
+    assert received[1:] == [
+        ("1", {"headline": "one"}),
+        ("2", {"headline": "two"}),
+        ("custom", "first"),
+        ("custom", "second"),
+    ]
+    response.close()
+
+
+async def test_resume_and_heartbeat(
+    nacl_client, nacl_server_keys, nacl_client_keys
+) -> None:
+    registry = ConnectionRegistry()
+    history = EventHistory(max_events=3)
+    for index in range(4):
+        history.append(index, "news" if index % 2 else None)
+    history.append("other", "sport")
+    app = make_app(nacl_server_keys.private_key, registry, history)
+    client = await nacl_client(app, keys=nacl_client_keys)
+
+    response = await client.get("/events", "resume", headers={"Last-Event-ID": "2"})
+    event_lines = [await response.content.readline() for _ in range(4)]
+    assert event_lines[:2] == [b"event: batch\n", b"id: 4\n"]
+    assert client.unbox(event_lines[2][len("data: ") :].decode().strip()) == [2, 3]
+    assert await response.content.readline() == b":\n"
+    response.close()
+
+    response = await client.get("/events", "resume", headers={"Last-Event-ID": "1"})
+    async for event_id, message in read_events(response, client.mail_box):
+        assert (event_id, message) == (None, {"reset": True})
+        break
+    response.close()
+    assert history.since("5") == [] and history.since("6") is None
+
+
+async def test_closed_stream_is_dropped(nacl_loop) -> None:
+    client = Nacl()
+    mail_box = MailBox(Nacl().private_key, client.decoded_public_key())
+    registry = ConnectionRegistry()
+    stream = EventStream(mail_box)
+    registry.add(stream, mail_box, client.decoded_public_key())
+    await stream.close()
+    with raises(ConnectionResetError):
+        await stream.send("late")
+    for index in range(3):
+        registry.send(stream, index)
+    await sleep(0)
+    assert stream not in registry
+    assert stream._pending == []
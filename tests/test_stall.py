@@ -0,0 +1,61 @@
+from asyncio import sleep
+from time import sleep as block
+
+from aiohttp.web import Application, Request, Response
+
+from nacl_middleware import MailBox, nacl_middleware
+from nacl_middleware.stall import OUTSIDE_STAGE, StallMonitor
+from nacl_middleware.tracing import TimingTracer
+from tests.utils import run
+
+
+def test_stalls_are_attributed_to_stages() -> None:
+    timing = TimingTracer()
+    monitor = StallMonitor(threshold=0.05, interval=0.005, tracer=timing)
+
+    async def main() -> None:
+        monitor.start()
+        try:
+            await sleep(0.02)
+            with monitor.span("nacl.request", **{"http.target": "/upload"}):
+                with monitor.span("nacl.decrypt") as span:
+                    span.set_attribute("nacl.ciphertext_size", 4096)
+                    block(0.15)
+            await sleep(0.02)
+            block(0.08)
+            await sleep(0.02)
+        finally:
+            monitor.stop()
+
+    run(main())
+    stages = {stall.stage: stall for stall in monitor.stalls}
+    assert set(stages) == {"nacl.decrypt", OUTSIDE_STAGE}
+    decrypt = stages["nacl.decrypt"]
+    assert decrypt.duration >= 0.1
+    assert (decrypt.payload_size, decrypt.target) == (4096, "/upload")
+    histogram = monitor.histogram()
+    assert histogram["nacl.decrypt"]["count"] == 1
+    assert histogram["nacl.decrypt"]["buckets"]["0.25"] == 1
+    assert [span.name for span in timing.spans] == ["nacl.decrypt", "nacl.request"]
+    assert timing.spans[0].attributes == {"nacl.ciphertext_size": 4096}
+
+
+async def test_blocking_handler(nacl_client, nacl_server_keys) -> None:
+    monitor = StallMonitor(threshold=0.05, interval=0.005)
+
+    async def blocking_handler(request: Request) -> Response:
+        block(0.1)
+        mail_box: MailBox = request["mail_box"]
+        return Response(text=mail_box.box(request["decrypted_message"]))
+
+    app = Application(
+        middlewares=[nacl_middleware(nacl_server_keys.private_key, tracer=monitor)]
+    )
+    app.router.add_get("/block", blocking_handler)
+    monitor.attach(app)
+    client = await nacl_client(app)
+    assert await client.send("/block", "slow") == "slow"
+    await sleep(0.02)
+    assert [(stall.stage, stall.target) for stall in monitor.stalls] == [
+        ("nacl.handler", "/block")
+    ]
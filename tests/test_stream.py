@@ -0,0 +1,88 @@
+from io import BytesIO
+from tempfile import TemporaryFile
+
+from aiohttp.web import Application, Request, Response, json_response
+from nacl.hash import sha256
+
+from nacl_middleware import nacl_middleware
+from nacl_middleware.stream import (
+    StreamEncryptor,
+    decrypt_stream,
+    read_chunks,
+    spool_stream,
+    stream_metadata,
+)
+
+CHUNK_SIZE = 1024
+
+
+async def upload_handler(request: Request) -> Response:
+    with TemporaryFile() as file:
+        size = await spool_stream(request, file, max_chunk_size=CHUNK_SIZE)
+        file.seek(0)
+        digest = sha256(file.read()).decode()
+    return json_response(
+        {"size": size, "sha256": digest, "metadata": stream_metadata(request)}
+    )
+
+
+async def chunks_handler(request: Request) -> Response:
+    sizes = [len(chunk) async for chunk in decrypt_stream(request, CHUNK_SIZE)]
+    return json_response(sizes)
+
+
+def make_app(private_key) -> Application:
+    app = Application(middlewares=[nacl_middleware(private_key)])
+    app.router.add_post("/upload", upload_handler)
+    app.router.add_post("/chunks", chunks_handler)
+    return app
+
+
+async def post(client, path: str, encryptor: StreamEncryptor, body: bytes):
+    params = {
+        "publicKey": client.keys.decoded_public_key(),
+        "encryptedMessage": encryptor.encrypted_message,
+    }
+    return await client.client.post(path, params=params, data=body)
+
+
+async def test_upload(nacl_client, nacl_server_keys) -> None:
+    client = await nacl_client(make_app(nacl_server_keys.private_key))
+    data = bytes(range(256)) * 40
+    encryptor = StreamEncryptor(client.mail_box, {"name": "data.bin"})
+    body = b"".join(encryptor.frames(read_chunks(BytesIO(data), CHUNK_SIZE)))
+    response = await post(client, "/upload", encryptor, body)
+    assert await response.json() == {
+        "size": len(data),
+        "sha256": sha256(data).decode(),
+        "metadata": {"name": "data.bin"},
+    }
+
+    encryptor = StreamEncryptor(client.mail_box)
+    response = await post(client, "/chunks", encryptor, b"".join(encryptor.frames([])))
+    assert await response.json() == [0]
+
+
+async def test_tampering_is_detected(nacl_client, nacl_server_keys) -> None:
+    client = await nacl_client(make_app(nacl_server_keys.private_key))
+
+    def frames(count: int):
+        encryptor = StreamEncryptor(client.mail_box)
+        chunks = [bytes([index]) * 100 for index in range(count)]
+        return encryptor, list(encryptor.frames(chunks))
+
+    encryptor, parts = frames(3)
+    truncated = b"".join(parts[:2])
+    assert (await post(client, "/chunks", encryptor, truncated)).status == 401
+
+    encryptor, parts = frames(3)
+    reordered = b"".join([parts[1], parts[0], parts[2]])
+    assert (await post(client, "/chunks", encryptor, reordered)).status == 401
+
+    encryptor, parts = frames(2)
+    trailing = b"".join(parts) + parts[0]
+    assert (await post(client, "/chunks", encryptor, trailing)).status == 401
+
+    encryptor = StreamEncryptor(client.mail_box)
+    too_large = encryptor.push(bytes(CHUNK_SIZE + 1), final=True)
+    assert (await post(client, "/chunks", encryptor, too_large)).status == 413
@@ -0,0 +1,40 @@
+from aiohttp.web import Application, Request, Response
+
+from nacl_middleware import MailBox, nacl_middleware
+from nacl_middleware.tracing import TimingTracer
+
+STAGES = ["nacl.parse", "nacl.key_lookup", "nacl.decrypt", "nacl.loads"]
+
+
+async def echo_handler(request: Request) -> Response:
+    mail_box: MailBox = request["mail_box"]
+    return Response(text=mail_box.box(request["decrypted_message"]))
+
+
+async def test_stage_spans(nacl_client, nacl_server_keys) -> None:
+    tracer = TimingTracer()
+    app = Application(
+        middlewares=[nacl_middleware(nacl_server_keys.private_key, tracer=tracer)]
+    )
+    app.router.add_get("/echo", echo_handler)
+    client = await nacl_client(app)
+
+    assert await client.send("/echo", {"size": "x" * 100}) == {"size": "x" * 100}
+    assert [span.name for span in tracer.spans] == STAGES + [
+        "nacl.handler",
+        "nacl.request",
+    ]
+    assert await client.send("/echo", "again") == "again"
+
+    spans = {span.name: span for span in list(tracer.spans)[6:]}
+    assert spans["nacl.key_lookup"].attributes == {"nacl.cache_hit": True}
+    assert spans["nacl.decrypt"].attributes["nacl.plaintext_size"] == len('"again"')
+    assert spans["nacl.request"].attributes["http.target"] == "/echo"
+    assert list(tracer.spans)[1].attributes == {"nacl.cache_hit": False}
+    assert len(tracer.durations("nacl.request")) == 2
+
+    params = client.params("tampered")
+    params["encryptedMessage"] = "A" * len(params["encryptedMessage"])
+    response = await client.client.get("/echo", params=params)
+    assert response.status == 401
+    assert tracer.spans[-1].attributes["nacl.rejected"] is True
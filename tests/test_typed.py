@@ -0,0 +1,189 @@
+from dataclasses import asdict, dataclass, field
+from typing import List, Literal, Optional, TypedDict
+from urllib.parse import urlencode
+
+from aiohttp.web import Application, Request, Response
+from pytest import importorskip, raises
+
+from nacl_middleware import MailBox, Nacl, nacl_middleware
+from nacl_middleware.asgi import NaclASGIMiddleware
+from nacl_middleware.deadline import DeadlinePolicy, box_with_deadline
+from nacl_middleware.lazy import decrypted_message
+from nacl_middleware.typed import (
+    MessageDecoder,
+    MessageValidationError,
+    message_type,
+    to_builtins,
+)
+from tests.utils import run
+
+
+@dataclass
+class Item:
+    sku: str
+    quantity: int = 1
+
+
+@dataclass
+class Order:
+    id: int
+    items: List[Item]
+    note: Optional[str] = None
+    kind: Literal["retail", "wholesale"] = "retail"
+    parts: List["Order"] = field(default_factory=list)
+
+
+class Point(TypedDict, total=False):
+    x: float
+    y: float
+
+
+def test_compiled_decoder() -> None:
+    decoder = MessageDecoder(Order, use_msgspec=False)
+    order = decoder.decode(
+        b'{"id": 1, "items": [{"sku": "a"}], "extra": 0, "parts": [{"id": 2, "items": []}]}'
+    )
+    assert order == Order(1, [Item("a")], parts=[Order(2, [])])
+    assert decoder.convert(asdict(order)) == order
+    assert MessageDecoder(Point, use_msgspec=False).decode(b'{"x": 1}') == {"x": 1.0}
+
+    for plaintext, error in [
+        (b'{"id": true, "items": []}', "Expected `int`, got `bool` - at `$.id`"),
+        (b'{"items": []}', "Object missing required field `id` - at `$`"),
+        (b'{"id": 1, "items": [{"sku": 2}]}', "at `$.items[0].sku`"),
+        (b'{"id": 1, "items": [], "kind": "other"}', "at `$.kind`"),
+        (b"[1]", "Expected `object`, got `list`"),
+    ]:
+        with raises(MessageValidationError) as e:
+            decoder.decode(plaintext)
+        assert error in str(e.value)
+    with raises(ValueError):
+        decoder.decode(b"{")
+    with raises(TypeError):
+        MessageDecoder(set, use_msgspec=False)
+
+
+def test_msgspec_decoder() -> None:
+    msgspec = importorskip("msgspec")
+
+    class Message(msgspec.Struct):
+        text: str
+        count: int = 0
+
+    decoder = MessageDecoder(Message)
+    assert decoder.uses_msgspec
+    assert decoder.decode(b'{"text": "hi"}') == Message("hi")
+    assert to_builtins(Message("hi")) == {"text": "hi", "count": 0}
+    assert MessageDecoder(Order).decode(b'{"id": 1, "items": []}') == Order(1, [])
+    with raises(MessageValidationError):
+        decoder.decode(b'{"count": 1}')
+    with raises(MessageValidationError):
+        decoder.convert({"text": 1})
+
+
+async def test_middleware_decodes_the_declared_types(
+    nacl_client, nacl_server_keys, nacl_client_keys
+) -> None:
+    async def order_handler(request: Request) -> Response:
+        order: Order = request["decrypted_message"]
+        return Response(text=request["mail_box"].box([order.id, len(order.items)]))
+
+    @message_type(Point)
+    async def point_handler(request: Request) -> Response:
+        point: Point = request["decrypted_message"]
+        return Response(text=request["mail_box"].box(point))
+
+    app = Application(
+        middlewares=[nacl_middleware(nacl_server_keys.private_key, message_type=Order)]
+    )
+    app.router.add_get("/order", order_handler)
+    app.router.add_get("/point", point_handler)
+    client = await nacl_client(app, keys=nacl_client_keys)
+
+    assert await client.send("/order", {"id": 3, "items": [{"sku": "a"}]}) == [3, 1]
+    assert await client.send("/point", {"x": 1, "y": 2.5}) == {"x": 1.0, "y": 2.5}
+
+    response = await client.get("/order", {"id": "3", "items": []})
+    assert response.status == 400
+    assert "at `$.id`" in await response.text()
+    response = await client.get("/point", {"x": "left"})
+    assert response.status == 400
+    response = await client.client.get(
+        "/order", params={"publicKey": "00", "encryptedMessage": "00"}
+    )
+    assert response.status == 401
+
+
+async def test_lazy_and_deadline_messages_are_decoded(
+    nacl_client, nacl_server_keys, nacl_client_keys
+) -> None:
+    async def handler(request: Request) -> Response:
+        item: Item = decrypted_message(request)
+        return Response(text=request["mail_box"].box(item.sku))
+
+    lazy_app = Application(
+        middlewares=[
+            nacl_middleware(nacl_server_keys.private_key, lazy=True, message_type=Item)
+        ]
+    )
+    lazy_app.router.add_get("/item", handler)
+    client = await nacl_client(lazy_app, keys=nacl_client_keys)
+    assert await client.send("/item", {"sku": "lazy"}) == "lazy"
+    assert (await client.get("/item", {"quantity": 1})).status == 400
+
+    deadline_app = Application(
+        middlewares=[
+            nacl_middleware(
+                nacl_server_keys.private_key,
+                deadlines=DeadlinePolicy(),
+                message_type=Item,
+            )
+        ]
+    )
+    deadline_app.router.add_get("/item", handler)
+    client = await nacl_client(deadline_app, keys=nacl_client_keys)
+    for message, status in [({"sku": "boxed"}, 200), ({"sku": 1}, 400)]:
+        encrypted_message, headers = box_with_deadline(client.mail_box, message, 5.0)
+        response = await client.client.get(
+            "/item",
+            params={
+                "publicKey": nacl_client_keys.decoded_public_key(),
+                "encryptedMessage": encrypted_message,
+            },
+            headers=headers,
+        )
+        assert response.status == status
+
+
+def test_asgi_rejects_invalid_messages() -> None:
+    server = Nacl()
+    client = Nacl()
+    mail_box = MailBox(client.private_key, server.decoded_public_key())
+    received = []
+
+    async def app(scope, receive, send) -> None:
+        received.append(scope["state"]["decrypted_message"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = NaclASGIMiddleware(app, server.private_key, message_type=Item)
+
+    def status(message: any) -> int:
+        sent = []
+
+        async def send(event: dict) -> None:
+            sent.append(event)
+
+        query = urlencode(
+            {
+                "publicKey": client.decoded_public_key(),
+                "encryptedMessage": mail_box.box(message),
+            }
+        )
+        scope = {"type": "http", "path": "/", "query_string": query.encode()}
+        run(middleware({"headers": [], **scope}, None, send))
+        return sent[0]["status"]
+
+    assert status({"sku": "a", "quantity": 2}) == 200
+    assert status({"sku": "a", "quantity": "2"}) == 400
+    assert received == [Item("a", 2)]
@@ -0,0 +1,38 @@
+from pytest import mark, raises
+
+from nacl_middleware import MailBox, Nacl
+from nacl_middleware.utils import validate_encrypted_message
+
+server = Nacl()
+client = Nacl()
+mail_box = MailBox(client.private_key, server.decoded_public_key())
+
+
+def test_validate_accepts_boxed_message() -> None:
+    """
+    A message produced by MailBox.box passes validation within its limits.
+    """
+    encrypted_message = mail_box.box("x" * 100)
+    validate_encrypted_message(encrypted_message, len(encrypted_message), 102)
+
+
+@mark.parametrize(
+    "encrypted_message, max_ciphertext_size, max_plaintext_size",
+    [
+        ("A" * 52, None, None),
+        ("A" * 57, None, None),
+        ("A" * 55 + "*", None, None),
+        (mail_box.box("x" * 100), 100, None),
+        (mail_box.box("x" * 100), None, 101),
+    ],
+)
+def test_validate_rejects(
+    encrypted_message: str, max_ciphertext_size: int, max_plaintext_size: int
+) -> None:
+    """
+    Short, misaligned, non base64 and oversized messages are rejected.
+    """
+    with raises(ValueError):
+        validate_encrypted_message(
+            encrypted_message, max_ciphertext_size, max_plaintext_size
+        )
@@ -0,0 +1,22 @@
+from asyncio import new_event_loop
+from collections.abc import Coroutine
+
+
+def run(coroutine: Coroutine) -> any:
+    """
+    Runs a coroutine to completion in a private event loop.
+
+    Unlike asyncio.run, the global event loop is left untouched, so tests relying on
+    get_event_loop keep working.
+
+    Args:
+        coroutine (Coroutine): The coroutine to run.
+
+    Returns:
+        any: The result of the coroutine.
+    """
+    loop = new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()